@@ -22,13 +22,18 @@ from __future__ import unicode_literals
 
 import datetime
 import json
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import time
+from urlparse import urlparse
 
 import requests
+import requests.adapters
 from requests.exceptions import RequestException
 
 from backend.romeo import fetch_journal
 from backend.romeo import fetch_publisher
-from backend.utils import urlopen_retry
 from dissemin.settings import DOI_PROXY_DOMAIN
 from dissemin.settings import DOI_PROXY_SUPPORTS_BATCH
 from django.db import DataError
@@ -40,6 +45,7 @@ from papers.doi import doi_to_crossref_identifier
 from papers.doi import doi_to_url
 from papers.doi import to_doi
 from papers.errors import MetadataSourceException
+from papers.models import DoiMetadata
 from papers.models import OaiSource
 from papers.name import normalize_name_words
 from papers.name import parse_comma_name
@@ -95,6 +101,11 @@ nb_results_per_request = 100
 max_crossref_batches_per_researcher = 10
 # Maximum timeout for the CrossRef interface (sometimes it is a bit lazy)
 crossref_timeout = 15
+# Maximum number of concurrent requests sent by a CrossRefClient
+crossref_concurrency = 4
+# Maximum number of requests per second sent to the same host
+# (CrossRef and the DOI proxy), unless the host announces its own limit
+max_requests_per_second_per_host = 10
 
 
 # Licenses considered OA, as stored by CrossRef
@@ -269,6 +280,118 @@ def _create_publication(paper, metadata):
     paper.update_availability()
     return paper, rec
 
+# HTTP client
+
+
+class HostRateLimiter(object):
+    """
+    Spaces out the requests sent to each host, so that no more than
+    a given number of requests per second are sent to the same host.
+    This is shared between threads.
+    """
+
+    def __init__(self, requests_per_second):
+        self.default_interval = 1. / requests_per_second
+        self.intervals = {}
+        self.next_slots = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        """
+        Blocks until a request can be sent to this host.
+        """
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slots.get(host, now))
+            self.next_slots[host] = slot + self.intervals.get(
+                host, self.default_interval)
+        if slot > now:
+            time.sleep(slot - now)
+
+    def update_from_headers(self, host, headers):
+        """
+        Adapts the rate for a host to the limit it announces
+        (as CrossRef does with the `X-Rate-Limit-Limit` and
+        `X-Rate-Limit-Interval` headers).
+        """
+        try:
+            limit = int(headers['X-Rate-Limit-Limit'])
+            interval = float(headers['X-Rate-Limit-Interval'].rstrip('s'))
+        except (KeyError, ValueError):
+            return
+        if limit > 0:
+            with self.lock:
+                self.intervals[host] = max(
+                    interval / limit, self.default_interval)
+
+
+class CrossRefClient(object):
+    """
+    HTTP client for CrossRef and the DOI proxy. Connections are kept
+    alive in a pool, requests to each host are rate-limited, and
+    independent requests can be run concurrently with :meth:`map`.
+    """
+
+    def __init__(self, concurrency=crossref_concurrency,
+                 requests_per_second=max_requests_per_second_per_host):
+        self.concurrency = concurrency
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request with the pooled session, once the rate limit
+        of the host allows it.
+        """
+        host = urlparse(url).netloc
+        kwargs.setdefault('timeout', crossref_timeout)
+        self.rate_limiter.wait(host)
+        response = self.session.request(method, url, **kwargs)
+        self.rate_limiter.update_from_headers(host, response.headers)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def map(self, func, items):
+        """
+        Calls `func` on each item, running at most `concurrency` calls
+        at the same time (in threads).
+
+        :returns: the list of results, in the same order as the items
+        """
+        items = list(items)
+        if len(items) <= 1 or self.concurrency <= 1:
+            return map(func, items)
+        pool = ThreadPool(min(self.concurrency, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+
+_client = None
+_client_pid = None
+
+
+def get_crossref_client():
+    """
+    The :class:`CrossRefClient` of the current process (sessions
+    cannot be shared between processes, for instance Celery workers).
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = CrossRefClient()
+        _client_pid = os.getpid()
+    return _client
+
 # Fetching utilities
 
 
@@ -280,15 +403,29 @@ def fetch_metadata_by_DOI(doi):
     """
     if doi is None:
         return
+    found, metadata = DoiMetadata.get(doi)
+    if found:
+        if metadata is None:
+            raise MetadataSourceException('Error while fetching DOI metadata:\n' +
+                                          'No metadata found (cached).')
+        return metadata
+
     addheaders = {'Accept': 'application/citeproc+json'}
     try:
-        request = 'http://'+DOI_PROXY_DOMAIN+'/'+doi
-        response = urlopen_retry(request,
-                                 timeout=crossref_timeout,
-                                 headers=addheaders,
-                                 retries=0)
-        parsed = json.loads(response)
+        response = get_crossref_client().get(
+            'http://'+DOI_PROXY_DOMAIN+'/'+doi, headers=addheaders)
+        if response.status_code == 404:
+            # Only a definite answer is cached, not transient errors
+            DoiMetadata.set(doi, None)
+            raise MetadataSourceException('Error while fetching DOI metadata:\n' +
+                                          'No metadata found.')
+        response.raise_for_status()
+        parsed = response.json()
+        DoiMetadata.set(doi, parsed)
         return parsed
+    except RequestException as e:
+        raise MetadataSourceException('Error while fetching DOI metadata:\n' +
+                                      'Error: '+str(e))
     except ValueError as e:
         raise MetadataSourceException('Error while fetching DOI metadata:\nInvalid JSON response.\n' +
                                       'Error: '+str(e))
@@ -324,42 +461,65 @@ def fetch_dois_by_batch(doi_list):
     """
     Fetch a list of DOIs by batch (useful when refreshing the list of publications
     of a given researcher, as the records have most likely been already cached before
-    by the proxy)
+    by the proxy). DOIs found in the local cache (:class:`DoiMetadata`)
+    are not fetched again. The others are fetched concurrently, by batches
+    of :py:data:`nb_results_per_request` DOIs.
+    """
+    cached = DoiMetadata.get_many(doi_list)
+    missing_dois = list(set(doi for doi in doi_list if doi not in cached))
+    batches = [missing_dois[i:i+nb_results_per_request]
+               for i in range(0, len(missing_dois), nb_results_per_request)]
+    results = get_crossref_client().map(fetch_doi_batch, batches)
+
+    fetched = {}
+    for batch, batch_results in zip(batches, results):
+        if len(batch_results) == len(batch):
+            fetched.update(zip(batch, batch_results))
+    # DOIs missing from the results are not cached: they may just be
+    # unknown to the batch endpoints
+    DoiMetadata.set_many({doi: metadata for doi, metadata in fetched.items()
+                          if metadata is not None})
+
+    return [cached[doi] if doi in cached else fetched.get(doi)
+            for doi in doi_list]
+
+
+def fetch_doi_batch(doi_list):
+    """
+    Fetch a batch of at most :py:data:`nb_results_per_request` DOIs
+    (see :func:`fetch_dois_by_batch`).
     """
     def results_list_to_dict(results):
         dct = {}
         for item in results:
             if item and 'DOI' in item:
-                dct[item['DOI']] = item
+                dct[item['DOI'].lower()] = item
         return dct
 
     if len(doi_list) == 0:
         return []
-    elif len(doi_list) > nb_results_per_request:
-        first_dois = fetch_dois_by_batch(doi_list[:nb_results_per_request])
-        last_dois = fetch_dois_by_batch(doi_list[nb_results_per_request:])
-        return first_dois + last_dois
 
+    client = get_crossref_client()
     params = {'filter': ','.join(['doi:'+doi for doi in doi_list])}
     req = None
     try:
         # First we fetch dois by batch from CrossRef. That's fast, but only
         # works for CrossRef DOIs
-        req = requests.get('http://api.crossref.org/works', params=params)
+        req = client.get('http://api.crossref.org/works', params=params)
         req.raise_for_status()
         results = req.json()['message'].get('items', [])
         dct = results_list_to_dict(results)
 
         # Some DOIs might not be in the results list, because they are issued by other organizations
         # We fetch them using our proxy (cached content negociation)
-        missing_dois = list(set(doi_list) - set(dct.keys()))
-        req = requests.post('http://'+DOI_PROXY_DOMAIN +
-                            '/batch', {'dois': json.dumps(missing_dois)})
+        missing_dois = [doi for doi in set(doi_list) if doi.lower() not in dct]
+        req = client.post('http://'+DOI_PROXY_DOMAIN +
+                          '/batch', data={'dois': json.dumps(missing_dois)})
         req.raise_for_status()
         missing_dois_dct = results_list_to_dict(req.json())
         dct.update(missing_dois_dct)
 
-        result = [dct.get(doi) for doi in doi_list]
+        result = [dct.get(doi.lower()) for doi in doi_list]
         return result
     except RequestException as e:
         raise MetadataSourceException(
@@ -488,24 +648,25 @@ class CrossRefAPI(object):
             params['filter'] = ','.join(map(lambda (k, v): k+":"+v, filters.items()))
 
         url = 'http://api.crossref.org/works'
+        client = get_crossref_client()
 
+        # Deep paging with cursors: each page gives the cursor of the next one
         count = 0
-        rows = 20
-        offset = 0
+        params['rows'] = nb_results_per_request
+        params['cursor'] = '*'
         while not max_batches or count < max_batches:
-            params['rows'] = rows
-            params['offset'] = offset
-
             try:
-                r = requests.get(url, params=params)
+                r = client.get(url, params=params)
                 print "CROSSREF: "+r.url
                 js = r.json()
                 found = False
                 for item in jpath('message/items', js, default=[]):
                     found = True
                     yield item
-                if not found:
+                next_cursor = jpath('message/next-cursor', js)
+                if not found or not next_cursor:
                     break
+                params['cursor'] = next_cursor
             except ValueError as e:
                 raise MetadataSourceException('Error while fetching CrossRef results:\nInvalid response.\n' +
                                               'URL was: %s\nParameters were: %s\nJSON parser error was: %s' % (url, urlencode(params), unicode(e)))
@@ -513,7 +674,6 @@ class CrossRefAPI(object):
                 raise MetadataSourceException('Error while fetching CrossRef results:\nUnable to open the URL: ' +
                                               url+'\nError was: '+str(e))
 
-            offset += rows
             count += 1
 
 
@@ -524,10 +684,31 @@ def fetch_zotero_by_DOI(doi):
     Fetch Zotero metadata for a given DOI.
     Works only with the doi_cache proxy.
     """
+    found, metadata = DoiMetadata.get(doi, kind='zotero')
+    if found:
+        if metadata is None:
+            raise MetadataSourceException('Error while fetching Zotero metadata:\n' +
+                                          'No metadata found (cached).')
+        return metadata
+
     try:
         print('http://'+DOI_PROXY_DOMAIN+'/zotero/'+doi)
-        request = requests.get('http://'+DOI_PROXY_DOMAIN+'/zotero/'+doi)
-        return request.json()
+        request = get_crossref_client().get(
+            'http://'+DOI_PROXY_DOMAIN+'/zotero/'+doi)
+        metadata = None
+        if request.status_code != 404:
+            request.raise_for_status()
+            metadata = request.json()
+        if not metadata:
+            # Only a definite answer is cached, not transient errors
+            DoiMetadata.set(doi, None, kind='zotero')
+            raise MetadataSourceException('Error while fetching Zotero metadata:\n' +
+                                          'No metadata found.')
+        DoiMetadata.set(doi, metadata, kind='zotero')
+        return metadata
+    except RequestException as e:
+        raise MetadataSourceException('Error while fetching Zotero metadata:\n' +
+                                      'Error: '+str(e))
     except ValueError as e:
         raise MetadataSourceException('Error while fetching Zotero metadata:\nInvalid JSON response.\n' +
                                       'Error: '+str(e))
@@ -537,7 +718,11 @@ def consolidate_publication(publi):
     """
     Fetches the abstract from Zotero and adds it to the publication if it succeeds.
     """
-    zotero = fetch_zotero_by_DOI(publi.doi)
+    try:
+        zotero = fetch_zotero_by_DOI(publi.doi)
+    except MetadataSourceException as e:
+        print e
+        return publi
     if zotero is None:
         return publi
     for item in zotero:
@@ -23,24 +23,42 @@ This module contains functions that are not normally needed
 to run the platform, but that can be useful during development,
 or to cleanup various things in the database.
 
-These functions are not integrated in the rest of the platform,
-so running them involves starting a Django shell ("python manage.py shell"),
-importing this module and running the function manually.
+These functions are not integrated in the rest of the platform.
+The long-running ones can be run with the management command of the
+same name (for instance "python manage.py recompute_fingerprints",
+see :class:`papers.management.base.MaintenanceCommand`). The others
+involve starting a Django shell ("python manage.py shell"), importing
+this module and running the function manually.
 """
 
 from __future__ import unicode_literals
 
-from collections import defaultdict
+from itertools import chain
+from itertools import groupby
+from multiprocessing import Pool
+from operator import itemgetter
+import time
 
 import backend.crossref
 from backend.romeo import fetch_publisher
 from backend.tasks import change_publisher_oa_status
+from bulk_update.helper import bulk_update
+from django.db import connection
+from django.db import connections
+from django.db import DatabaseError
+from django.db.models import Count
+from django.db.models import Max
+from django.db.models import Min
+from papers.fingerprint import create_paper_fingerprint
+from papers.fingerprint import create_paper_fingerprints
 from papers.models import Name
 from papers.models import NameVariant
 from papers.models import OaiRecord
 from papers.models import Paper
 from papers.models import Researcher
+from papers.name import unify_name_lists
 from papers.utils import sanitize_html
+from publishers.models import alias_resolver
 from publishers.models import AliasPublisher
 from publishers.models import Publisher
 
@@ -80,98 +98,366 @@ def merge_names(fro, to):
     fro.delete()
 
 
-def update_paper_statuses():
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def iterate_in_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE, fields=None,
+                      pk_range=None, label=None):
+    """
+    Iterates over a queryset by chunks of objects, ordered by primary key.
+    Each chunk is fetched by its own query, starting after the last
+    primary key of the previous chunk, so that the whole table is never
+    loaded in memory (unlike `queryset.all()`).
+
+    :param queryset: the queryset to iterate over
+    :param chunk_size: the maximum number of objects in each chunk
+    :param fields: if provided, only these fields are fetched
+    :param pk_range: if provided, a pair (min_pk, max_pk) restricting
+        the iteration to the objects whose primary key lies between these
+        bounds (inclusive)
+    :param label: if provided, the progress is printed after each chunk,
+        prefixed by this label
+    :returns: a generator of lists of objects
+    """
+    if fields:
+        queryset = queryset.only(*fields)
+    if pk_range:
+        queryset = queryset.filter(pk__gte=pk_range[0], pk__lte=pk_range[1])
+    queryset = queryset.order_by('pk')
+
+    processed = 0
+    last_pk = None
+    while True:
+        chunk_qs = queryset
+        if last_pk is not None:
+            chunk_qs = chunk_qs.filter(pk__gt=last_pk)
+        chunk = list(chunk_qs[:chunk_size].iterator())
+        if not chunk:
+            break
+        yield chunk
+        last_pk = chunk[-1].pk
+        processed += len(chunk)
+        if label:
+            print "%s: %d objects processed (last id: %d)" % (
+                label, processed, last_pk)
+
+
+def pk_ranges(queryset, nb_ranges):
+    """
+    Splits the primary keys of a queryset into contiguous ranges
+    of (roughly) the same width, suitable for the `pk_range` argument
+    of :func:`iterate_in_chunks`.
+
+    :returns: a list of at most nb_ranges pairs (min_pk, max_pk)
+    """
+    bounds = queryset.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+    min_pk, max_pk = bounds['min_pk'], bounds['max_pk']
+    if min_pk is None:
+        return []
+    width = max(1, (max_pk - min_pk + nb_ranges) // nb_ranges)
+    return [(lower, min(lower + width - 1, max_pk))
+            for lower in range(min_pk, max_pk + 1, width)]
+
+
+def _run_on_pk_range(args):
+    function, pk_range, kwargs = args
+    return function(pk_range=pk_range, **kwargs)
+
+
+def run_in_workers(function, queryset, nb_workers, **kwargs):
+    """
+    Runs a maintenance function (accepting a `pk_range` argument) on
+    disjoint ranges of primary keys of the queryset, in parallel
+    processes.
+    """
+    ranges = pk_ranges(queryset, nb_workers)
+    # Each process needs to open its own database connection
+    connections.close_all()
+    pool = Pool(nb_workers)
+    try:
+        pool.map(_run_on_pk_range,
+                 [(function, pk_range, kwargs) for pk_range in ranges],
+                 chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def update_paper_statuses(chunk_size=DEFAULT_CHUNK_SIZE, pk_range=None):
     """
     Should only be run if something went wrong,
     the backend is supposed to update the fields by itself
     """
-    papers = Paper.objects.all()
-    for p in papers:
-        p.update_availability()
+    for chunk in iterate_in_chunks(Paper.objects.all(), chunk_size,
+                                   fields=['id'], pk_range=pk_range,
+                                   label='update_paper_statuses'):
+        # iterate_in_chunks does not prefetch the records, so the chunk is
+        # reloaded by recompute_availability
+        Paper.recompute_availability([p.pk for p in chunk], chunk_size)
 
 
-def cleanup_titles():
+def cleanup_titles(chunk_size=DEFAULT_CHUNK_SIZE, pk_range=None):
     """
     Run HTML sanitizing on all the titles of the papers
     (this is normally done on creation of the papers, but
     not for old dumps of the database)
     """
-    papers = Paper.objects.all()
-    for p in papers:
-        p.title = sanitize_html(p.title)
-        p.save(update_fields=['title'])
-
-
-def cleanup_abstracts():
+    for chunk in iterate_in_chunks(Paper.objects.all(), chunk_size,
+                                   fields=['title'], pk_range=pk_range,
+                                   label='cleanup_titles'):
+        changed = []
+        for p in chunk:
+            new_title = sanitize_html(p.title)
+            if new_title != p.title:
+                p.title = new_title
+                changed.append(p)
+        if changed:
+            bulk_update(changed, update_fields=['title'])
+
+
+def cleanup_abstracts(chunk_size=DEFAULT_CHUNK_SIZE, pk_range=None):
     """
     Run HTML sanitizing on the abstracts
     (this is normally done on creation of the papers, but
     not for old dumps of the database)
     """
-    for p in OaiRecord.objects.all():
-        if p.description:
-            new_abstract = sanitize_html(p.description)
-            if new_abstract != p.description:
-                p.description = new_abstract
-                p.save()
-
-
-def recompute_fingerprints():
+    records = OaiRecord.objects.filter(description__isnull=False)
+    for chunk in iterate_in_chunks(records, chunk_size,
+                                   fields=['description'], pk_range=pk_range,
+                                   label='cleanup_abstracts'):
+        changed = []
+        for p in chunk:
+            if p.description:
+                new_abstract = sanitize_html(p.description)
+                if new_abstract != p.description:
+                    p.description = new_abstract
+                    changed.append(p)
+        if changed:
+            bulk_update(changed, update_fields=['description'])
+
+
+def recompute_fingerprints(chunk_size=DEFAULT_CHUNK_SIZE):
     """
     Recomputes the fingerprints of all papers, merging
     those who end up having the same fingerprint
     """
     merged = 0
-    for idx, p in enumerate(Paper.objects.all()):
-        if idx % 100 == 0:
-            print idx
-        p.fingerprint = 'blah'
-        match = p.recompute_fingerprint_and_merge_if_needed()
-        if match is not None:
-            merged += 1
+    for chunk in iterate_in_chunks(Paper.objects.all(), chunk_size,
+                                   fields=['title', 'authors_list', 'pubdate',
+                                           'fingerprint'],
+                                   label='recompute_fingerprints'):
+        fingerprints = create_paper_fingerprints(
+            (p.title, p.bare_author_names(), p.year) for p in chunk)
+        changed = [(p, fp) for p, fp in zip(chunk, fingerprints)
+                   if p.fingerprint != fp]
+
+        owners = {
+            match.fingerprint: match
+            for match in Paper.objects.filter(
+                fingerprint__in=[fp for p, fp in changed])
+        }
+        updated = []
+        for p, fp in changed:
+            match = owners.get(fp)
+            if match is None:
+                old_owner = owners.get(p.fingerprint)
+                if old_owner is not None and old_owner.pk == p.pk:
+                    del owners[p.fingerprint]
+                p.fingerprint = fp
+                owners[fp] = p
+                updated.append(p)
+            else:
+                match.merge(p)
+                merged += 1
+        if updated:
+            bulk_update(updated, update_fields=['fingerprint'])
     print "%d papers merged" % merged
 
 
-def find_collisions():
+def find_collisions(chunk_size=DEFAULT_CHUNK_SIZE):
     """
     Recomputes all the fingerprints and reports those which would be
-    merged by recompute_fingerprints()
+    merged by recompute_fingerprints(). The new fingerprints are written
+    to a temporary table, so that the colliding papers are streamed in
+    fingerprint order instead of being kept in memory.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TEMPORARY TABLE new_fingerprints '
+                       '(fingerprint varchar(64), paper_id integer)')
+        try:
+            for chunk in iterate_in_chunks(Paper.objects.all(), chunk_size,
+                                           fields=['title', 'authors_list', 'pubdate'],
+                                           label='find_collisions'):
+                fingerprints = create_paper_fingerprints(
+                    (p.title, p.bare_author_names(), p.year) for p in chunk)
+                values = []
+                for p, fp in zip(chunk, fingerprints):
+                    values += [fp, p.pk]
+                cursor.execute(
+                    'INSERT INTO new_fingerprints VALUES ' +
+                    ', '.join(['(%s, %s)']*len(chunk)), values)
+
+            cursor.execute(
+                'SELECT fingerprint, paper_id FROM new_fingerprints '
+                'WHERE fingerprint IN (SELECT fingerprint FROM new_fingerprints '
+                'GROUP BY fingerprint HAVING COUNT(*) > 1) '
+                'ORDER BY fingerprint, paper_id')
+            rows = chain.from_iterable(
+                iter(lambda: cursor.fetchmany(chunk_size), []))
+            for fp, group in groupby(rows, key=itemgetter(0)):
+                pks = [paper_id for _, paper_id in group]
+                first = True
+                for paper in Paper.objects.filter(pk__in=pks):
+                    if first:
+                        first = False
+                        print "### "+paper.plain_fingerprint()
+                    print paper.title
+                    print paper.bare_author_names()
+        finally:
+            try:
+                cursor.execute('DROP TABLE IF EXISTS new_fingerprints')
+            except DatabaseError:
+                # The transaction is aborted: rolling it back drops the
+                # table, and the original error is more useful
+                pass
+
+
+def check_researcher_links(chunk_size=DEFAULT_CHUNK_SIZE, pk_range=None,
+                           fix=False):
+    """
+    Checks that the `researchers` relation of papers is consistent with
+    the researcher ids stored in their `authors_list` (which is what
+    :attr:`Researcher.papers` relies on).
+
+    :param fix: if true, the relation is updated to match the
+        authors lists
+    :returns: the numbers of missing and extra links
     """
-    dct = defaultdict(set)
-    for p in Paper.objects.all():
-        fp = p.new_fingerprint()
-        dct[fp].add(p)
+    Link = Paper.researchers.through
+    nb_missing = 0
+    nb_extra = 0
+    for chunk in iterate_in_chunks(Paper.objects.all(), chunk_size,
+                                   fields=['authors_list'], pk_range=pk_range,
+                                   label='check_researcher_links'):
+        expected = set((p.pk, a['researcher_id'])
+                       for p in chunk for a in p.authors_list
+                       if a.get('researcher_id'))
+        existing = {(paper_id, researcher_id): link_id
+                    for link_id, paper_id, researcher_id in
+                    Link.objects.filter(paper_id__in=[p.pk for p in chunk]
+                                        ).values_list(
+                                            'id', 'paper_id', 'researcher_id')}
+        # authors_list can refer to deleted researchers
+        valid_researchers = set(Researcher.objects.filter(
+            pk__in=set(researcher_id for _, researcher_id in expected)
+            ).values_list('pk', flat=True))
+        missing = [link for link in expected
+                   if link not in existing and link[1] in valid_researchers]
+        extra = [link_id for link, link_id in existing.items()
+                 if link not in expected]
+        nb_missing += len(missing)
+        nb_extra += len(extra)
+
+        if fix:
+            Link.objects.bulk_create([
+                Link(paper_id=paper_id, researcher_id=researcher_id)
+                for paper_id, researcher_id in missing])
+            if extra:
+                Link.objects.filter(pk__in=extra).delete()
+
+    print "check_researcher_links: %d missing links, %d extra links" % (
+        nb_missing, nb_extra)
+    return nb_missing, nb_extra
+
+
+def benchmark_fingerprints(nb_papers=10000, processes=None):
+    """
+    Compares the batch fingerprinting (create_paper_fingerprints)
+    with the computation of fingerprints paper by paper, on the
+    first papers of the database. Both must yield the same results.
+    """
+    papers = [(p.title, p.bare_author_names(), p.year)
+              for p in Paper.objects.all()[:nb_papers]]
 
-    for fp, s in dct.items():
-        if len(s) > 1:
-            first = True
-            for paper in s:
-                if first:
-                    first = False
-                    print "### "+paper.plain_fingerprint()
-                print paper.title
-                print paper.bare_author_names()
+    start = time.time()
+    expected = [create_paper_fingerprint(*p) for p in papers]
+    sequential = time.time() - start
 
+    start = time.time()
+    fingerprints = create_paper_fingerprints(papers, processes=processes)
+    batch = time.time() - start
+
+    for paper, fp, expected_fp in zip(papers, fingerprints, expected):
+        if fp != expected_fp:
+            print "Fingerprint mismatch for %s" % paper[0]
+    print "%d papers: %.2fs sequentially, %.2fs in batch" % (
+        len(papers), sequential, batch)
 
-def create_publisher_aliases(erase_existing=True):
-    # TODO: this might be more efficient with aggregates?
-    counts = defaultdict(int)
-    for p in OaiRecord.objects.all():
-        if p.publisher_id:
-            pair = (p.publisher_name, p.publisher_id)
-            counts[pair] += 1
 
+def benchmark_unify_name_lists(nb_authors=3000, repeat=10):
+    """
+    Times :func:`unify_name_lists` on synthetic author lists of the
+    given size (as found in high-energy physics papers), with and
+    without its fast path: when the authors are unchanged, when one
+    author is added, when many authors are added and when an author
+    matching an existing one is added (which disables the fast path).
+    Both must yield the same results.
+    """
+    authors = [('%s %s.' % (first, chr(ord('A') + idx % 26)),
+                'Collaborator%d' % (idx // 3))
+               for idx, first in enumerate(
+                   ['Robin', 'Claire', 'Jean-Pierre'] * (nb_authors // 3))]
+    extended = authors + [('Anne', 'Newcomer')]
+    long_extension = authors + [('Anne', 'Newcomer%d' % idx)
+                                for idx in range(nb_authors // 2)]
+    related = authors + [('R.', 'Collaborator0')]
+
+    for label, new_authors in [('unchanged', authors),
+                               ('one added', extended),
+                               ('many added', long_extension),
+                               ('related added', related)]:
+        timings = []
+        results = []
+        for fast_path in [False, True]:
+            start = time.time()
+            for _ in range(repeat):
+                result = unify_name_lists(authors, new_authors,
+                                          fast_path=fast_path)
+            timings.append((time.time() - start) / repeat)
+            results.append(result)
+        if results[0] != results[1]:
+            print "Unified lists differ (%s)" % label
+        print "%d authors, %s: %.4fs without fast path, %.4fs with it" % (
+            len(authors), label, timings[0], timings[1])
+
+
+def create_publisher_aliases(erase_existing=True):
+    """
+    Creates an AliasPublisher for each pair of publisher name
+    and publisher found in the OaiRecords, counting how many times
+    each pair occurs.
+    """
+    counts = (OaiRecord.objects
+              .filter(publisher_id__isnull=False)
+              .values_list('publisher_name', 'publisher_id')
+              .annotate(count=Count('id'))
+              .order_by())
+
+    # The counts are recomputed from scratch, so the increments
+    # pending in this process would be counted twice
+    alias_resolver.clear()
     if erase_existing:
         AliasPublisher.objects.all().delete()
-
-    for (name, pk) in counts:
-        if not erase_existing:
-            alias = AliasPublisher.objects.get_or_create(
+        AliasPublisher.objects.bulk_create([
+            AliasPublisher(name=name, publisher_id=pk, count=count)
+            for name, pk, count in counts.iterator()
+        ], batch_size=DEFAULT_CHUNK_SIZE)
+    else:
+        for name, pk, count in counts.iterator():
+            alias, _ = AliasPublisher.objects.get_or_create(
                 name=name, publisher_id=pk)
-        else:
-            alias = AliasPublisher(name=name, publisher_id=pk)
-        alias.count = counts[(name, pk)]
-        alias.save()
+            alias.count = count
+            alias.save(update_fields=['count'])
 
 
 def refetch_publishers():
@@ -184,6 +470,7 @@ def refetch_publishers():
             p.publisher = publisher
             p.save(update_fields=['publisher'])
             p.paper.update_availability()
+    alias_resolver.flush()
 
 
 def refetch_containers():
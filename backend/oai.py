@@ -28,9 +28,12 @@ from backend.extractors import REGISTERED_OAI_EXTRACTORS
 from backend.papersource import PaperSource
 from backend.pubtype_translations import OAI_PUBTYPE_TRANSLATIONS
 from django.conf import settings
+from django.db import IntegrityError
 from django.db import transaction
+from django.utils import timezone
 from oaipmh import common
 from oaipmh.client import Client
+from oaipmh.error import BadResumptionTokenError
 from oaipmh.error import DatestampError
 from oaipmh.error import NoRecordsMatchError
 from oaipmh.metadata import base_dc_reader
@@ -41,6 +44,8 @@ from papers.baremodels import BareName
 from papers.baremodels import BareOaiRecord
 from papers.baremodels import BarePaper
 from papers.doi import to_doi
+from papers.models import OaiHarvestCheckpoint
+from papers.models import OaiRecord
 from papers.models import OaiSource
 from papers.models import Paper
 from papers.name import parse_comma_name
@@ -51,6 +56,67 @@ from papers.utils import valid_publication_date
 # Set exposed by proaixy to indicate the metadata source
 PROXY_SOURCE_PREFIX = "proaixy:source:"
 
+# Format used to pass datestamps to the harvesting tasks
+OAI_DATESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def split_date_range(from_date, until_date, nb_windows):
+    """
+    Splits the interval between two datetimes into `nb_windows`
+    contiguous windows of the same length, so that they can be
+    harvested independently.
+
+    As the OAI-PMH `from` and `until` arguments are inclusive,
+    records whose datestamp is exactly on the boundary between two
+    windows are harvested twice (this is harmless as ingestion is
+    idempotent).
+
+    :returns: the list of (start, end) pairs
+    """
+    if nb_windows < 1:
+        raise ValueError('At least one window is required')
+    if until_date <= from_date:
+        raise ValueError('Empty date range')
+    step = (until_date - from_date) / nb_windows
+    bounds = [from_date + i*step for i in range(nb_windows)] + [until_date]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def partitions_progress(group_result):
+    """
+    Returns the progress of the partitions of a harvest started
+    with :meth:`OaiPaperSource.parallel_ingest`: a list of dictionaries
+    (one per date window) with the `state` of the task, the number of
+    records `processed` so far and the `resumption_token` of the page
+    being processed.
+    """
+    progress = []
+    for result in group_result.results:
+        info = result.info if isinstance(result.info, dict) else {}
+        item = dict(info)
+        item['state'] = result.state
+        if result.successful():
+            item['processed'] = result.result
+        progress.append(item)
+    return progress
+
+
+class ResumableClient(Client):
+    """
+    A pyoai client that keeps track of the resumption token
+    used to fetch the page of records currently being harvested.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ResumableClient, self).__init__(*args, **kwargs)
+        #: The resumption token used to fetch the last page
+        #: (None for the first page of a harvest)
+        self.resumption_token = None
+
+    def makeRequest(self, **kwargs):
+        self.resumption_token = kwargs.get('resumptionToken')
+        return super(ResumableClient, self).makeRequest(**kwargs)
+
 
 class OaiTranslator(object):
     """
@@ -273,6 +339,15 @@ class BASEDCTranslator(OAIDCTranslator):
         return 'base_dc'
 
 
+#: Translators which can be instantiated by the harvesting workers,
+#: indexed by the metadata format they handle
+REGISTERED_OAI_TRANSLATORS = {
+        'oai_dc': OAIDCTranslator,
+        'base_dc': BASEDCTranslator,
+        'citeproc': CiteprocTranslator,
+        }
+
+
 class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSource
     """
     A paper source that fetches records from the OAI-PMH proxy
@@ -303,7 +378,9 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
         self.registry.registerReader('oai_dc', oai_dc_reader)
         self.registry.registerReader('base_dc', base_dc_reader)
         self.registry.registerReader('citeproc', citeproc_reader)
-        self.client = Client(endpoint, self.registry)
+        self.endpoint = endpoint
+        self.day_granularity = day_granularity
+        self.client = ResumableClient(endpoint, self.registry)
         self.client._day_granularity = day_granularity
         self.client.extra_parameters = {
             'key': settings.PROAIXY_API_KEY}
@@ -326,7 +403,8 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
     # Record ingestion
 
     def ingest(self, from_date=None, metadataPrefix='any',
-               resumptionToken=None):
+               resumptionToken=None, batch_size=None, until_date=None,
+               progress_callback=None, checkpoint=None):
         """
         Main method to fill Dissemin with papers!
 
@@ -334,12 +412,115 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
                           the proxy (useful for incremental fetching)
         :param metadataPrefix: restrict the ingest for this metadata
                           format
+        :param batch_size: save the papers by batches of that size
+                          (see :meth:`process_records`)
+        :param until_date: only fetch papers modified before that date
+        :param progress_callback: see :meth:`process_records`
+        :param checkpoint: an :class:`OaiHarvestCheckpoint` to update
+                          after each page of records, so that the harvest
+                          can be resumed with :meth:`resume`
+        :returns: the number of records processed
         """
+        if checkpoint is not None and until_date is not None:
+            checkpoint.until_date = timezone.make_aware(
+                until_date, timezone.utc)
+        if checkpoint is not None and resumptionToken is None:
+            # Records are not ordered by datestamp: until this harvest is
+            # complete, it can only be restarted from its beginning
+            checkpoint.last_datestamp = (
+                timezone.make_aware(from_date, timezone.utc)
+                if from_date is not None else None)
         records = self.client.listRecords(
                     metadataPrefix=metadataPrefix,
                     from_=from_date,
+                    until=until_date,
                     resumptionToken=resumptionToken)
-        self.process_records(records)
+        return self.process_records(records, batch_size=batch_size,
+                                    progress_callback=progress_callback,
+                                    checkpoint=checkpoint)
+
+    def get_checkpoint(self, metadataPrefix='any', partition=''):
+        """
+        Returns the :class:`OaiHarvestCheckpoint` for this endpoint
+        and metadata format (created if needed).
+        """
+        checkpoint, created = OaiHarvestCheckpoint.objects.get_or_create(
+            endpoint=self.endpoint,
+            metadata_prefix=metadataPrefix,
+            partition=partition)
+        return checkpoint
+
+    def resume(self, metadataPrefix='any', partition='', batch_size=None,
+               progress_callback=None):
+        """
+        Resumes the last harvest of this endpoint for the given metadata
+        format, from the page where it was interrupted. If the resumption
+        token has expired, the whole date range of the interrupted harvest
+        is harvested again (OAI-PMH does not order the records by datestamp,
+        so the pages not harvested yet can contain any datestamp). If the
+        last harvest was complete, we harvest from its highest datestamp.
+
+        :returns: the number of records processed
+        """
+        checkpoint = self.get_checkpoint(metadataPrefix, partition)
+        kwargs = {
+            'metadataPrefix': metadataPrefix,
+            'batch_size': batch_size,
+            'progress_callback': progress_callback,
+            'checkpoint': checkpoint,
+            }
+        if checkpoint.resumption_token:
+            try:
+                return self.ingest(
+                    resumptionToken=checkpoint.resumption_token, **kwargs)
+            except BadResumptionTokenError:
+                print("Resumption token expired, resuming from %s" %
+                      unicode(checkpoint.last_datestamp))
+
+        from_date = None
+        if checkpoint.last_datestamp:
+            from_date = timezone.make_naive(
+                checkpoint.last_datestamp, timezone.utc)
+        until_date = None
+        if checkpoint.until_date:
+            until_date = timezone.make_naive(
+                checkpoint.until_date, timezone.utc)
+        return self.ingest(from_date=from_date, until_date=until_date,
+                           **kwargs)
+
+    def parallel_ingest(self, from_date, until_date=None, nb_windows=8,
+                        metadataPrefix='any', batch_size=None):
+        """
+        Splits the harvest between `from_date` and `until_date` (default:
+        now) into `nb_windows` date windows, which are harvested in
+        parallel by Celery workers (one task per window). The translators
+        registered on this source have to be listed in
+        :data:`REGISTERED_OAI_TRANSLATORS`.
+
+        :returns: a Celery `GroupResult`, which can be passed to
+            :func:`partitions_progress` to monitor the harvest
+        """
+        from backend.tasks import ingest_oai_window
+        from celery import group
+
+        for fmt, translator in self.translators.items():
+            if REGISTERED_OAI_TRANSLATORS.get(fmt) != type(translator):
+                raise ValueError('The translator for %s cannot be used '
+                                 'by the harvesting workers' % fmt)
+
+        if until_date is None:
+            until_date = datetime.utcnow()
+        windows = split_date_range(from_date, until_date, nb_windows)
+        tasks = group(ingest_oai_window.s(
+                        endpoint=self.endpoint,
+                        from_date=start.strftime(OAI_DATESTAMP_FORMAT),
+                        until_date=end.strftime(OAI_DATESTAMP_FORMAT),
+                        formats=self.translators.keys(),
+                        metadataPrefix=metadataPrefix,
+                        day_granularity=self.day_granularity,
+                        batch_size=batch_size)
+                      for start, end in windows)
+        return tasks.apply_async()
 
     def create_paper_by_identifier(self, identifier, metadataPrefix):
         """
@@ -368,10 +549,10 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
         except NoRecordsMatchError:
             return []
 
-    def process_record(self, header, metadata):
+    def translate_record(self, header, metadata):
         """
-        Saves the record given by the header and metadata (as returned by
-        pyoai) into a Paper, or None if anything failed.
+        Translates the record given by the header and metadata (as returned
+        by pyoai) into a :class:`BarePaper`, or None if anything failed.
         """
         translator = self.translators.get(header.format())
         if translator is None:
@@ -379,20 +560,126 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
                   header.format())
             return
 
-        paper = translator.translate(header, metadata)
+        return translator.translate(header, metadata)
+
+    def process_record(self, header, metadata):
+        """
+        Saves the record given by the header and metadata (as returned by
+        pyoai) into a Paper, or None if anything failed.
+        """
+        paper = self.translate_record(header, metadata)
         if paper is not None:
+            return self.save_bare_paper(header, paper)
+
+    def save_bare_paper(self, header, paper):
+        """
+        Saves a translated :class:`BarePaper` in its own transaction,
+        merging it with any existing paper.
+        """
+        try:
+            with transaction.atomic():
+                saved = Paper.from_bare(paper)
+            return saved
+        except ValueError as e:
+            print "Ignoring invalid paper:"
+            print header.identifier()
+            print e
+
+    def process_batch(self, batch):
+        """
+        Saves a batch of translated papers. The fingerprints, identifiers
+        and DOIs of the whole batch are looked up with one query each:
+        papers which do not match anything are created in bulk, in a single
+        transaction. The other ones (which need to be merged with existing
+        papers or records) go through :meth:`save_bare_paper`, just like
+        in the unbatched mode.
+
+        Papers created in bulk skip the per-paper hooks of
+        :meth:`Paper.from_bare`: the statistics of the researchers,
+        departments, publishers and journals are not updated incrementally
+        (the periodic `reconcile_stats` task corrects them), and no
+        duplicate merging is attempted, since none of their keys matched
+        an existing paper or record. If another process saved one of
+        these keys in the meantime, the bulk creation fails with an
+        :class:`IntegrityError` and the whole batch is saved paper by paper
+        instead.
+
+        :param batch: a list of (header, :class:`BarePaper`) pairs
+        :returns: the number of papers created in bulk
+        """
+        fingerprints = set()
+        identifiers = set()
+        dois = set()
+        for header, paper in batch:
+            fingerprints.add(paper.fingerprint)
+            fingerprints.add(paper.new_fingerprint())
+            for record in paper.oairecords:
+                identifiers.add(record.identifier)
+                if record.doi:
+                    dois.add(record.doi)
+
+        if Paper.fingerprint_index is not None:
+            known_fingerprints = set(fp for fp in fingerprints
+                                     if fp in Paper.fingerprint_index)
+        else:
+            known_fingerprints = set(Paper.objects.filter(
+                fingerprint__in=fingerprints).values_list('fingerprint', flat=True))
+        known_identifiers = set(OaiRecord.objects.filter(
+            identifier__in=identifiers).values_list('identifier', flat=True))
+        known_dois = set(OaiRecord.objects.filter(
+            doi__in=dois).values_list('doi', flat=True))
+
+        fresh = []
+        to_merge = []
+        for header, paper in batch:
+            keys = [paper.fingerprint, paper.new_fingerprint()]
+            records = paper.oairecords
+            record_ids = [r.identifier for r in records]
+            record_dois = [r.doi for r in records if r.doi]
+            if (any(fp in known_fingerprints for fp in keys) or
+                    any(i in known_identifiers for i in record_ids) or
+                    any(doi in known_dois for doi in record_dois)):
+                to_merge.append((header, paper))
+                continue
+            # Later papers of the batch with the same keys will be merged
+            # with this one
+            known_fingerprints.update(keys)
+            known_identifiers.update(record_ids)
+            known_dois.update(record_dois)
+            fresh.append((header, paper))
+
+        created = 0
+        if fresh:
             try:
                 with transaction.atomic():
-                    saved = Paper.from_bare(paper)
-                return saved
-            except ValueError as e:
-                print "Ignoring invalid paper:"
-                print header.identifier()
+                    created = len(Paper.bulk_create_from_bare(
+                        [paper for header, paper in fresh]))
+            except (ValueError, IntegrityError) as e:
+                print "Bulk creation failed, saving papers one by one:"
                 print e
+                to_merge = fresh + to_merge
 
-    def process_records(self, listRecords):
+        for header, paper in to_merge:
+            self.save_bare_paper(header, paper)
+
+        return created
+
+    def process_records(self, listRecords, batch_size=None,
+                        progress_callback=None, checkpoint=None):
         """
         Save as :class:`Paper` all the records contained in this list
+
+        :param batch_size: if provided, translated papers are buffered
+            and saved by batches of that size using :meth:`process_batch`.
+            Otherwise, each record is saved as soon as it is translated.
+        :param progress_callback: a function called with the number of
+            records processed so far and the current resumption token,
+            every time the rate is reported and at the end of the harvest.
+        :param checkpoint: if provided, this :class:`OaiHarvestCheckpoint`
+            is saved every time a new page of records is reached (once
+            all the records of the previous page have been saved) and at
+            the end of the harvest.
+        :returns: the number of records processed
         """
         # check that we have at least one translator, otherwise
         # it's not really worth trying…
@@ -402,14 +689,40 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
 
         last_report = datetime.now()
         processed_since_report = 0
+        processed = 0
+        batch = []
+        page_token = None
+        last_datestamp = None
 
         for record in listRecords:
             header = record[0]
             metadata = record[1]._map
 
-            self.process_record(header, metadata)
+            # checkpointing
+            if checkpoint is not None:
+                if processed and self.client.resumption_token != page_token:
+                    if batch:
+                        self.process_batch(batch)
+                        batch = []
+                    self.save_checkpoint(checkpoint,
+                                         self.client.resumption_token)
+                page_token = self.client.resumption_token
+                if header.datestamp() and (last_datestamp is None or
+                                           header.datestamp() > last_datestamp):
+                    last_datestamp = header.datestamp()
+
+            if batch_size:
+                paper = self.translate_record(header, metadata)
+                if paper is not None:
+                    batch.append((header, paper))
+                if len(batch) >= batch_size:
+                    self.process_batch(batch)
+                    batch = []
+            else:
+                self.process_record(header, metadata)
 
             # rate reporting
+            processed += 1
             processed_since_report += 1
             if processed_since_report >= 1000:
                 td = datetime.now() - last_report
@@ -419,3 +732,29 @@ class OaiPaperSource(PaperSource):  # TODO: this should not inherit from PaperSo
                 print("current rate: %s records/s" % rate)
                 processed_since_report = 0
                 last_report = datetime.now()
+                if progress_callback:
+                    progress_callback(processed, self.client.resumption_token)
+
+        if batch:
+            self.process_batch(batch)
+        if checkpoint is not None:
+            self.save_checkpoint(checkpoint, None, last_datestamp)
+        if progress_callback:
+            progress_callback(processed, self.client.resumption_token)
+        return processed
+
+    def save_checkpoint(self, checkpoint, resumption_token, last_datestamp=None):
+        """
+        Records the progress of a harvest in the given checkpoint.
+
+        :param resumption_token: the token to fetch the first page not
+            processed yet (None when the harvest is complete)
+        :param last_datestamp: the (naive, UTC) datestamp from which the
+            next harvest can start. Only given once the harvest is
+            complete: the highest datestamp of its records.
+        """
+        checkpoint.resumption_token = resumption_token
+        if last_datestamp is not None:
+            checkpoint.last_datestamp = timezone.make_aware(
+                last_datestamp, timezone.utc)
+        checkpoint.save()
@@ -20,6 +20,9 @@
 
 from __future__ import unicode_literals
 
+import Queue
+import threading
+
 #from requests.exceptions import RequestException
 #import json, requests
 from backend.crossref import convert_to_name_pair
@@ -27,6 +30,7 @@ from backend.crossref import CrossRefAPI
 from backend.crossref import fetch_dois
 from backend.papersource import PaperSource
 from django.conf import settings
+from django.db import connection
 from notification.api import add_notification_for
 from notification.api import delete_notification_per_tag
 import notification.levels as notification_levels
@@ -292,6 +296,7 @@ class ORCIDDataPaper(object):
         except SkippedPaper as e:
             paper.skipped = True
             paper.skip_reason, = e.args
+            return paper
 
     def __repr__(self):
         return '<ORCIDDataPaper %s written by %s>' % (self.title, ', '.join(self.authors))
@@ -307,6 +312,173 @@ class ORCIDDataPaper(object):
         return self.__dict__
 
 
+#: Maximum number of fetched items waiting to be translated and saved
+orcid_pipeline_queue_size = 64
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+class OrcidFetchingPipeline(object):
+    """
+    Fetches everything needed to import an ORCID profile, in background
+    threads, so that the papers can be translated and saved while the
+    remaining metadata is still downloading:
+
+    - the ORCID profile (and its works),
+    - the CrossRef search results for this ORCID id,
+    - the metadata of the DOIs listed in the profile, once the CrossRef
+      search is over, so that DOIs already returned by the search are
+      not fetched again.
+
+    The fetched items are passed to the consumer through a bounded
+    queue, as pairs (kind, item), where kind is one of 'profile',
+    'work', 'search', 'doi', 'profile_error' or 'error'.
+    Translating and saving the papers is left to the consumer, as this
+    relies on its database connection.
+    """
+
+    def __init__(self, orcid_id, profile=None, use_doi=True,
+                 queue_size=orcid_pipeline_queue_size):
+        self.orcid_id = orcid_id
+        self.profile = profile
+        self.use_doi = use_doi
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.search_metadata = {}
+        self.threads = []
+        self.search_thread = None
+
+    def results(self):
+        """
+        Starts the fetching threads and yields the items they fetch,
+        as they arrive.
+        """
+        # If we are using the ORCID sandbox, then do not look for papers from CrossRef
+        # as the ORCID ids they contain are production ORCID ids (not fake
+        # ones).
+        if self.use_doi and settings.ORCID_BASE_DOMAIN == 'orcid.org':
+            self.search_thread = self.start_thread(self.fetch_crossref_search)
+        self.start_thread(self.fetch_profile)
+
+        nb_running = len(self.threads)
+        try:
+            while nb_running:
+                kind, item = self.queue.get()
+                if kind == 'done':
+                    nb_running -= 1
+                else:
+                    yield kind, item
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Stops the fetching threads (for instance when the consumer does
+        not need more papers).
+        """
+        self.stopped.set()
+
+    def start_thread(self, target):
+        def run():
+            try:
+                target()
+            except PipelineStopped:
+                pass
+            except Exception as e:
+                self.put('error', e, force=True)
+            finally:
+                # The thread may have used the database (DOI cache)
+                connection.close()
+                self.put('done', None, force=True)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        self.threads.append(thread)
+        thread.start()
+        return thread
+
+    def put(self, kind, item, force=False):
+        """
+        Puts an item in the queue, waiting for some room in it, unless
+        the consumer has stopped.
+        """
+        while force or not self.stopped.is_set():
+            try:
+                self.queue.put((kind, item), timeout=1)
+                return
+            except Queue.Full:
+                if force and self.stopped.is_set():
+                    return
+        raise PipelineStopped()
+
+    def fetch_crossref_search(self):
+        cr_api = CrossRefAPI()
+        for metadata in cr_api.search_for_dois_incrementally('', {'orcid': self.orcid_id}):
+            doi = to_doi(metadata.get('DOI') or '')
+            if doi:
+                self.search_metadata[doi] = metadata
+            self.put('search', metadata)
+
+    def fetch_profile(self):
+        try:
+            if self.profile is None:
+                profile = OrcidProfile(id=self.orcid_id)
+            else:
+                profile = OrcidProfile(json=self.profile)
+        except MetadataSourceException as e:
+            self.put('profile_error', e)
+            return
+        self.put('profile', profile)
+
+        # curl -H "Accept: application/orcid+json"
+        # 'http://pub.orcid.org/v1.2/0000-0002-8612-8827/orcid-works' -L -i
+        dois = []
+        pubs = jpath(
+            'orcid-profile/orcid-activities/orcid-works/orcid-work', profile, [])
+        for pub in pubs:
+            pub_dois = ORCIDMetadataExtractor(pub).dois()
+            if pub_dois and self.use_doi:
+                # We want to batch it rather than manually do it.
+                dois.extend(pub_dois)
+            else:
+                self.put('work', pub)
+
+        if not self.use_doi:
+            return
+
+        # DOIs returned by the CrossRef search do not need to be fetched again
+        if self.search_thread is not None:
+            self.search_thread.join()
+        dois_to_fetch = []
+        for doi in unique_dois(dois):
+            if doi in self.search_metadata:
+                self.put('doi', self.search_metadata[doi])
+            else:
+                dois_to_fetch.append(doi)
+
+        for metadata in fetch_dois(dois_to_fetch):
+            self.put('doi', metadata)
+
+
+def unique_dois(dois):
+    """
+    Removes duplicate DOIs from a list, keeping the order.
+
+    >>> unique_dois(['10.1000/A', '10.2000/b', '10.1000/a'])
+    [u'10.1000/a', u'10.2000/b']
+    """
+    seen = set()
+    result = []
+    for doi in dois:
+        doi = doi.lower()
+        if doi not in seen:
+            seen.add(doi)
+            result.append(doi)
+    return result
+
+
 class OrcidPaperSource(PaperSource):
 
     def fetch_papers(self, researcher):
@@ -358,37 +530,92 @@ class OrcidPaperSource(PaperSource):
             return
 
         for metadata in cr_api.search_for_dois_incrementally('', {'orcid': orcid_id}):
-            try:
-                paper = cr_api.save_doi_metadata(metadata)
-                if paper:
-                    yield True, paper
-                else:
-                    yield False, metadata
-            except ValueError as e:
-                print "Saving CrossRef record from ORCID failed: %s" % unicode(e)
+            result = self.translate_crossref_metadata(cr_api, metadata)
+            if result is not None:
+                yield result
+
+    def translate_crossref_metadata(self, cr_api, metadata):
+        """
+        Creates a paper from a CrossRef search result.
+
+        :returns: (True, paper) if it succeeds, (False, metadata) if the
+            metadata yields no paper, None if it is invalid.
+        """
+        try:
+            paper = cr_api.save_doi_metadata(metadata)
+            if paper:
+                return True, paper
+            else:
+                return False, metadata
+        except ValueError as e:
+            print "Saving CrossRef record from ORCID failed: %s" % unicode(e)
 
     def fetch_metadata_from_dois(self, cr_api, ref_name, orcid_id, dois):
         doi_metadata = fetch_dois(dois)
         for metadata in doi_metadata:
-            try:
-                authors = map(convert_to_name_pair, metadata['author'])
-                orcids = affiliate_author_with_orcid(
-                    ref_name, orcid_id, authors)
-                paper = cr_api.save_doi_metadata(metadata, orcids)
-                if not paper:
-                    yield False, metadata
-                    continue
-
-                record = BareOaiRecord(
-                        source=orcid_oai_source(),
-                        identifier='orcid:%s:%s' % (orcid_id, metadata['DOI']),
-                        splash_url='http://%s/%s' % (
-                            settings.ORCID_BASE_DOMAIN, orcid_id),
-                        pubtype=paper.doctype)
-                paper.add_oairecord(record)
-                yield True, paper
-            except (KeyError, ValueError, TypeError):
-                yield False, metadata
+            yield self.translate_doi_metadata(cr_api, ref_name, orcid_id, metadata)
+
+    def translate_doi_metadata(self, cr_api, ref_name, orcid_id, metadata):
+        """
+        Creates a paper from the metadata of a DOI listed in an ORCID
+        profile, and adds the ORCID record to it.
+
+        :returns: (True, paper) if it succeeds, (False, metadata) otherwise.
+        """
+        try:
+            authors = map(convert_to_name_pair, metadata['author'])
+            orcids = affiliate_author_with_orcid(
+                ref_name, orcid_id, authors)
+            paper = cr_api.save_doi_metadata(metadata, orcids)
+            if not paper:
+                return False, metadata
+
+            record = BareOaiRecord(
+                    source=orcid_oai_source(),
+                    identifier='orcid:%s:%s' % (orcid_id, metadata['DOI']),
+                    splash_url='http://%s/%s' % (
+                        settings.ORCID_BASE_DOMAIN, orcid_id),
+                    pubtype=paper.doctype)
+            paper.add_oairecord(record)
+            return True, paper
+        except (KeyError, ValueError, TypeError):
+            return False, metadata
+
+    def translate_orcid_work(self, ref_name, orcid_id, pub, ignored_papers):
+        """
+        Creates a paper from a work listed in an ORCID profile.
+
+        :param ignored_papers: the list where the work is added if its
+            metadata is incomplete
+        :returns: the paper, or None if it was ignored
+        """
+        data_paper = ORCIDDataPaper.from_orcid_metadata(
+            ref_name,
+            orcid_id,
+            pub
+        )
+
+        # If the paper is skipped due to invalid metadata.
+        # We first try to reconcile it with local researcher author name.
+        # Then, we consider it missed.
+        if data_paper.skipped:
+            print('%s is skipped due to incorrect metadata (%s)' %
+                  (data_paper, data_paper.skip_reason))
+
+            print('Trying to reconcile it with local researcher.')
+            data_paper = self.reconcile_paper(
+                ref_name,
+                orcid_id,
+                pub,
+                overrides={
+                    'authors': [(self.researcher.name.first, self.researcher.name.last)]
+                }
+            )
+            if data_paper.skipped:
+                ignored_papers.append(data_paper.as_dict())
+                return
+
+        return self.create_paper(data_paper)
 
     def warn_user_of_ignored_papers(self, ignored_papers):
         user = self.researcher.user
@@ -410,6 +637,10 @@ class OrcidPaperSource(PaperSource):
         Queries ORCiD to retrieve the publications associated with a given ORCiD.
         It also fetches such papers from the CrossRef search interface.
 
+        The ORCiD profile, the CrossRef search results and the DOI metadata
+        are fetched in background threads (see :class:`OrcidFetchingPipeline`),
+        so that papers are yielded as soon as their metadata is available.
+
         :param profile: The ORCID profile if it has already been fetched before (format: parsed JSON).
         :param use_doi: Fetch the publications by DOI when we find one (recommended, but slow)
         :returns: a generator, where all the papers found are yielded. (some of them could be in
@@ -422,81 +653,43 @@ class OrcidPaperSource(PaperSource):
         if orcid_id is None:
             raise MetadataSourceException('Invalid ORCiD identifier')
 
-        # Get ORCiD profile
-        try:
-            if profile is None:
-                profile = OrcidProfile(id=orcid_id)
-            else:
-                profile = OrcidProfile(json=profile)
-        except MetadataSourceException as e:
-            print e
-            return
-
-        # Reference name
-        ref_name = profile.name
-        # curl -H "Accept: application/orcid+json"
-        # 'http://pub.orcid.org/v1.2/0000-0002-8612-8827/orcid-works' -L -i
-        dois = []  # list of DOIs to fetch
+        ref_name = None  # reference name, from the profile
         ignored_papers = []  # list of ignored papers due to incomplete metadata
 
-        # Fetch publications (1st attempt with ORCiD data)
-        pubs = jpath(
-            'orcid-profile/orcid-activities/orcid-works/orcid-work', profile, [])
-        for pub in pubs:
-            data_paper = ORCIDDataPaper.from_orcid_metadata(
-                ref_name,
-                orcid_id,
-                pub,
-                stop_if_dois_exists=use_doi
-            )
-
-            if data_paper.dois and use_doi:  # We want to batch it rather than manually do it.
-                dois.extend(data_paper.dois)
-                continue
-
-            # If the paper is skipped due to invalid metadata.
-            # We first try to reconcile it with local researcher author name.
-            # Then, we consider it missed.
-            if data_paper.skipped:
-                print('%s is skipped due to incorrect metadata (%s)' %
-                      (data_paper, data_paper.skip_reason))
-
-                print('Trying to reconcile it with local researcher.')
-                data_paper = self.reconcile_paper(
-                    ref_name,
-                    orcid_id,
-                    pub,
-                    overrides={
-                        'authors': [(self.researcher.name.first, self.researcher.name.last)]
-                    }
-                )
-                if data_paper.skipped:
-                    ignored_papers.append(data_paper.as_dict())
-                    continue
-
-            yield self.create_paper(data_paper)
-
-        # 2nd attempt with DOIs and CrossRef
-        if use_doi:
-            # Let's grab papers from CrossRef
-            for success, paper_or_metadata in self.fetch_crossref_incrementally(cr_api, orcid_id):
-                if success:
-                    yield paper_or_metadata
-                else:
-                    ignored_papers.append(paper_or_metadata)
-                    print('This metadata (%s) yields no paper.' %
-                          (unicode(paper_or_metadata)))
-
-            # Let's grab papers with DOIs found in our ORCiD profile.
-            # FIXME(RaitoBezarius): if we fail here, we should get back the pub
-            # and yield it.
-            for success, paper_or_metadata in self.fetch_metadata_from_dois(cr_api, ref_name, orcid_id, dois):
-                if success:
-                    yield paper_or_metadata
+        pipeline = OrcidFetchingPipeline(orcid_id, profile, use_doi)
+        try:
+            for kind, item in pipeline.results():
+                if kind == 'profile_error':
+                    print item
+                    return
+                elif kind == 'error':
+                    raise item
+                elif kind == 'profile':
+                    ref_name = item.name
+                elif kind == 'work':
+                    paper = self.translate_orcid_work(
+                        ref_name, orcid_id, item, ignored_papers)
+                    if paper is not None:
+                        yield paper
                 else:
-                    ignored_papers.append(paper_or_metadata)
-                    print('This metadata (%s) yields no paper.' %
-                          (paper_or_metadata))
+                    if kind == 'search':
+                        result = self.translate_crossref_metadata(cr_api, item)
+                    else:
+                        # FIXME(RaitoBezarius): if we fail here, we should get back the pub
+                        # and yield it.
+                        result = self.translate_doi_metadata(
+                            cr_api, ref_name, orcid_id, item)
+                    if result is None:
+                        continue
+                    success, paper_or_metadata = result
+                    if success:
+                        yield paper_or_metadata
+                    else:
+                        ignored_papers.append(paper_or_metadata)
+                        print('This metadata (%s) yields no paper.' %
+                              (unicode(paper_or_metadata)))
+        finally:
+            pipeline.stop()
 
         self.warn_user_of_ignored_papers(ignored_papers)
         if ignored_papers:
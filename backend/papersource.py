@@ -20,8 +20,11 @@
 
 from __future__ import unicode_literals
 
-import haystack
+from collections import OrderedDict
+
 from papers.models import Paper
+from search.queue import mark_paper_dirty
+from search.queue import mark_papers_dirty
 
 
 class PaperSource(object):
@@ -57,22 +60,36 @@ class PaperSource(object):
         """
         return self.fetch_papers(researcher)
 
-    def fetch_and_save(self, researcher):
+    def fetch_and_save(self, researcher, batch=False, flush_every=None):
         """
         Fetch papers and save them to the database.
 
-        :param incremental: When set to true, papers are clustered
-            and commited one after the other. This is useful when
-            papers are fetched on the fly for an user.
+        :param batch: When set to true, the papers are saved as they are
+            fetched, but their attribution to the researcher and their
+            indexing are done for all of them at once, at the end
+            (see :meth:`attribute_papers`).
+        :param flush_every: In batch mode, also attribute and index the
+            papers saved so far every time this number of papers is reached,
+            so that they appear in the profile while fetching the others.
         """
         count = 0
+        pending = []
         for p in self.fetch_bare(researcher):
-            self.save_paper(p, researcher)
+            if batch:
+                pending.append(Paper.from_bare(p))
+                if flush_every and len(pending) >= flush_every:
+                    self.attribute_papers(pending, researcher)
+                    pending = []
+            else:
+                self.save_paper(p, researcher)
             if self.max_results is not None and count >= self.max_results:
                 break
 
             count += 1
 
+        if pending:
+            self.attribute_papers(pending, researcher)
+
     def save_paper(self, bare_paper, researcher):
         # Save the paper as non-bare
         p = Paper.from_bare(bare_paper)
@@ -80,18 +97,48 @@ class PaperSource(object):
         # Check whether this paper is associated with an ORCID id
         # for the target researcher
         if researcher.orcid:
-            for idx, a in enumerate(p.authors_list):
-                if a['orcid'] == researcher.orcid:
-                    p.authors_list[idx]['researcher_id'] = researcher.id
-                    p.researchers.add(researcher.id)
-                    self.update_empty_orcid(researcher, False)
+            if self.attribute_paper(p, researcher):
+                self.update_empty_orcid(researcher, False)
 
             p.save()
+            p.link_researchers()
             self.index_paper(p)
-            researcher.update_stats()
 
         return p
 
+    def attribute_paper(self, paper, researcher):
+        """
+        Sets the researcher of the authors of a paper which bear the ORCID
+        id of this researcher. The change is not saved.
+
+        :returns: True if some author was attributed to the researcher.
+        """
+        attributed = False
+        if researcher.orcid:
+            for idx, a in enumerate(paper.authors_list):
+                if a['orcid'] == researcher.orcid:
+                    paper.authors_list[idx]['researcher_id'] = researcher.id
+                    attributed = True
+        return attributed
+
+    def attribute_papers(self, papers, researcher):
+        """
+        Batch version of the end of :meth:`save_paper`: attributes
+        papers (already saved) to the researcher, updates the statistics
+        and queues the papers for indexing, with a constant number of
+        queries.
+        """
+        # A paper can be returned twice by the source: keep its last version
+        papers = OrderedDict((p.pk, p) for p in papers).values()
+
+        attributed = [p for p in papers if self.attribute_paper(p, researcher)]
+        if attributed:
+            Paper.bulk_save_authors(attributed)
+            Paper.bulk_link_researchers(attributed)
+            self.update_empty_orcid(researcher, False)
+
+        mark_papers_dirty([p.pk for p in papers])
+
     def update_empty_orcid(self, researcher, val):
         """
         Updates the empty_orcid_profile field of the provided :class:`Researcher` instance.
@@ -102,13 +149,6 @@ class PaperSource(object):
 
     def index_paper(self, paper):
         """
-        Updates a paper in the search index
+        Queues a paper for indexing (see :mod:`search.queue`)
         """
-        using_backends = haystack.connection_router.for_write(instance=paper)
-        for using in using_backends:
-            try:
-                index = haystack.connections[using].get_unified_index(
-                                        ).get_index(Paper)
-                index.update_object(paper, using=using)
-            except haystack.exceptions.NotHandled:
-                pass
+        mark_paper_dirty(paper.pk)
@@ -28,15 +28,20 @@ import requests.exceptions
 from backend.utils import cached_urlopen_retry
 from dissemin.settings import ROMEO_API_DOMAIN
 from dissemin.settings import ROMEO_API_KEY
+from dissemin.settings import ROMEO_LOCAL_MIRROR
+from django.db.models import Q
 import lxml.etree as ET
 from lxml.html import fromstring
 from papers.errors import MetadataSourceException
+from papers.name import LRUCache
 from papers.utils import kill_html
 from papers.utils import nstrip
 from papers.utils import remove_diacritics
 from papers.utils import sanitize_html
+from publishers.models import alias_resolver
 from publishers.models import AliasPublisher
 from publishers.models import Journal
+from publishers.models import journal_title_key
 from publishers.models import Publisher
 from publishers.models import PublisherCondition
 from publishers.models import PublisherCopyrightLink
@@ -52,6 +57,16 @@ PUBLISHER_NAME_ASSOCIATION_THRESHOLD = 32
 # and the second one
 PUBLISHER_NAME_ASSOCIATION_FACTOR = 5
 
+# Number of journals created at once when importing a RoMEO dump
+ROMEO_IMPORT_BATCH_SIZE = 1000
+
+# Number of search terms whose journal is remembered by fetch_journal
+JOURNAL_CACHE_SIZE = 4096
+
+#: Maps the search terms recently passed to :func:`fetch_journal`
+#: to the id of the journal they resolved to
+journal_cache = LRUCache(JOURNAL_CACHE_SIZE)
+
 
 def perform_romeo_query(search_terms):
     search_terms = search_terms.copy()
@@ -85,28 +100,158 @@ def perform_romeo_query(search_terms):
     return root
 
 
-def find_journal_in_model(search_terms):
+class JournalIndex(object):
+    """
+    An in-memory map from ISSNs (printed or electronic) and normalized titles
+    (see :func:`journal_title_key`) to the ids of the journals
+    we know about, so that journals can be resolved without scanning
+    the journal table (and without any query at all when they are unknown).
+    """
+
+    def __init__(self, journals=[]):
+        """
+        :param journals: an iterable of (id, issn, title, essn) tuples
+        """
+        self.by_issn = {}
+        self.by_title = {}
+        for pk, issn, title, essn in journals:
+            self.add(pk, issn, title, essn)
+
+    @classmethod
+    def load(cls):
+        """
+        Builds the index of all the journals stored in the database.
+        """
+        return cls(Journal.objects.values_list(
+            'id', 'issn', 'title', 'essn').iterator())
+
+    def add(self, pk, issn, title, essn=None):
+        if essn:
+            self.by_issn.setdefault(essn, pk)
+        if issn:
+            self.by_issn[issn] = pk
+        key = journal_title_key(title)
+        if key:
+            self.by_title.setdefault(key, pk)
+
+    def lookup(self, title=None, issn=None):
+        """
+        :returns: the id of the journal with that ISSN or, failing that,
+            with that title, or None if it is not in the index.
+        """
+        if issn and issn in self.by_issn:
+            return self.by_issn[issn]
+        key = journal_title_key(title)
+        if key:
+            return self.by_title.get(key)
+
+    def __len__(self):
+        return len(self.by_issn) + len(self.by_title)
+
+
+#: The index of the journals of the database, once loaded
+#: by :func:`load_journal_index`.
+journal_index = None
+
+
+def load_journal_index():
+    """
+    Loads the in-memory index of journals used by :func:`find_journal_in_model`
+    and :func:`resolve_journals`. Journals created afterwards by this process
+    are added to it.
+    """
+    global journal_index
+    journal_index = JournalIndex.load()
+    return journal_index
+
+
+def drop_journal_index():
+    global journal_index
+    journal_index = None
+
+
+def get_journal_index():
+    """
+    Returns the index of journals, loading it if needed.
+    """
+    return journal_index or load_journal_index()
+
+
+def find_journal_in_model(search_terms, use_index=True):
+    """
+    Looks up a journal in the model, by ISSN (printed or electronic) first
+    and then by normalized title (see :func:`journal_title_key`).
+
+    :param use_index: use the in-memory index of journals if it is
+        loaded. When disabled, the database is always queried.
+    """
     issn = search_terms.get('issn', None)
     title = search_terms.get('jtitle', None)
+
+    if use_index and ROMEO_LOCAL_MIRROR:
+        get_journal_index()
+    if use_index and journal_index is not None:
+        pk = journal_index.lookup(title, issn)
+        if pk is not None:
+            return Journal.objects.filter(pk=pk).first()
+        return
+
     # Look up the journal in the model
     # By ISSN
     if issn:
-        matches = Journal.objects.filter(issn=issn)
+        matches = Journal.objects.filter(Q(issn=issn) | Q(essn=issn))
         if matches:
             return matches[0]
 
     # By title
-    if title:
-        matches = Journal.objects.filter(title__iexact=title)
+    key = journal_title_key(title)
+    if key:
+        matches = Journal.objects.filter(title_key=key)
         if matches:
             return matches[0]
 
 
+def resolve_journals(pairs):
+    """
+    Resolves many journals at once against the journals we know about
+    (for instance those imported with :func:`import_romeo_dump`),
+    without querying RoMEO.
+
+    :param pairs: a list of (title, issn) pairs, where either
+        of the two values can be None
+    :returns: the list of the corresponding :class:`Journal` objects
+        (with their publishers), or None when no journal matches.
+    """
+    index = get_journal_index()
+    ids = [index.lookup(title, issn) for title, issn in pairs]
+    journals = Journal.objects.select_related('publisher').in_bulk(
+        set(pk for pk in ids if pk is not None))
+    return [journals.get(pk) for pk in ids]
+
+
 def fetch_journal(search_terms, matching_mode='exact'):
     """
     Fetch the journal data from RoMEO. Returns an Journal object.
     search_terms should be a dictionnary object containing at least one of these fields:
+    'issn', 'jtitle'.
+
+    The journals found for the last search terms are remembered
+    in :data:`journal_cache`.
     """
+    cache_key = (matching_mode,) + tuple(sorted(search_terms.items()))
+    pk = journal_cache.get(cache_key)
+    if pk is not None:
+        journal = Journal.objects.filter(pk=pk).first()
+        if journal:
+            return journal
+
+    journal = _fetch_journal(search_terms, matching_mode)
+    if journal:
+        journal_cache.set(cache_key, journal.pk)
+    return journal
+
+
+def _fetch_journal(search_terms, matching_mode):
     allowed_fields = ['issn', 'jtitle']
     terms = search_terms.copy()
     # Make the title HTML-safe before searching for it in the database or in
@@ -129,6 +274,8 @@ def fetch_journal(search_terms, matching_mode='exact'):
     journal = find_journal_in_model(terms)
     if journal:
         return journal
+    if ROMEO_LOCAL_MIRROR:
+        return None
 
     # Perform the query
     if matching_mode != 'exact':
@@ -160,10 +307,16 @@ def fetch_journal(search_terms, matching_mode='exact'):
         issn = nstrip(journal.findall('./issn')[0].text)
     except (KeyError, IndexError):
         pass
+    essn = nstrip(journal.findtext('./essn'))
 
     # Now we may have additional info, so it's worth trying again in the model
-    model_journal = find_journal_in_model({'issn': issn, 'jtitle': name})
+    # (bypassing the index, which can miss journals created by other processes)
+    model_journal = find_journal_in_model(
+        {'issn': issn, 'jtitle': name}, use_index=False)
     if model_journal:
+        if journal_index is not None:
+            journal_index.add(model_journal.pk, model_journal.issn,
+                              model_journal.title, model_journal.essn)
         return model_journal
 
     # Otherwise we need to find the publisher
@@ -176,8 +329,10 @@ def fetch_journal(search_terms, matching_mode='exact'):
 
     publisher = get_or_create_publisher(publisher_desc)
 
-    result = Journal(title=name, issn=issn, publisher=publisher)
+    result = Journal(title=name, issn=issn, essn=essn, publisher=publisher)
     result.save()
+    if journal_index is not None:
+        journal_index.add(result.pk, result.issn, result.title, result.essn)
     return result
 
 
@@ -192,24 +347,30 @@ def fetch_publisher(publisher_name):
 
     # Second, let's see if the publisher name has often been associated to a
     # known publisher
-    aliases = list(AliasPublisher.objects.filter(
-        name=publisher_name).order_by('-count')[:2])
+    # (the aliases are resolved in memory, see AliasResolver)
+    aliases = alias_resolver.most_common(publisher_name, 2)
+    publisher_id = None
     if len(aliases) == 1:
         # Only one publisher found. If it has been seen often enough under that name,
         # keep it!
-        if aliases[0].count > PUBLISHER_NAME_ASSOCIATION_THRESHOLD:
-            AliasPublisher.increment(publisher_name, aliases[0].publisher)
-            return aliases[0].publisher
+        if aliases[0][1] > PUBLISHER_NAME_ASSOCIATION_THRESHOLD:
+            publisher_id = aliases[0][0]
     elif len(aliases) == 2:
         # More than one publisher found (two aliases returned as we limited to the two first
         # results). Then we need to make sure the first one appears a lot more often than
         # the first
-        if (aliases[0].count > PUBLISHER_NAME_ASSOCIATION_THRESHOLD and
-                aliases[0].count > PUBLISHER_NAME_ASSOCIATION_FACTOR*aliases[1].count):
-            AliasPublisher.increment(publisher_name, aliases[0].publisher)
-            return aliases[0].publisher
+        if (aliases[0][1] > PUBLISHER_NAME_ASSOCIATION_THRESHOLD and
+                aliases[0][1] > PUBLISHER_NAME_ASSOCIATION_FACTOR*aliases[1][1]):
+            publisher_id = aliases[0][0]
+    if publisher_id is not None:
+        publisher = Publisher.objects.filter(pk=publisher_id).first()
+        if publisher:
+            AliasPublisher.increment(publisher_name, publisher)
+            return publisher
 
     # Otherwise, let's try to fetch the publisher from RoMEO!
+    if ROMEO_LOCAL_MIRROR:
+        return
 
     # Prepare the query
     search_terms = dict()
@@ -354,3 +515,58 @@ def addRestriction(xml, applies_to, publisher):
         r = PublisherRestrictionDetail(
             publisher=publisher, applies_to=applies_to, text=text)
         r.save()
+
+
+def import_romeo_dump(path):
+    """
+    Imports a dump of RoMEO into our publisher and journal tables,
+    so that journals can then be resolved locally (see the
+    ``ROMEO_LOCAL_MIRROR`` setting). The dump is an XML file in the format
+    of the API responses, with ``<journals>`` and ``<publishers>``
+    sections. Journals are linked to their publisher by its name
+    (``<romeopub>``) and the ones we already know are left untouched.
+
+    :param path: the path (or file object) of the dump
+    :returns: the number of journals created
+    """
+    journals = []
+    publishers = {}
+    for _, elem in ET.iterparse(path, events=('end',)):
+        if elem.tag == 'journal':
+            journals.append((nstrip(elem.findtext('jtitle')),
+                             nstrip(elem.findtext('issn')),
+                             nstrip(elem.findtext('essn')),
+                             nstrip(elem.findtext('romeopub'))))
+            elem.clear()
+        elif elem.tag == 'publisher':
+            try:
+                publisher = get_or_create_publisher(elem)
+                publishers.setdefault(publisher.name.lower(), publisher)
+            except MetadataSourceException as e:
+                print(e)
+            elem.clear()
+
+    index = load_journal_index()
+    pending = JournalIndex()
+    to_create = []
+    for title, issn, essn, publisher_name in journals:
+        if not title or len(title) > 256 or (issn and len(issn) > 10):
+            continue
+        if essn and len(essn) > 10:
+            essn = None
+        publisher = publishers.get((publisher_name or '').lower())
+        if (publisher is None or index.lookup(title, issn) is not None or
+                pending.lookup(title, issn) is not None):
+            continue
+        journal = Journal(title=kill_html(title), issn=issn, essn=essn,
+                          publisher=publisher)
+        # bulk_create does not call save(), which computes the title key
+        journal.title_key = journal_title_key(journal.title)
+        pending.add(len(to_create), issn, journal.title)
+        to_create.append(journal)
+
+    for i in range(0, len(to_create), ROMEO_IMPORT_BATCH_SIZE):
+        batch = to_create[i:i+ROMEO_IMPORT_BATCH_SIZE]
+        for journal in Journal.objects.bulk_create(batch):
+            index.add(journal.pk, journal.issn, journal.title, journal.essn)
+    return len(to_create)
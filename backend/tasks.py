@@ -26,10 +26,13 @@ from datetime import timedelta
 from statistics.models import AccessStatistics
 
 from backend.crossref import consolidate_publication
+from backend.oai import OaiPaperSource
+from backend.oai import REGISTERED_OAI_TRANSLATORS
 from backend.orcid import OrcidPaperSource
 from backend.utils import run_only_once
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from oaipmh.error import NoRecordsMatchError
 from django.utils import timezone
 from papers.errors import MetadataSourceException
 from papers.models import Department
@@ -37,8 +40,11 @@ from papers.models import Institution
 from papers.models import Paper
 from papers.models import PaperWorld
 from papers.models import Researcher
+from papers.utils import tolerant_datestamp_to_datetime
+from publishers.models import alias_resolver
 from publishers.models import Journal
 from publishers.models import Publisher
+import search.queue
 
 logger = get_task_logger(__name__)
 
@@ -84,7 +90,7 @@ def fetch_everything_for_researcher(pk):
     try:
         for key, source in sources:
             update_researcher_task(r, key)
-            source.fetch_and_save(r)
+            source.fetch_and_save(r, batch=True, flush_every=50)
         update_researcher_task(r, None)
 
     except MetadataSourceException as e:
@@ -95,6 +101,50 @@ def fetch_everything_for_researcher(pk):
         r.update_stats()
         r.harvester = None
         update_researcher_task(r, None)
+        alias_resolver.flush()
+
+
+@shared_task(name='ingest_oai_window', bind=True)
+def ingest_oai_window(self, endpoint, from_date, until_date, formats,
+                      metadataPrefix='any', day_granularity=False,
+                      batch_size=None):
+    """
+    Harvests the records modified between two datestamps from an OAI-PMH
+    endpoint. This is the unit of work of
+    :meth:`~backend.oai.OaiPaperSource.parallel_ingest`. The number of
+    records processed and the current resumption token are reported
+    in the state of the task. The progress is also saved in a checkpoint
+    whose partition is `from_date`, so that the window can be resumed
+    with :meth:`~backend.oai.OaiPaperSource.resume` if the task dies.
+
+    :param formats: the metadata formats to register translators for
+    :returns: the number of records processed
+    """
+    source = OaiPaperSource(endpoint, day_granularity=day_granularity)
+    for fmt in formats:
+        source.add_translator(REGISTERED_OAI_TRANSLATORS[fmt]())
+
+    def report_progress(processed, resumption_token):
+        self.update_state(state='PROGRESS', meta={
+            'from_date': from_date,
+            'until_date': until_date,
+            'processed': processed,
+            'resumption_token': resumption_token,
+            })
+
+    try:
+        return source.ingest(
+            from_date=tolerant_datestamp_to_datetime(from_date),
+            until_date=tolerant_datestamp_to_datetime(until_date),
+            metadataPrefix=metadataPrefix,
+            batch_size=batch_size,
+            progress_callback=report_progress,
+            checkpoint=source.get_checkpoint(metadataPrefix,
+                                             partition=from_date))
+    except NoRecordsMatchError:
+        return 0
+    finally:
+        alias_resolver.flush()
 
 
 @shared_task(name='change_publisher_oa_status')
@@ -104,6 +154,17 @@ def change_publisher_oa_status(pk, status):
     publisher.update_stats()
 
 
+@shared_task(name='flush_indexing_queue')
+@run_only_once('flush_indexing_queue', timeout=10*60)
+def flush_indexing_queue():
+    """
+    Reindexes the papers queued by :func:`search.queue.mark_paper_dirty`
+    """
+    processed = search.queue.flush_indexing_queue()
+    if processed:
+        logger.info('flush_indexing_queue: %d papers indexed' % processed)
+
+
 @shared_task(name='consolidate_paper')
 @run_only_once('consolidate_paper', keys=['pk'], timeout=1*60)
 def consolidate_paper(pk):
@@ -141,8 +202,24 @@ def update_all_stats_but_researchers():
     """
     AccessStatistics.update_all_stats(PaperWorld)
     AccessStatistics.update_all_stats(Publisher)
-    AccessStatistics.update_all_stats(Institution)
     AccessStatistics.update_all_stats(Department)
+    AccessStatistics.update_all_stats(Institution)
+
+
+@shared_task(name='reconcile_stats')
+@run_only_once('refresh_stats', timeout=60*60)
+def reconcile_stats():
+    """
+    Recomputes the statistics from scratch, to correct the drift of
+    the incremental updates (bulk operations bypass them). Departments
+    and institutions are summed from the researchers, so these are
+    reconciled first.
+    """
+    AccessStatistics.update_all_stats(PaperWorld)
+    for model in [Publisher, Journal, Researcher, Department, Institution]:
+        changed = AccessStatistics.update_all_stats(model)
+        logger.info('reconcile_stats: corrected the statistics of %d %s objects' %
+                    (changed, model.__name__))
 
 
 @shared_task(name='update_journal_stats')
@@ -21,19 +21,33 @@
 from __future__ import unicode_literals
 
 import datetime
+import time
 import unittest
 
+from backend.crossref import consolidate_publication
 from backend.crossref import convert_to_name_pair
 from backend.crossref import CrossRefAPI
+from backend.crossref import CrossRefClient
 from backend.crossref import DOI_PROXY_SUPPORTS_BATCH
+from backend.crossref import fetch_doi_batch
 from backend.crossref import fetch_dois_by_batch
 from backend.crossref import fetch_dois_incrementally
 from backend.crossref import fetch_metadata_by_DOI
+from backend.crossref import fetch_zotero_by_DOI
 from backend.crossref import get_publication_date
+from backend.crossref import HostRateLimiter
 from backend.crossref import is_oa_license
 from backend.crossref import parse_crossref_date
+from django.db import IntegrityError
 from django.test import TestCase
+from django.utils import timezone
+import mock
 from papers.errors import MetadataSourceException
+from papers.models import DoiMetadata
+from papers.models import OaiRecord
+from papers.models import Paper
+from papers.models import shorten_url
+from requests.exceptions import HTTPError
 
 
 class CrossRefTest(TestCase):
@@ -92,8 +106,105 @@ class CrossRefTest(TestCase):
         self.assertTrue(p.is_orphan())
         self.assertFalse(p.visible)
 
+    def test_consolidate_publication_short_urls(self):
+        p = Paper.from_bare(self.api.create_paper_by_doi('10.4204/eptcs.172.16'))
+        publi = p.publications[0]
+        pdf_url = 'http://my.repository.edu/consolidated.pdf'
+        zotero = [{'attachments': [{'mimeType': 'application/pdf',
+                                    'url': pdf_url}]}]
+        with mock.patch('backend.crossref.fetch_zotero_by_DOI',
+                        return_value=zotero):
+            consolidate_publication(publi)
+        saved = OaiRecord.objects.get(pk=publi.pk)
+        self.assertEqual(saved.pdf_url, pdf_url)
+        self.assertEqual(saved.short_pdf_url, shorten_url(pdf_url))
 
-class CrossRefUnitTest(unittest.TestCase):
+    def test_cached_metadata(self):
+        doi = '10.1000/cached.doi'
+        DoiMetadata.set(doi, {'DOI': doi, 'title': ['Cached']})
+        with mock.patch('backend.crossref.get_crossref_client') as client:
+            metadata = fetch_metadata_by_DOI(doi.upper())
+            self.assertEqual(metadata['title'], ['Cached'])
+            self.assertFalse(client.called)
+
+    def test_negative_caching(self):
+        doi = '10.1000/missing.doi'
+        DoiMetadata.set(doi, None)
+        self.assertEqual(DoiMetadata.get(doi), (True, None))
+        with self.assertRaises(MetadataSourceException):
+            fetch_metadata_by_DOI(doi)
+
+        # expired entries are fetched again
+        DoiMetadata.objects.filter(doi=doi).update(
+            last_update=timezone.now() - datetime.timedelta(days=2))
+        self.assertEqual(DoiMetadata.get(doi), (False, None))
+
+    def test_batch_uses_cache(self):
+        DoiMetadata.set_many({'10.1000/a': {'DOI': '10.1000/a'},
+                              '10.1000/b': None})
+        with mock.patch('backend.crossref.fetch_doi_batch',
+                        return_value=[{'DOI': '10.1000/c'}]) as fetch:
+            results = fetch_dois_by_batch(
+                ['10.1000/a', '10.1000/b', '10.1000/c'])
+            fetch.assert_called_once_with(['10.1000/c'])
+        self.assertEqual(results, [{'DOI': '10.1000/a'}, None,
+                                   {'DOI': '10.1000/c'}])
+        self.assertEqual(DoiMetadata.get('10.1000/c'),
+                         (True, {'DOI': '10.1000/c'}))
+
+    def test_batch_missing_not_cached(self):
+        def fetch(dois):
+            return [{'DOI': doi} if doi.endswith('found') else None
+                    for doi in dois]
+        with mock.patch('backend.crossref.fetch_doi_batch', side_effect=fetch):
+            results = fetch_dois_by_batch(['10.1000/found', '10.1000/lost'])
+        self.assertEqual(results, [{'DOI': '10.1000/found'}, None])
+        self.assertEqual(DoiMetadata.get('10.1000/lost'), (False, None))
+
+    def test_batch_case_insensitive(self):
+        with mock.patch('backend.crossref.get_crossref_client') as client:
+            client.return_value.get.return_value.json.return_value = {
+                'message': {'items': [{'DOI': '10.1000/ABC'}]}}
+            client.return_value.post.return_value.json.return_value = []
+            self.assertEqual(fetch_doi_batch(['10.1000/abc']),
+                             [{'DOI': '10.1000/ABC'}])
+            self.assertEqual(client.return_value.post.call_args[1]['data'],
+                             {'dois': '[]'})
+
+    def test_transient_errors_not_cached(self):
+        doi = '10.1000/unavailable.doi'
+        response = mock.Mock(status_code=503)
+        response.raise_for_status.side_effect = HTTPError('503 Server Error')
+        with mock.patch('backend.crossref.get_crossref_client') as client:
+            client.return_value.get.return_value = response
+            with self.assertRaises(MetadataSourceException):
+                fetch_metadata_by_DOI(doi)
+            with self.assertRaises(MetadataSourceException):
+                fetch_zotero_by_DOI(doi)
+        self.assertEqual(DoiMetadata.get(doi), (False, None))
+        self.assertEqual(DoiMetadata.get(doi, kind='zotero'), (False, None))
+
+    def test_missing_doi_cached(self):
+        doi = '10.1000/unknown.doi'
+        with mock.patch('backend.crossref.get_crossref_client') as client:
+            client.return_value.get.return_value = mock.Mock(status_code=404)
+            with self.assertRaises(MetadataSourceException):
+                fetch_metadata_by_DOI(doi)
+            with self.assertRaises(MetadataSourceException):
+                fetch_zotero_by_DOI(doi)
+        self.assertEqual(DoiMetadata.get(doi), (True, None))
+        self.assertEqual(DoiMetadata.get(doi, kind='zotero'), (True, None))
+
+    def test_set_many_conflict(self):
+        DoiMetadata.set('10.1000/b', None)
+        with mock.patch.object(DoiMetadata.objects, 'bulk_create',
+                               side_effect=IntegrityError('duplicate key')):
+            DoiMetadata.set_many({'10.1000/a': {'DOI': '10.1000/a'},
+                                  '10.1000/b': {'DOI': '10.1000/b'}})
+        self.assertEqual(DoiMetadata.get('10.1000/a'),
+                         (True, {'DOI': '10.1000/a'}))
+        self.assertEqual(DoiMetadata.get('10.1000/b'),
+                         (True, {'DOI': '10.1000/b'}))
 
     def test_fetch_single_doi(self):
         doi = '10.5380/dp.v1i1.1922'
@@ -119,29 +230,6 @@ class CrossRefUnitTest(unittest.TestCase):
                           'ISSN': ['2179-7412', '1807-3883'],
                           'member': 'http://id.crossref.org/member/3785'})
 
-    def test_parse_crossref_date_incomplete(self):
-        self.assertEqual(parse_crossref_date(None), None)
-        self.assertEqual(
-                parse_crossref_date({'date-parts': [[2015, 07, 06]]}),
-                datetime.date(year=2015, month=07, day=06))
-        self.assertEqual(
-                parse_crossref_date({'date-parts': [[2015, 07]]}),
-                datetime.date(year=2015, month=07, day=01))
-        self.assertEqual(
-                parse_crossref_date({'date-parts': [[2015]]}),
-                datetime.date(year=2015, month=01, day=01))
-
-    def test_parse_crossref_date_raw(self):
-        self.assertEqual(
-                parse_crossref_date({'raw': '2015'}),
-                datetime.date(year=2015, month=01, day=01))
-        self.assertEqual(
-                parse_crossref_date({'raw': '2015-07'}),
-                datetime.date(year=2015, month=07, day=01))
-        self.assertEqual(
-                parse_crossref_date({'raw': '2015-07-06'}),
-                datetime.date(year=2015, month=07, day=06))
-
     def test_get_publication_date(self):
         self.assertEqual(
                 get_publication_date(
@@ -197,6 +285,55 @@ class CrossRefUnitTest(unittest.TestCase):
         results = fetch_dois_by_batch(dois)
         self.assertEqual([item['DOI'] for item in results], dois)
 
+    def test_concurrent_batches(self):
+        dois = ['10.1103/physreve.79.026303', '10.1063/1.4738850',
+                '10.1103/physrevlett.87.054501']
+        with mock.patch('backend.crossref.nb_results_per_request', 1):
+            results = fetch_dois_by_batch(dois)
+        self.assertEqual([item['DOI'] for item in results], dois)
+
+
+class CrossRefUnitTest(unittest.TestCase):
+
+    def test_parse_crossref_date_incomplete(self):
+        self.assertEqual(parse_crossref_date(None), None)
+        self.assertEqual(
+                parse_crossref_date({'date-parts': [[2015, 07, 06]]}),
+                datetime.date(year=2015, month=07, day=06))
+        self.assertEqual(
+                parse_crossref_date({'date-parts': [[2015, 07]]}),
+                datetime.date(year=2015, month=07, day=01))
+        self.assertEqual(
+                parse_crossref_date({'date-parts': [[2015]]}),
+                datetime.date(year=2015, month=01, day=01))
+
+    def test_parse_crossref_date_raw(self):
+        self.assertEqual(
+                parse_crossref_date({'raw': '2015'}),
+                datetime.date(year=2015, month=01, day=01))
+        self.assertEqual(
+                parse_crossref_date({'raw': '2015-07'}),
+                datetime.date(year=2015, month=07, day=01))
+        self.assertEqual(
+                parse_crossref_date({'raw': '2015-07-06'}),
+                datetime.date(year=2015, month=07, day=06))
+
+    def test_rate_limiter(self):
+        limiter = HostRateLimiter(20)
+        start = time.time()
+        for i in range(5):
+            limiter.wait('api.crossref.org')
+        limiter.wait('dx.doi.org')
+        self.assertTrue(time.time() - start >= 0.2)
+        limiter.update_from_headers('api.crossref.org', {
+            'X-Rate-Limit-Limit': '2', 'X-Rate-Limit-Interval': '1s'})
+        self.assertEqual(limiter.intervals['api.crossref.org'], 0.5)
+
+    def test_client_map(self):
+        client = CrossRefClient(concurrency=3)
+        self.assertEqual(client.map(lambda x: 2*x, range(10)),
+                         [2*x for x in range(10)])
+
     def test_convert_to_name_pair(self):
         self.assertEqual(
                 convert_to_name_pair({'family': 'Farge', 'given': 'Marie'}),
@@ -20,13 +20,46 @@
 
 from __future__ import unicode_literals
 
+import datetime
+import unittest
+
 from backend.oai import BASEDCTranslator
 from backend.oai import CiteprocTranslator
 from backend.oai import OAIDCTranslator
 from backend.oai import OaiPaperSource
+from backend.oai import split_date_range
+from django.db import IntegrityError
 from django.test import TestCase
+from django.utils import timezone
+import mock
 from oaipmh.error import BadArgumentError
+from papers.baremodels import BareName
+from papers.baremodels import BareOaiRecord
+from papers.baremodels import BarePaper
 from papers.models import OaiRecord
+from papers.models import OaiSource
+from papers.models import Paper
+
+
+class OaiUtilsTest(unittest.TestCase):
+
+    def test_split_date_range(self):
+        start = datetime.datetime(2016, 1, 1)
+        end = datetime.datetime(2016, 1, 5)
+        windows = split_date_range(start, end, 4)
+        self.assertEqual(len(windows), 4)
+        self.assertEqual(windows[0],
+                         (start, datetime.datetime(2016, 1, 2)))
+        self.assertEqual(windows[-1][1], end)
+        for (_, end_a), (start_b, _) in zip(windows, windows[1:]):
+            self.assertEqual(end_a, start_b)
+
+    def test_split_invalid_range(self):
+        start = datetime.datetime(2016, 1, 1)
+        with self.assertRaises(ValueError):
+            split_date_range(start, start, 4)
+        with self.assertRaises(ValueError):
+            split_date_range(start, datetime.datetime(2016, 1, 2), 0)
 
 
 class OaiTest(TestCase):
@@ -189,6 +222,106 @@ class OaiTest(TestCase):
         self.assertEqual(new_paper, hal_paper)
         self.assertSetEqual(records, set(new_paper.oairecords))
 
+    def test_process_batch(self):
+        """
+        Papers saved by batch are created in bulk when they are new,
+        and merged with the existing ones otherwise.
+        """
+        hal = OaiSource.objects.get(identifier='hal')
+
+        def bare_paper(identifier, title):
+            paper = BarePaper.create(title,
+                                     [BareName.create_bare('John', 'Doe')],
+                                     datetime.date(year=2012, month=1, day=9))
+            paper.add_oairecord(BareOaiRecord(
+                source=hal,
+                identifier=identifier,
+                splash_url='http://hal.archives-ouvertes.fr/'+identifier))
+            return paper
+
+        batch = [
+            (None, bare_paper('oai:hal:batch-1', 'Batched paper number one')),
+            (None, bare_paper('oai:hal:batch-2', 'Batched paper number two')),
+            (None, bare_paper('oai:hal:batch-3', 'Batched paper number one')),
+        ]
+        self.assertEqual(self.oai.process_batch(batch), 2)
+
+        first = OaiRecord.objects.get(identifier='oai:hal:batch-1').about
+        third = OaiRecord.objects.get(identifier='oai:hal:batch-3').about
+        self.assertEqual(first, third)
+        self.assertEqual(first.fingerprint, first.new_fingerprint())
+        self.assertEqual(first.bare_author_names(), [('John', 'Doe')])
+
+        # Processing the same records again does not create anything
+        batch = [(None, bare_paper('oai:hal:batch-2', 'Batched paper number two'))]
+        self.assertEqual(self.oai.process_batch(batch), 0)
+        self.assertEqual(OaiRecord.objects.filter(
+            identifier='oai:hal:batch-2').count(), 1)
+
+        # If the bulk creation conflicts with a concurrent insertion,
+        # the papers are saved one by one
+        batch = [(None, bare_paper('oai:hal:batch-4', 'Batched paper number four'))]
+        with mock.patch.object(Paper, 'bulk_create_from_bare',
+                               side_effect=IntegrityError('duplicate key')):
+            self.assertEqual(self.oai.process_batch(batch), 0)
+        self.assertTrue(OaiRecord.objects.filter(
+            identifier='oai:hal:batch-4').exists())
+
+    def test_checkpoint(self):
+        """
+        The progress of a harvest is saved and used to resume it.
+        """
+        checkpoint = self.oai.get_checkpoint('base_dc')
+        self.oai.save_checkpoint(checkpoint, 'sometoken',
+                                 datetime.datetime(2016, 2, 11, 18, 34, 12))
+        checkpoint = self.oai.get_checkpoint('base_dc')
+        self.assertEqual(checkpoint.resumption_token, 'sometoken')
+
+        with mock.patch.object(self.oai, 'ingest') as ingest:
+            self.oai.resume('base_dc')
+            self.assertEqual(ingest.call_args[1]['resumptionToken'],
+                             'sometoken')
+
+        # once the harvest is complete, we restart from the last datestamp
+        self.oai.save_checkpoint(checkpoint, None, None)
+        with mock.patch.object(self.oai, 'ingest') as ingest:
+            self.oai.resume('base_dc')
+            self.assertEqual(ingest.call_args[1]['from_date'],
+                             datetime.datetime(2016, 2, 11, 18, 34, 12))
+
+    def test_checkpoint_restart_date(self):
+        """
+        Until a harvest is complete, it is restarted from its beginning,
+        as the records are not ordered by datestamp.
+        """
+        checkpoint = self.oai.get_checkpoint('base_dc', partition='restart')
+        start = datetime.datetime(2016, 1, 1)
+
+        def records():
+            # two records on the first page, one on the last one
+            for token, day in [('page2', 20), ('page2', 5), (None, 10)]:
+                self.oai.client.resumption_token = token
+                header = mock.Mock()
+                header.datestamp.return_value = datetime.datetime(2016, 1, day)
+                yield header, mock.Mock(_map={})
+
+        saved = []
+        save_checkpoint = self.oai.save_checkpoint
+
+        def save(checkpoint, resumption_token, last_datestamp=None):
+            save_checkpoint(checkpoint, resumption_token, last_datestamp)
+            saved.append(checkpoint.last_datestamp)
+
+        with mock.patch.object(self.oai.client, 'listRecords',
+                               return_value=records()), \
+                mock.patch.object(self.oai, 'process_record'), \
+                mock.patch.object(self.oai, 'save_checkpoint', side_effect=save):
+            self.oai.ingest(from_date=start, metadataPrefix='base_dc',
+                            checkpoint=checkpoint)
+        self.assertEqual(saved, [
+            timezone.make_aware(start, timezone.utc),
+            timezone.make_aware(datetime.datetime(2016, 1, 20), timezone.utc)])
+
     def test_create_invalid_metadata(self):
         """
         Metadata that we don't accept
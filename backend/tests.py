@@ -21,23 +21,35 @@
 from __future__ import unicode_literals
 
 import datetime
+from io import BytesIO
+from StringIO import StringIO
 import unittest
 
 from backend.crossref import CrossRefAPI
+from backend.maintenance import check_researcher_links
 from backend.maintenance import cleanup_names
 from backend.maintenance import cleanup_researchers
 from backend.maintenance import create_publisher_aliases
+from backend.maintenance import find_collisions
+from backend.maintenance import iterate_in_chunks
+from backend.maintenance import pk_ranges
 from backend.maintenance import recompute_publisher_policies
 from backend.maintenance import refetch_containers
 from backend.maintenance import refetch_publishers
 from backend.maintenance import update_paper_statuses
 from backend.orcid import affiliate_author_with_orcid
+from backend.orcid import OrcidFetchingPipeline
 from backend.orcid import OrcidPaperSource
+from backend.papersource import PaperSource
 from backend.romeo import fetch_journal
 from backend.romeo import fetch_publisher
+from backend.romeo import drop_journal_index
 from backend.romeo import find_journal_in_model
+from backend.romeo import import_romeo_dump
 from backend.romeo import perform_romeo_query
+from backend.romeo import resolve_journals
 from backend.tasks import fetch_everything_for_researcher
+from backend.tasks import flush_indexing_queue
 from backend.tasks import remove_empty_profiles
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.management import call_command
@@ -45,8 +57,10 @@ from django.test import override_settings
 from django.test import TestCase
 import haystack
 from lxml import etree
+import mock
 from papers.baremodels import BareAuthor
 from papers.baremodels import BareName
+from papers.baremodels import BareOaiRecord
 from papers.baremodels import BarePaper
 from papers.models import Department
 from papers.models import Institution
@@ -55,7 +69,10 @@ from papers.models import OaiRecord
 from papers.models import OaiSource
 from papers.models import Paper
 from papers.models import Researcher
+from papers.utils import sanitize_html
 from publishers.models import Journal
+from search.queue import indexing_queue_length
+from search.queue import mark_papers_dirty
 
 TEST_INDEX = {
     'default': {
@@ -135,6 +152,81 @@ class RomeoTest(TestCase):
         self.assertEqual(fetch_journal(
             {'issn': '0036-8075'}).publisher.oa_status, 'OK')
 
+
+ROMEO_DUMP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<romeoapi version="2.9">
+<journals>
+<journal><jtitle>Journal of Mirrored Studies</jtitle><issn>1234-5678</issn>
+<essn>1234-5679</essn><romeopub>Mirror Press</romeopub></journal>
+<journal><jtitle>Revista Espa\xc3\xb1ola de Espejos</jtitle>
+<romeopub>Mirror Press</romeopub></journal>
+<journal><jtitle>Orphan Journal</jtitle><issn>8765-4321</issn>
+<romeopub>Unknown Press</romeopub></journal>
+</journals>
+<publishers>
+<publisher id="99999"><name>Mirror Press</name>
+<preprints><prearchiving>can</prearchiving></preprints>
+<postprints><postarchiving>can</postarchiving></postprints>
+<pdfversion><pdfarchiving>cannot</pdfarchiving></pdfversion>
+</publisher>
+</publishers>
+</romeoapi>
+"""
+
+
+class RomeoMirrorTest(TestCase):
+
+    def tearDown(self):
+        drop_journal_index()
+
+    def test_import_dump(self):
+        self.assertEqual(import_romeo_dump(BytesIO(ROMEO_DUMP)), 2)
+        journal = Journal.objects.get(issn='1234-5678')
+        self.assertEqual(journal.publisher.name, 'Mirror Press')
+        self.assertEqual(journal.publisher.oa_status, 'OK')
+        self.assertFalse(Journal.objects.filter(title='Orphan Journal'))
+        # importing the same dump again does not create anything
+        self.assertEqual(import_romeo_dump(BytesIO(ROMEO_DUMP)), 0)
+
+    def test_resolve_journals(self):
+        import_romeo_dump(BytesIO(ROMEO_DUMP))
+        with self.assertNumQueries(1):
+            journals = resolve_journals([
+                ('Some other title', '1234-5678'),
+                ('revista  espanola de espejos.', None),
+                ('Orphan Journal', '8765-4321'),
+                (None, None)])
+            self.assertEqual(journals[0].issn, '1234-5678')
+            self.assertEqual(journals[0].publisher.name, 'Mirror Press')
+        self.assertEqual(journals[1].title, 'Revista Española de Espejos')
+        self.assertEqual(journals[2:], [None, None])
+
+    def test_find_journal_with_index(self):
+        import_romeo_dump(BytesIO(ROMEO_DUMP))
+        with self.assertNumQueries(0):
+            self.assertEqual(find_journal_in_model(
+                {'jtitle': 'Orphan Journal'}), None)
+        self.assertEqual(find_journal_in_model(
+            {'jtitle': 'JOURNAL OF MIRRORED STUDIES'}).issn, '1234-5678')
+
+    def test_find_journal_without_index(self):
+        import_romeo_dump(BytesIO(ROMEO_DUMP))
+        drop_journal_index()
+        self.assertEqual(find_journal_in_model(
+            {'issn': '1234-5679'}).issn, '1234-5678')
+        self.assertEqual(find_journal_in_model(
+            {'jtitle': 'Journal of Mirrored-Studies '}).issn, '1234-5678')
+        self.assertEqual(find_journal_in_model(
+            {'jtitle': 'Journal of Mirrors'}), None)
+
+    def test_fetch_journal_cache(self):
+        import_romeo_dump(BytesIO(ROMEO_DUMP))
+        drop_journal_index()
+        terms = {'jtitle': 'Journal of Mirrored Studies'}
+        self.assertEqual(fetch_journal(terms).issn, '1234-5678')
+        with self.assertNumQueries(1):
+            self.assertEqual(fetch_journal(terms).issn, '1234-5678')
+
 # Generic test case that requires some example DB
 
 
@@ -171,6 +263,14 @@ class PrefilledTest(TestCase):
         super(PrefilledTest, self).tearDownClass()
 
 
+def run_on_commit():
+    """
+    Runs the callbacks registered with `transaction.on_commit` right
+    away, as test cases run in a transaction which is never committed.
+    """
+    return mock.patch('django.db.transaction.on_commit', lambda func: func())
+
+
 def check_paper(asserter, paper):
     """
     All sorts of tests to ensure a paper is well-behaved
@@ -230,6 +330,30 @@ class OrcidUnitTest(unittest.TestCase):
                     [('Antonin', 'Delpeuch'), ('Anne', 'Preller')]),
                 ['0000-0002-8612-8827', None])
 
+    @override_settings(ORCID_BASE_DOMAIN='orcid.org')
+    def test_pipeline_deduplicates_dois(self):
+        def work(doi):
+            return {'work-external-identifiers': {'work-external-identifier': [
+                {'work-external-identifier-type': 'DOI',
+                 'work-external-identifier-id': {'value': doi}}]}}
+        profile = {'orcid-profile': {'orcid-activities': {'orcid-works': {
+            'orcid-work': [work('10.1000/a'), work('10.1000/B'), work('10.1000/b')]}}}}
+        search_result = {'DOI': '10.1000/a'}
+
+        with mock.patch('backend.orcid.OrcidProfile', side_effect=lambda json: json), \
+                mock.patch('backend.orcid.CrossRefAPI') as cr_api, \
+                mock.patch('backend.orcid.fetch_dois', return_value=[{'DOI': '10.1000/b'}]) as fetch_dois:
+            cr_api.return_value.search_for_dois_incrementally.return_value = [search_result]
+            pipeline = OrcidFetchingPipeline('0000-0002-8612-8827', profile)
+            results = list(pipeline.results())
+
+        fetch_dois.assert_called_once_with(['10.1000/b'])
+        self.assertEqual(sorted(results), sorted([
+            ('profile', profile),
+            ('search', search_result),
+            ('doi', search_result),
+            ('doi', {'DOI': '10.1000/b'})]))
+
 
 class OrcidIntegrationTest(PaperSourceTest):
 
@@ -269,6 +393,47 @@ class OrcidIntegrationTest(PaperSourceTest):
         self.assertEqual(p.authors[2].orcid, pablo.orcid)
 
 
+class BatchPaperSource(PaperSource):
+    """
+    Returns a few papers written by the researcher (with their ORCID id).
+    """
+
+    def fetch_papers(self, researcher):
+        hal = OaiSource.objects.get(identifier='hal')
+        for idx in range(5):
+            paper = BarePaper.create('Batched paper about topic %d' % (idx % 4),
+                                     [BareName.create_bare('Antonin', 'Delpeuch'),
+                                      BareName.create_bare('Anne', 'Preller')],
+                                     datetime.date(year=2014, month=2, day=1),
+                                     orcids=[researcher.orcid, None])
+            paper.add_oairecord(BareOaiRecord(
+                source=hal,
+                identifier='oai:hal:batch-source-%d' % idx,
+                splash_url='http://hal.archives-ouvertes.fr/%d' % idx))
+            yield paper
+
+
+class PaperSourceBatchTest(PrefilledTest):
+
+    def test_batch_fetch_and_save(self):
+        self.r4.update_stats()
+        num_tot = self.r4.stats.num_tot
+
+        BatchPaperSource().fetch_and_save(self.r4, batch=True, flush_every=2)
+
+        papers = Paper.objects.filter(title__startswith='Batched paper about')
+        self.assertEqual(papers.count(), 4)
+        for paper in papers:
+            self.assertEqual(paper.authors_list[0]['researcher_id'], self.r4.id)
+            self.assertIn(self.r4, paper.researchers.all())
+
+        # statistics were updated incrementally
+        r = Researcher.objects.get(pk=self.r4.pk)
+        self.assertEqual(r.stats.num_tot, num_tot + 4)
+        r.update_stats()
+        self.assertEqual(r.stats.num_tot, num_tot + 4)
+
+
 class PaperMethodsTest(PrefilledTest):
 
     def test_update_authors(self):
@@ -325,6 +490,31 @@ class TasksTest(PrefilledTest):
             Researcher.objects.get(pk=pk)
         self.assertEqual(Researcher.objects.count(), nb_researchers)
 
+    def test_flush_indexing_queue(self):
+        p = Paper.objects.first()
+        with run_on_commit():
+            mark_papers_dirty([p.pk, 123456789])
+        self.assertTrue(indexing_queue_length() >= 2)
+        flush_indexing_queue()
+        self.assertEqual(indexing_queue_length(), 0)
+
+    def test_indexing_waits_for_commit(self):
+        # the test runs in a transaction which is never committed
+        with mock.patch('search.queue.index_papers') as index_papers, \
+                mock.patch('search.queue.redis_client') as redis:
+            mark_papers_dirty([Paper.objects.first().pk])
+        self.assertFalse(index_papers.called)
+        self.assertFalse(redis.sadd.called)
+
+    def test_indexing_without_redis(self):
+        p = Paper.objects.first()
+        with mock.patch('search.queue.redis_client', None), \
+                mock.patch('search.queue.index_papers') as index_papers, \
+                run_on_commit():
+            mark_papers_dirty([p.pk])
+            self.assertEqual(indexing_queue_length(), 0)
+        index_papers.assert_called_once_with([p.pk])
+
 
 class MaintenanceTest(PrefilledTest):
 
@@ -376,3 +566,47 @@ class MaintenanceTest(PrefilledTest):
                       pdf_url=pdf_url)
         update_paper_statuses()
         self.assertEqual(Paper.objects.get(pk=p.pk).pdf_url, pdf_url)
+
+    def test_check_researcher_links(self):
+        p = Paper.objects.first()
+        p.authors_list[0]['researcher_id'] = self.r4.id
+        p.save()
+        p.researchers.clear()
+        nb_missing, nb_extra = check_researcher_links(chunk_size=3)
+        self.assertTrue(nb_missing >= 1)
+        check_researcher_links(fix=True)
+        self.assertEqual(check_researcher_links(), (0, 0))
+        self.assertIn(self.r4, p.researchers.all())
+
+    def test_iterate_in_chunks(self):
+        chunks = list(iterate_in_chunks(Paper.objects.all(), chunk_size=2,
+                                        fields=['title']))
+        self.assertTrue(all(len(chunk) <= 2 for chunk in chunks))
+        pks = [p.pk for chunk in chunks for p in chunk]
+        self.assertEqual(pks, sorted(pks))
+        self.assertEqual(len(pks), Paper.objects.count())
+
+    def test_find_collisions(self):
+        p, other = Paper.objects.all()[:2]
+        Paper.objects.filter(pk=other.pk).update(
+            title=p.title, authors_list=p.authors_list, pubdate=p.pubdate)
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            find_collisions(chunk_size=2)
+        output = stdout.getvalue()
+        self.assertEqual(output.count('### '), 1)
+        self.assertEqual(output.count(p.title), 2)
+
+    def test_pk_ranges(self):
+        ranges = pk_ranges(Paper.objects.all(), 3)
+        self.assertTrue(len(ranges) <= 3)
+        nb_papers = sum(Paper.objects.filter(
+            pk__gte=lower, pk__lte=upper).count() for lower, upper in ranges)
+        self.assertEqual(nb_papers, Paper.objects.count())
+
+    def test_cleanup_titles(self):
+        p = Paper.objects.first()
+        p.title = 'A <script>alert("title")</script>title'
+        p.save(update_fields=['title'])
+        call_command('cleanup_titles', chunk_size=3)
+        self.assertEqual(Paper.objects.get(pk=p.pk).title,
+                         sanitize_html(p.title))
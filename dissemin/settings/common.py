@@ -94,12 +94,23 @@ DOI_PROXY_SUPPORTS_BATCH = True
 #DOI_PROXY_DOMAIN =  'dx.doi.org'
 #DOI_PROXY_SUPPORTS_BATCH = False
 
+# The metadata fetched for each DOI is also cached in our own database,
+# so that refreshing a profile only hits the network for new DOIs.
+# Expiration of the metadata found:
+DOI_METADATA_CACHE_TTL = timedelta(days=30)
+# Expiration of the DOIs without metadata (negative caching):
+DOI_METADATA_NEGATIVE_CACHE_TTL = timedelta(days=1)
+
 
 ### RoMEO proxy ###
 # Set this to 'sherpa.ac.uk' if our custom mirror is not up anymore.
 # Otherwise our proxy caches results and is more reliable than the
 # original endpoint.
 ROMEO_API_DOMAIN = 'romeo-cache.dissem.in'
+# Set this to True once a dump of RoMEO has been imported
+# (with the import_romeo_dump command): journals and publishers
+# are then only looked up locally, without querying RoMEO.
+ROMEO_LOCAL_MIRROR = False
 
 ### Paper deposits ###
 # Max size of the PDFs (in bytes)
@@ -164,6 +175,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'publishers.middleware.FlushAliasesMiddleware',
 )
 
 AUTHENTICATION_BACKENDS = (
@@ -238,26 +250,28 @@ BROKER_URL = 'redis://'+REDIS_URL
 # We also use Redis as result backend.
 CELERY_RESULT_BACKEND = BROKER_URL
 
-# Redis is not mandatory, this client is reserved for deposits.
+# Redis client, used for the locks of tasks and the queue of papers
+# to reindex (search.queue). Without it, papers are reindexed
+# synchronously when they change.
 try:
     import redis
     redis_client = redis.StrictRedis(
             host=REDIS_HOST, port=REDIS_PORT,
             db=REDIS_DB, password=REDIS_PASSWORD)
 except ImportError:
-    pass
+    redis_client = None
 
 CELERY_ACCEPT_CONTENT = ['pickle', 'json', 'msgpack', 'yaml']
 CELERY_IMPORTS = ['backend.tasks']
 
 CELERYBEAT_SCHEDULE = {
-    'update_all_stats_but_researchers': {
-        'task': 'update_all_stats_but_researchers',
-        'schedule': timedelta(minutes=30),
+    'reconcile_stats': {
+        'task': 'reconcile_stats',
+        'schedule': timedelta(hours=6),
     },
-    'update_journal_stats': {
-        'task': 'update_journal_stats',
-        'schedule': timedelta(days=1),
+    'flush_indexing_queue': {
+        'task': 'flush_indexing_queue',
+        'schedule': timedelta(minutes=1),
     },
     'remove_empty_profiles': {
         'task': 'remove_empty_profiles',
@@ -20,6 +20,7 @@ from django.contrib import admin
 from papers.models import Department
 from papers.models import Institution
 from papers.models import Name
+from papers.models import OaiHarvestCheckpoint
 from papers.models import OaiRecord
 from papers.models import OaiSource
 from papers.models import Paper
@@ -56,5 +57,6 @@ admin.site.register(Researcher, ResearcherAdmin)
 admin.site.register(Name)
 admin.site.register(Paper, PaperAdmin)
 admin.site.register(OaiSource)
+admin.site.register(OaiHarvestCheckpoint)
 admin.site.register(OaiRecord, OaiRecordAdmin)
 admin.site.register(PaperWorld, SingletonModelAdmin)
@@ -46,7 +46,6 @@ from papers.utils import remove_nones
 from papers.utils import sanitize_html
 from papers.utils import validate_orcid
 from publishers.models import DummyPublisher
-from publishers.models import OA_STATUS_CHOICES
 from publishers.models import OA_STATUS_PREFERENCE
 
 PAPER_TYPE_CHOICES = [
@@ -67,6 +66,11 @@ PAPER_TYPE_CHOICES = [
 
 PAPER_TYPE_PREFERENCE = [x for (x, y) in PAPER_TYPE_CHOICES]
 
+# Ranks of the OA statuses and paper types in the preferences above,
+# used to compute the availability of papers
+OA_STATUS_RANK = {status: idx for idx, status in enumerate(OA_STATUS_PREFERENCE)}
+PAPER_TYPE_RANK = {doctype: idx for idx, doctype in enumerate(PAPER_TYPE_PREFERENCE)}
+
 MAX_NAME_LENGTH = 256
 
 
@@ -195,8 +199,7 @@ class BarePaper(BareObject):
         bare_obj.update_availability()
         bare_obj.fingerprint = bare_obj.new_fingerprint()
         ist = super(BarePaper, cls).from_bare(bare_obj)
-        for idx, a in enumerate(bare_obj.authors):
-            ist.add_author(a, position=idx)
+        ist.set_authors(bare_obj.authors)
         ist.save()
         ist.just_created = True
         for r in bare_obj.oairecords:
@@ -293,6 +296,14 @@ class BarePaper(BareObject):
             self.bare_authors.append(author)
         return author
 
+    def set_authors(self, authors):
+        """
+        Replaces the list of authors of the paper.
+
+        :param authors: the new list of :class:`BareAuthor`
+        """
+        self.bare_authors = list(authors)
+
     def set_researcher(self, position, researcher_id):
         """
         Sets the researcher_id for the author at the given position
@@ -527,38 +538,29 @@ class BarePaper(BareObject):
 
         self.pdf_url = None
         oa_idx = len(OA_STATUS_PREFERENCE)-1
-        type_idx = len(PAPER_TYPE_PREFERENCE)-1
+        type_idx = PAPER_TYPE_RANK.get(
+            self.doctype, len(PAPER_TYPE_PREFERENCE)-1)
         source_found = False
 
-        if self.doctype in PAPER_TYPE_PREFERENCE:
-            type_idx = PAPER_TYPE_PREFERENCE.index(self.doctype)
-
         for rec in records:
             if rec.has_publication_metadata():
                 # OA status
-                cur_status = rec.oa_status()
-                try:
-                    idx = OA_STATUS_PREFERENCE.index(cur_status)
-                except ValueError:
-                    idx = len(OA_STATUS_PREFERENCE)
+                idx = OA_STATUS_RANK.get(
+                    rec.oa_status(), len(OA_STATUS_PREFERENCE))
                 oa_idx = min(idx, oa_idx)
-                if OA_STATUS_CHOICES[oa_idx][0] == 'OA':
+                if OA_STATUS_PREFERENCE[oa_idx] == 'OA':
                     self.pdf_url = rec.pdf_url or rec.splash_url
             else:
                 if not self.pdf_url and rec.pdf_url:
                     self.pdf_url = rec.pdf_url
 
             # Pub type
-            cur_type = rec.pubtype
-            try:
-                idx = PAPER_TYPE_PREFERENCE.index(cur_type)
-            except ValueError:
-                idx = len(PAPER_TYPE_PREFERENCE)
+            idx = PAPER_TYPE_RANK.get(rec.pubtype, len(PAPER_TYPE_PREFERENCE))
             type_idx = min(idx, type_idx)
 
             source_found = True
 
-        self.oa_status = OA_STATUS_CHOICES[oa_idx][0]
+        self.oa_status = OA_STATUS_PREFERENCE[oa_idx]
 
         # If this paper is not associated with any source, do not display it
         # This happens when creating the associated OaiRecord
@@ -20,6 +20,10 @@
 
 from __future__ import unicode_literals
 
+from array import array
+import binascii
+import hashlib
+from multiprocessing import Pool
 import re
 
 from papers.name import split_name_words
@@ -30,6 +34,15 @@ from papers.utils import ulower
 # Paper fingerprinting
 
 stripped_chars = re.compile(r'[^- a-z0-9]')
+title_separators = re.compile(r'[ -]+')
+
+# Cache of the fingerprints of last names (see last_name_fingerprint)
+last_name_cache = {}
+# Maximum number of entries in this cache
+LAST_NAME_CACHE_SIZE = 100000
+
+# Minimum number of papers to fingerprint in a multiprocessing pool
+FINGERPRINT_POOL_THRESHOLD = 50000
 
 
 def create_paper_plain_fingerprint(title, authors, year):
@@ -59,7 +72,7 @@ def create_paper_plain_fingerprint(title, authors, year):
     title = remove_diacritics(title).lower()
     title = stripped_chars.sub('', title)
     title = title.strip()
-    title = re.sub('[ -]+', '-', title)
+    title = title_separators.sub('-', title)
     buf = title
 
     # If the title is long enough, we return the fingerprint as is
@@ -75,27 +88,180 @@ def create_paper_plain_fingerprint(title, authors, year):
     for author in authors:
         if not author:
             continue
-        author = (remove_diacritics(author[0]), remove_diacritics(author[1]))
-
-        # Last name, without the small words such as "van", "der", "de"…
-        last_name_words, last_name_separators = split_name_words(author[1])
-        last_words = []
-        for i in range(len(last_name_words)):
-            if (last_name_words[i][0].isupper() or
-                    (i > 0 and last_name_separators[i-1] == '-')):
-                last_words.append(last_name_words[i])
-
-        # If no word was uppercased, fall back on all the words
-        if not last_words:
-            last_words = last_name_words
-
-        # Lowercase
-        last_words = map(ulower, last_words)
-        fp = '-'.join(last_words)
-        author_names_list.append(fp)
+        author_names_list.append(last_name_fingerprint(author[1]))
 
     author_names_list.sort()
     for fp in author_names_list:
         buf += '/'+fp
 
     return buf
+
+
+def last_name_fingerprint(last_name):
+    """
+    The part of the plain fingerprint contributed by an author: their last
+    name, without the small words such as "van", "der", "de"… As the same
+    last names appear over and over again, the results are memoized.
+
+    >>> last_name_fingerprint('van der Waals')
+    u'waals'
+    >>> last_name_fingerprint('Lévy-Leblond')
+    u'levy-leblond'
+    """
+    fp = last_name_cache.get(last_name)
+    if fp is not None:
+        return fp
+
+    last_name_words, last_name_separators = split_name_words(
+        remove_diacritics(last_name))
+    last_words = []
+    for i in range(len(last_name_words)):
+        if (last_name_words[i][0].isupper() or
+                (i > 0 and last_name_separators[i-1] == '-')):
+            last_words.append(last_name_words[i])
+
+    # If no word was uppercased, fall back on all the words
+    if not last_words:
+        last_words = last_name_words
+
+    # Lowercase
+    last_words = map(ulower, last_words)
+    fp = '-'.join(last_words)
+
+    if len(last_name_cache) >= LAST_NAME_CACHE_SIZE:
+        last_name_cache.clear()
+    last_name_cache[last_name] = fp
+    return fp
+
+
+def create_paper_fingerprint(title, authors, year):
+    """
+    The fingerprint of a paper: the MD5 digest of its plain fingerprint
+    (see :func:`create_paper_plain_fingerprint`).
+    """
+    buf = create_paper_plain_fingerprint(title, authors, year)
+    return hashlib.md5(buf).hexdigest()
+
+
+def _create_paper_fingerprint_tuple(args):
+    return create_paper_fingerprint(*args)
+
+
+def create_paper_fingerprints(papers, processes=None):
+    """
+    Computes the fingerprints of many papers at once. This returns the
+    same values as :func:`create_paper_fingerprint` called on each paper,
+    but large inputs (more than :data:`FINGERPRINT_POOL_THRESHOLD` papers)
+    are split between multiple processes.
+
+    :param papers: an iterable of (title, authors, year) triples, where
+        authors is a list of (first_name, last_name) pairs
+    :param processes: the number of processes to use (default: the
+        number of CPUs)
+    :returns: the list of fingerprints, in the same order as the papers
+    """
+    papers = list(papers)
+    if len(papers) < FINGERPRINT_POOL_THRESHOLD:
+        return map(_create_paper_fingerprint_tuple, papers)
+
+    pool = Pool(processes)
+    try:
+        return pool.map(_create_paper_fingerprint_tuple, papers,
+                        chunksize=1000)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class FingerprintIndex(object):
+    """
+    A compact, in-memory index of paper fingerprints, mapping them to
+    paper ids. It is meant to be loaded once before bulk imports, so
+    that looking up fingerprints which are not in the database (which is
+    the common case when harvesting new papers) does not require any
+    query.
+
+    Fingerprints are hexadecimal MD5 digests: the bulk of the index is
+    stored as a sorted buffer of 16-byte binary digests, along with an
+    array of the corresponding ids. Fingerprints added after the
+    index was built are stored in a regular dictionary.
+    """
+    DIGEST_SIZE = 16
+
+    def __init__(self, sorted_pairs=[]):
+        """
+        :param sorted_pairs: an iterable of (fingerprint, paper id) pairs,
+            sorted by fingerprint
+        """
+        digests = bytearray()
+        self.ids = array(b'l')
+        self.extra = {}
+        last = None
+        for fp, pk in sorted_pairs:
+            digest = self._digest(fp)
+            if digest is None or (last is not None and digest <= last):
+                # invalid or unsorted fingerprint
+                self.extra[fp] = pk
+                continue
+            digests.extend(digest)
+            self.ids.append(pk)
+            last = digest
+        self.digests = bytes(digests)
+        self.removed = set()
+
+    @classmethod
+    def _digest(cls, fp):
+        try:
+            digest = binascii.unhexlify(fp)
+        except (TypeError, ValueError):
+            return
+        if len(digest) == cls.DIGEST_SIZE:
+            return digest
+
+    def _find(self, digest):
+        """
+        Binary search of a digest in the sorted buffer.
+        Returns its position, or None if it is not there.
+        """
+        size = self.DIGEST_SIZE
+        lo, hi = 0, len(self.ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.digests[size*mid:size*(mid+1)] < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.ids) and self.digests[size*lo:size*(lo+1)] == digest:
+            return lo
+
+    def get(self, fp):
+        """
+        Returns the id of the paper with this fingerprint, or None if
+        no paper is known to have it.
+        """
+        if fp in self.removed:
+            return
+        if fp in self.extra:
+            return self.extra[fp]
+        digest = self._digest(fp)
+        if digest is not None:
+            pos = self._find(digest)
+            if pos is not None:
+                return self.ids[pos]
+
+    def __contains__(self, fp):
+        return self.get(fp) is not None
+
+    def add(self, fp, pk):
+        """
+        Records that the paper `pk` has the fingerprint `fp`.
+        """
+        self.removed.discard(fp)
+        self.extra[fp] = pk
+
+    def remove(self, fp):
+        """
+        Records that no paper has the fingerprint `fp` anymore.
+        """
+        self.extra.pop(fp, None)
+        self.removed.add(fp)
@@ -0,0 +1,64 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Shared base class for the management commands running the maintenance
+jobs of :mod:`backend.maintenance`.
+"""
+
+from __future__ import unicode_literals
+
+from backend.maintenance import DEFAULT_CHUNK_SIZE
+from backend.maintenance import run_in_workers
+from django.core.management.base import BaseCommand
+
+
+class MaintenanceCommand(BaseCommand):
+    """
+    Runs a maintenance function over a table, chunk by chunk.
+    If the function accepts a `pk_range` argument, the `--workers`
+    option splits the primary keys of the table between processes.
+    """
+    #: The maintenance function to run (wrapped in a staticmethod)
+    function = None
+    #: If the function can be run on pk ranges, the queryset to split
+    queryset = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int,
+                            default=DEFAULT_CHUNK_SIZE,
+                            help='Number of rows fetched and written at once')
+        if self.queryset is not None:
+            parser.add_argument('--workers', type=int, default=1,
+                                help='Number of processes to run in parallel')
+
+    def get_kwargs(self, options):
+        """
+        The keyword arguments passed to the maintenance function.
+        """
+        return {'chunk_size': options['chunk_size']}
+
+    def handle(self, *args, **options):
+        kwargs = self.get_kwargs(options)
+        workers = options.get('workers', 1)
+        if workers > 1:
+            run_in_workers(self.function, self.queryset, workers, **kwargs)
+        else:
+            self.function(**kwargs)
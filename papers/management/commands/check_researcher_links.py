@@ -0,0 +1,41 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+from backend.maintenance import check_researcher_links
+from papers.management.base import MaintenanceCommand
+from papers.models import Paper
+
+
+class Command(MaintenanceCommand):
+    help = 'Checks that the researchers of papers match their authors lists'
+    function = staticmethod(check_researcher_links)
+    queryset = Paper.objects.all()
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--fix', action='store_true',
+                            help='Update the researchers of papers to match their authors')
+
+    def get_kwargs(self, options):
+        kwargs = super(Command, self).get_kwargs(options)
+        kwargs['fix'] = options['fix']
+        return kwargs
@@ -0,0 +1,31 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+from backend.maintenance import cleanup_abstracts
+from papers.management.base import MaintenanceCommand
+from papers.models import OaiRecord
+
+
+class Command(MaintenanceCommand):
+    help = 'Sanitizes the HTML in the abstracts of all records'
+    function = staticmethod(cleanup_abstracts)
+    queryset = OaiRecord.objects.all()
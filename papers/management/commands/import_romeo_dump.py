@@ -0,0 +1,35 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+from backend.romeo import import_romeo_dump
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Imports the journals and publishers of a RoMEO dump (XML file)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the dump')
+
+    def handle(self, *args, **options):
+        created = import_romeo_dump(options['path'])
+        self.stdout.write('%d journals created' % created)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0039_populate_oai_sources'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OaiHarvestCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=512)),
+                ('metadata_prefix', models.CharField(max_length=64)),
+                ('partition', models.CharField(blank=True, default='', max_length=64)),
+                ('resumption_token', models.CharField(blank=True, max_length=1024, null=True)),
+                ('last_datestamp', models.DateTimeField(blank=True, null=True)),
+                ('until_date', models.DateTimeField(blank=True, null=True)),
+                ('last_update', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'OAI harvest checkpoint',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='oaiharvestcheckpoint',
+            unique_together=set([('endpoint', 'metadata_prefix', 'partition')]),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from bulk_update.helper import bulk_update
+from papers.models import shorten_url
+
+def populate_short_urls(apps, schema_editor):
+    OaiRecord = apps.get_model('papers', 'OaiRecord')
+
+    bs = 10000
+    lastpk = 0
+    while True:
+        print lastpk
+        batch = list(OaiRecord.objects.filter(pk__gt=lastpk).order_by('pk')
+                     .only('splash_url', 'pdf_url')[:bs])
+        if not batch:
+            break
+        for r in batch:
+            r.short_splash_url = shorten_url(r.splash_url)
+            r.short_pdf_url = shorten_url(r.pdf_url)
+        bulk_update(batch, update_fields=['short_splash_url', 'short_pdf_url'])
+        lastpk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0040_oaiharvestcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='oairecord',
+            name='short_pdf_url',
+            field=models.CharField(blank=True, max_length=1024, null=True),
+        ),
+        migrations.AddField(
+            model_name='oairecord',
+            name='short_splash_url',
+            field=models.CharField(blank=True, max_length=1024, null=True),
+        ),
+        migrations.RunPython(populate_short_urls, migrations.RunPython.noop,
+                             atomic=False),
+        migrations.AlterIndexTogether(
+            name='oairecord',
+            index_together=set([('about', 'short_splash_url'), ('about', 'short_pdf_url')]),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0041_oairecord_short_urls'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoiMetadata',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doi', models.CharField(max_length=1024)),
+                ('kind', models.CharField(default='citeproc', max_length=16)),
+                ('compressed_metadata', models.BinaryField(null=True)),
+                ('last_update', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'DOI metadata',
+                'verbose_name_plural': 'DOI metadata',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='doimetadata',
+            unique_together=set([('doi', 'kind')]),
+        ),
+    ]
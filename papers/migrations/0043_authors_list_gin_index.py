@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Index the authors_list for containment queries such as
+    `authors_list__contains=[{'researcher_id': 42}]`, used to find
+    the papers of a researcher.
+    """
+
+    dependencies = [
+        ('papers', '0042_doimetadata'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX papers_paper_authors_list_gin ON papers_paper '
+            'USING gin (authors_list jsonb_path_ops);',
+            'DROP INDEX papers_paper_authors_list_gin;'),
+    ]
@@ -52,16 +52,25 @@ This module defines most of the models used in the platform.
 
 from __future__ import unicode_literals
 
+from collections import Counter
+from collections import defaultdict
 from datetime import datetime
 from datetime import timedelta
+import json
+import operator
 import re
+import zlib
 from statistics.models import AccessStatistics
 from statistics.models import combined_status_for_instance
 from statistics.models import STATUS_CHOICES_HELPTEXT
+from statistics.models import status_delta
 
+from bulk_update.helper import bulk_update
 from caching.base import CachingManager
 from caching.base import CachingMixin
 from celery.result import AsyncResult
+from dissemin.settings import DOI_METADATA_CACHE_TTL
+from dissemin.settings import DOI_METADATA_NEGATIVE_CACHE_TTL
 from dissemin.settings import POSSIBLE_LANGUAGE_CODES
 from dissemin.settings import PROFILE_REFRESH_ON_LOGIN
 from django.contrib.auth.models import User
@@ -71,7 +80,11 @@ from django.core.cache.utils import make_template_fragment_key
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
 from django.db import DataError
+from django.db import IntegrityError
 from django.db import models
+from django.db import transaction
+from django.db.models import Prefetch
+from django.db.models import Q
 from django.template.defaultfilters import slugify
 from django.utils import timezone
 from django.utils.functional import cached_property
@@ -85,6 +98,7 @@ from papers.baremodels import PAPER_TYPE_CHOICES
 from papers.baremodels import PAPER_TYPE_PREFERENCE
 from papers.doi import to_doi
 from papers.errors import MetadataSourceException
+from papers.fingerprint import FingerprintIndex
 from papers.name import name_similarity
 from papers.name import unify_name_lists
 from papers.orcid import OrcidProfile
@@ -92,6 +106,8 @@ from papers.utils import affiliation_is_greater
 from papers.utils import validate_orcid
 from publishers.models import Journal
 from publishers.models import Publisher
+from search.queue import mark_paper_dirty
+from search.queue import mark_papers_dirty
 from solo.models import SingletonModel
 
 UPLOAD_TYPE_CHOICES = [
@@ -111,6 +127,10 @@ HARVESTER_TASK_CHOICES = [
    ('stats', _('Updating statistics')),
    ]
 
+# Number of papers whose availability is recomputed at once
+# (see Paper.recompute_availability)
+AVAILABILITY_CHUNK_SIZE = 500
+
 
 class Institution(models.Model):
     """
@@ -144,6 +164,14 @@ class Institution(models.Model):
             self.stats.add(d.stats)
         self.stats.save()
 
+    @classmethod
+    def compute_all_stats(cls):
+        """
+        Computes the access statistics of all institutions at once
+        (see :py:meth:`AccessStatistics.update_all_stats`).
+        """
+        return AccessStatistics.sum_by_group(Department.objects.all(), 'institution')
+
     @property
     def object_id(self):
         """
@@ -194,6 +222,14 @@ class Department(models.Model):
             self.stats.add(r.stats)
         self.stats.save()
 
+    @classmethod
+    def compute_all_stats(cls):
+        """
+        Computes the access statistics of all departments at once
+        (see :py:meth:`AccessStatistics.update_all_stats`).
+        """
+        return AccessStatistics.sum_by_group(Researcher.objects.all(), 'department')
+
     @property
     def object_id(self):
         """
@@ -284,7 +320,10 @@ class Researcher(models.Model):
     def papers(self):
         """
         :py:class:`Paper` objects for this researcher,
-        sorted by decreasing publication date
+        sorted by decreasing publication date.
+        The containment lookup on `authors_list` is backed by a GIN index
+        (the `researchers` relation mirrors it, see
+        :func:`backend.maintenance.check_researcher_links`).
         """
         return Paper.objects.filter(
                 authors_list__contains=[{'researcher_id': self.id}]
@@ -361,6 +400,16 @@ class Researcher(models.Model):
             self.save()
         self.stats.update(self.papers)
 
+    @classmethod
+    def compute_all_stats(cls):
+        """
+        Computes the access statistics of all researchers at once
+        (see :py:meth:`AccessStatistics.update_all_stats`), from the
+        links between papers and researchers (which
+        `check_researcher_links` keeps consistent with the authors).
+        """
+        return AccessStatistics.count_by_group(Paper.objects.all(), 'researchers')
+
     def fetch_everything(self):
         from backend.tasks import fetch_everything_for_researcher
         self.harvester = fetch_everything_for_researcher.delay(pk=self.id).id
@@ -615,9 +664,164 @@ class Paper(models.Model, BarePaper):
     # Task id of the current task updating the metadata of this article (if any)
     task = models.CharField(max_length=512, null=True, blank=True)
 
+    #: In-memory :class:`FingerprintIndex` of all papers, used to avoid
+    #: fingerprint lookups in the database (see :meth:`load_fingerprint_index`)
+    fingerprint_index = None
+
+    #: Fields determining how a paper is counted in access statistics
+    stats_fields = frozenset(['oa_status', 'pdf_url', 'visible', 'authors_list'])
+
     def __init__(self, *args, **kwargs):
         super(Paper, self).__init__(*args, **kwargs)
         self.just_created = False
+        # How this paper is currently counted in the access statistics
+        # (see :meth:`stats_state`), None if unknown
+        self._stats_state = (None, frozenset())
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        paper = super(Paper, cls).from_db(db, field_names, values)
+        if cls.stats_fields.issubset(field_names):
+            paper._stats_state = paper.stats_state()
+        else:
+            paper._stats_state = None
+        return paper
+
+    def save(self, *args, **kwargs):
+        super(Paper, self).save(*args, **kwargs)
+        if Paper.fingerprint_index is not None:
+            Paper.fingerprint_index.add(self.fingerprint, self.pk)
+        self.update_stats_incrementally(kwargs.get('update_fields'))
+
+    def delete(self, *args, **kwargs):
+        if Paper.fingerprint_index is not None:
+            Paper.fingerprint_index.remove(self.fingerprint)
+        if self._stats_state is not None:
+            self.apply_stats_deltas(self._stats_state, (None, frozenset()))
+        mark_paper_dirty(self.pk)
+        return super(Paper, self).delete(*args, **kwargs)
+
+    ### Incremental updates of the access statistics ###
+
+    @property
+    def counted_status(self):
+        """
+        The combined status under which this paper is counted in
+        access statistics, or None if it is not counted (invisible).
+        """
+        if self.visible:
+            return self.combined_status
+
+    def stats_state(self):
+        """
+        How this paper should be counted in access statistics:
+        a pair of its :attr:`counted_status` and the set of
+        ids of its researchers.
+        """
+        researcher_ids = frozenset(
+            a.get('researcher_id') for a in self.authors_list) - {None}
+        return (self.counted_status, researcher_ids)
+
+    def update_stats_incrementally(self, update_fields=None):
+        """
+        Updates the access statistics impacted by the changes saved
+        since the paper was loaded (or last saved). This is called by
+        :meth:`save`. Changes made by bulk operations (which bypass
+        this method) are corrected by the `reconcile_stats` task.
+
+        :param update_fields: the fields which were saved, if not all
+        """
+        old_state = self._stats_state
+        if old_state is None:
+            return
+        new_status, new_researchers = self.stats_state()
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if not update_fields & (self.stats_fields - {'authors_list'}):
+                new_status = old_state[0]
+            if 'authors_list' not in update_fields:
+                new_researchers = old_state[1]
+        self._stats_state = (new_status, new_researchers)
+        self.apply_stats_deltas(old_state, self._stats_state)
+
+    def apply_stats_deltas(self, old_state, new_state):
+        """
+        Increments or decrements the access statistics of all the
+        objects this paper is counted in (its researchers, their
+        departments and institutions, its publishers, journals and the
+        :class:`PaperWorld`) when it moves from one state (see
+        :meth:`stats_state`) to another.
+        """
+        old_status, old_researchers = old_state
+        new_status, new_researchers = new_state
+        if old_status == new_status:
+            affected_researchers = old_researchers ^ new_researchers
+        else:
+            affected_researchers = old_researchers | new_researchers
+
+        changes = defaultdict(list)
+        if affected_researchers:
+            rows = Researcher.objects.filter(
+                pk__in=affected_researchers).values_list(
+                'pk', 'stats_id', 'department__stats_id',
+                'department__institution__stats_id')
+            for row in rows:
+                delta = status_delta(
+                    old_status if row[0] in old_researchers else None,
+                    new_status if row[0] in new_researchers else None)
+                changes[tuple(sorted(delta.items()))].extend(row[1:])
+
+        if old_status != new_status:
+            key = tuple(sorted(status_delta(old_status, new_status).items()))
+            changes[key].append(PaperWorld.get_solo().stats_id)
+            if self.pk is not None:
+                rows = OaiRecord.objects.filter(about_id=self.pk).values_list(
+                    'publisher__stats_id', 'journal__stats_id')
+                # Each publisher and journal counts the paper only once
+                for stats_ids in zip(*rows):
+                    changes[key].extend(set(stats_ids))
+
+        for delta, stats_ids in changes.items():
+            AccessStatistics.increment(stats_ids, dict(delta))
+
+    @classmethod
+    def bulk_save_authors(cls, papers):
+        """
+        Saves the `authors_list` of many papers with a constant number
+        of queries (unlike :meth:`save`), and updates the access
+        statistics of the researchers who were added to or removed
+        from these papers.
+
+        :param papers: saved :class:`Paper` instances whose authors
+            were changed in memory
+        """
+        deltas = defaultdict(Counter)
+        for paper in papers:
+            old_state = paper._stats_state
+            if old_state is None:
+                continue
+            status, old_researchers = old_state
+            new_researchers = paper.stats_state()[1]
+            for researcher_id in new_researchers - old_researchers:
+                deltas[researcher_id].update(status_delta(None, status))
+            for researcher_id in old_researchers - new_researchers:
+                deltas[researcher_id].update(status_delta(status, None))
+            paper._stats_state = (status, new_researchers)
+
+        bulk_update(papers, update_fields=['authors_list'])
+
+        changes = defaultdict(list)
+        if deltas:
+            rows = Researcher.objects.filter(
+                pk__in=deltas.keys()).values_list(
+                'pk', 'stats_id', 'department__stats_id',
+                'department__institution__stats_id')
+            for row in rows:
+                delta = {field: value
+                         for field, value in deltas[row[0]].items() if value}
+                changes[tuple(sorted(delta.items()))].extend(row[1:])
+        for delta, stats_ids in changes.items():
+            AccessStatistics.increment(stats_ids, dict(delta))
 
     ### Relations to other models, reimplemented from :class:`BarePaper` ###
 
@@ -663,6 +867,18 @@ class Paper(models.Model, BarePaper):
             self.researchers.add(author.researcher_id)
         return author
 
+    def set_authors(self, authors):
+        """
+        Replaces the list of authors of the paper, in memory.
+
+        The change is not commited to the database: once the paper is
+        saved, call :meth:`link_researchers` to update the `researchers`
+        relation as well.
+
+        :param authors: the new list of :class:`BareAuthor`
+        """
+        self.authors_list = [a.serialize() for a in authors]
+
     def set_researcher(self, position, researcher_id):
         """
         Sets the researcher_id for the author at the given position
@@ -674,6 +890,47 @@ class Paper(models.Model, BarePaper):
         self.save(update_fields=['authors_list'])
         self.researchers.add(researcher_id)
 
+    def link_researchers(self):
+        """
+        Adds the researchers found in `authors_list` to the `researchers`
+        relation, with a constant number of queries (see
+        :meth:`bulk_link_researchers`).
+        """
+        Paper.bulk_link_researchers([self])
+
+    @classmethod
+    def bulk_link_researchers(cls, papers):
+        """
+        Adds the researchers found in the `authors_list` of many (saved)
+        papers to their `researchers` relation, with two queries: the
+        existing links are fetched first and the missing ones are created
+        in bulk (`bulk_create` cannot ignore conflicts in our version of
+        Django).
+        """
+        Link = Paper.researchers.through
+        links = set((p.pk, a['researcher_id'])
+                    for p in papers for a in p.authors_list
+                    if a.get('researcher_id'))
+        if not links:
+            return
+        existing = set(Link.objects.filter(
+            paper_id__in=set(paper_id for paper_id, _ in links),
+            researcher_id__in=set(researcher_id for _, researcher_id in links)
+            ).values_list('paper_id', 'researcher_id'))
+        missing = links - existing
+        if not missing:
+            return
+        try:
+            with transaction.atomic():
+                Link.objects.bulk_create([
+                    Link(paper_id=paper_id, researcher_id=researcher_id)
+                    for paper_id, researcher_id in missing])
+        except IntegrityError:
+            # Some links were created concurrently
+            for paper_id, researcher_id in missing:
+                Link.objects.get_or_create(paper_id=paper_id,
+                                           researcher_id=researcher_id)
+
     def add_oairecord(self, oairecord):
         """
         Adds a record (possibly bare) to the paper, by saving it in
@@ -715,8 +972,37 @@ class Paper(models.Model, BarePaper):
 
     @classmethod
     def find_by_fingerprint(cls, fp):
+        """
+        Returns the queryset of papers with the given fingerprint.
+        When the fingerprint index is loaded, no query is made if
+        the fingerprint is not in the index.
+        """
+        if (Paper.fingerprint_index is not None and
+                fp not in Paper.fingerprint_index):
+            return Paper.objects.none()
         return Paper.objects.filter(fingerprint__exact=fp)
 
+    @classmethod
+    def load_fingerprint_index(cls):
+        """
+        Loads the fingerprints of all papers in memory, so that
+        :meth:`find_by_fingerprint` only queries the database for
+        fingerprints which are known to exist. The index is kept
+        up to date by the papers saved and deleted in this process:
+        it should only be used for bulk imports where no other process
+        creates papers concurrently.
+        """
+        pairs = Paper.objects.order_by('fingerprint').values_list(
+                    'fingerprint', 'id').iterator()
+        Paper.fingerprint_index = FingerprintIndex(pairs)
+
+    @classmethod
+    def drop_fingerprint_index(cls):
+        """
+        Frees the fingerprint index loaded by :meth:`load_fingerprint_index`.
+        """
+        Paper.fingerprint_index = None
+
     @classmethod
     def from_bare(cls, paper):
         """
@@ -741,10 +1027,12 @@ class Paper(models.Model, BarePaper):
                         save_now=False)
                 for record in paper.oairecords:
                     p.add_oairecord(record)
-                p.update_availability()  # in Paper, this saves to the db
+                # in Paper, this saves to the db
+                p.update_availability(update_fields=['authors_list', 'visible'])
             else:  # Otherwise we create a new paper
                 # this already saves the paper in the db
                 p = super(Paper, cls).from_bare(paper)
+            p.link_researchers()
 
             return p
 
@@ -752,6 +1040,72 @@ class Paper(models.Model, BarePaper):
             raise ValueError(
                 'Invalid paper, does not fit in the database schema:\n'+unicode(e))
 
+    @classmethod
+    def bulk_create_from_bare(cls, bare_papers):
+        """
+        Saves many bare papers at once, with a constant number of queries.
+        Unlike :meth:`from_bare`, this does not look for existing papers or
+        records to merge with: the caller has to make sure that none of the
+        fingerprints, record identifiers and DOIs are already in the
+        database. It should be run inside a transaction.
+
+        :returns: the list of :class:`Paper` instances created.
+        """
+        papers = []
+        for bare in bare_papers:
+            bare.update_availability()
+            bare.fingerprint = bare.new_fingerprint()
+            p = cls(**dict((f, getattr(bare, f)) for f in cls._bare_fields))
+            p.authors_list = [a.serialize() for a in bare.authors]
+            p.just_created = True
+            papers.append(p)
+
+        try:
+            papers = Paper.objects.bulk_create(papers)
+
+            researcher_links = []
+            records = []
+            for p, bare in zip(papers, bare_papers):
+                for researcher_id in set(a['researcher_id'] for a in p.authors_list
+                                         if a['researcher_id']):
+                    researcher_links.append(Paper.researchers.through(
+                        paper_id=p.pk, researcher_id=researcher_id))
+                for r in bare.oairecords:
+                    r.cleanup_description()
+                    records.append(OaiRecord(
+                        about=p,
+                        source=r.source,
+                        identifier=r.identifier,
+                        splash_url=r.splash_url,
+                        pdf_url=r.pdf_url,
+                        description=r.description,
+                        keywords=r.keywords,
+                        contributors=r.contributors,
+                        pubtype=r.pubtype,
+                        priority=r.source.priority,
+                        journal_title=r.journal_title,
+                        container=r.container,
+                        publisher_name=r.publisher_name,
+                        issue=r.issue,
+                        volume=r.volume,
+                        pages=r.pages,
+                        doi=r.doi,
+                        publisher=r.publisher,
+                        journal=r.journal,
+                        ))
+            Paper.researchers.through.objects.bulk_create(researcher_links)
+            for r in records:
+                r.update_short_urls()
+            OaiRecord.objects.bulk_create(records)
+            if Paper.fingerprint_index is not None:
+                for p in papers:
+                    Paper.fingerprint_index.add(p.fingerprint, p.pk)
+            mark_papers_dirty([p.pk for p in papers])
+        except DataError as e:
+            raise ValueError(
+                'Invalid paper, does not fit in the database schema:\n'+unicode(e))
+        return papers
+
     ### Other methods, specific to this non-bare subclass ###
 
     def update_author_stats(self):
@@ -795,21 +1149,123 @@ class Paper(models.Model, BarePaper):
     def is_deposited(self):
         return self.successful_deposits().count() > 0
 
-    def update_availability(self, cached_oairecords=[]):
+    def update_availability(self, cached_oairecords=[], update_fields=[]):
         """
         Updates the :class:`Paper`'s own `pdf_url` field
         based on its sources (:class:`OaiRecord`).
 
         This uses a non-trivial logic, hence it is useful to keep this result cached
-        in the database row.
+        in the database row. Only the fields which changed are saved. The cache
+        is invalidated and the paper reindexed in any case, as the caller may
+        have changed the records displayed with it.
 
         :param cached_oairecords: if the list of oairecords
                 to be considered is already available to the caller,
                 it can pass it to this function to save a db query
+        :param update_fields: other fields modified by the caller,
+                to be saved with the availability
         """
+        before = [getattr(self, f) for f in self.availability_fields]
         super(Paper, self).update_availability(cached_oairecords)
-        self.save()
+        changed = [f for f, value in zip(self.availability_fields, before)
+                   if getattr(self, f) != value]
+        changed += [f for f in update_fields if f not in changed]
+        if self.pk is None:
+            self.save()
+        elif changed:
+            self.save(update_fields=changed+['last_modified'])
         self.invalidate_cache()
+        mark_paper_dirty(self.pk)
+
+    #: Fields computed by :meth:`update_availability`
+    availability_fields = ['pdf_url', 'oa_status', 'doctype', 'visible']
+
+    @classmethod
+    def recompute_availability(cls, paper_ids, chunk_size=AVAILABILITY_CHUNK_SIZE):
+        """
+        Recomputes the availability of many papers, chunk by chunk
+        (see :meth:`bulk_update_availability`).
+
+        :param paper_ids: the ids of the papers to update
+        :returns: the number of papers whose availability changed
+        """
+        paper_ids = list(paper_ids)
+        nb_changed = 0
+        for i in range(0, len(paper_ids), chunk_size):
+            papers = cls.with_availability_records(
+                cls.objects.filter(pk__in=paper_ids[i:i+chunk_size]))
+            nb_changed += len(cls.bulk_update_availability(papers))
+        return nb_changed
+
+    @classmethod
+    def with_availability_records(cls, queryset):
+        """
+        Prefetches what :meth:`bulk_update_availability` needs:
+        the records of the papers, with their publishers and journals.
+        """
+        return queryset.prefetch_related(Prefetch(
+            'oairecord_set',
+            queryset=OaiRecord.objects.select_related('publisher', 'journal')))
+
+    @classmethod
+    def bulk_update_availability(cls, papers):
+        """
+        Updates the availability of many papers (see :meth:`update_availability`)
+        with a constant number of queries. Only the papers whose availability
+        changed are saved, removed from the cache and reindexed, and the access
+        statistics are updated with the aggregated changes.
+
+        :param papers: :class:`Paper` instances whose records were prefetched
+            (see :meth:`with_availability_records`)
+        :returns: the list of papers that changed
+        """
+        changed = []
+        for paper in papers:
+            before = [getattr(paper, f) for f in cls.availability_fields]
+            super(Paper, paper).update_availability(paper.oairecord_set.all())
+            if [getattr(paper, f) for f in cls.availability_fields] != before:
+                changed.append(paper)
+        if not changed:
+            return changed
+
+        bulk_update(changed, update_fields=cls.availability_fields)
+
+        # Group the stats to update by change of status
+        transitions = defaultdict(list)
+        researcher_ids = set()
+        for paper in changed:
+            old_state = paper._stats_state
+            if old_state is None:
+                continue
+            new_status = paper.counted_status
+            paper._stats_state = (new_status, old_state[1])
+            if old_state[0] != new_status:
+                transitions[(old_state[0], new_status)].append(paper)
+                researcher_ids |= old_state[1]
+        researcher_stats = defaultdict(list)
+        if researcher_ids:
+            for row in Researcher.objects.filter(pk__in=researcher_ids).values_list(
+                    'pk', 'stats_id', 'department__stats_id',
+                    'department__institution__stats_id'):
+                researcher_stats[row[0]] = row[1:]
+        world_stats_id = PaperWorld.get_solo().stats_id if transitions else None
+        for (old_status, new_status), transition_papers in transitions.items():
+            stats_ids = [world_stats_id]*len(transition_papers)
+            for paper in transition_papers:
+                for researcher_id in paper._stats_state[1]:
+                    stats_ids.extend(researcher_stats[researcher_id])
+                records = paper.oairecord_set.all()
+                # Each publisher and journal counts the paper only once
+                stats_ids.extend(set(r.publisher.stats_id
+                                     for r in records if r.publisher))
+                stats_ids.extend(set(r.journal.stats_id
+                                     for r in records if r.journal))
+            AccessStatistics.increment(
+                stats_ids, status_delta(old_status, new_status))
+
+        cls.bulk_invalidate_cache(changed)
+        mark_papers_dirty([p.pk for p in changed])
+        return changed
 
     def status_helptext(self):
         """
@@ -855,10 +1311,11 @@ class Paper(models.Model, BarePaper):
     def successful_deposits(self):
         return self.depositrecord_set.filter(pdf_url__isnull=False)
 
-    def invalidate_cache(self):
+    def cache_keys(self):
         """
-        Invalidate the HTML cache for all the publications of this researcher.
+        The keys of the HTML fragments of this paper in the cache.
         """
+        keys = []
         for a in self.authors+[None]:
             rpk = None
             if a:
@@ -867,9 +1324,27 @@ class Paper(models.Model, BarePaper):
                 else:
                     rpk = a.researcher_id
             for lang in POSSIBLE_LANGUAGE_CODES:
-                key = make_template_fragment_key(
-                    'publiListItem', [self.pk, lang, rpk])
-                cache.delete(key)
+                keys.append(make_template_fragment_key(
+                    'publiListItem', [self.pk, lang, rpk]))
+        return keys
+
+    def invalidate_cache(self):
+        """
+        Invalidate the HTML cache for all the publications of this researcher.
+        """
+        for key in self.cache_keys():
+            cache.delete(key)
+
+    @classmethod
+    def bulk_invalidate_cache(cls, papers):
+        """
+        Invalidates the HTML cache of many papers at once.
+        """
+        keys = []
+        for paper in papers:
+            keys.extend(paper.cache_keys())
+        if keys:
+            cache.delete_many(keys)
 
     def update_authors(self,
                        new_authors,
@@ -952,7 +1427,7 @@ class Paper(models.Model, BarePaper):
         copied.delete()
 
         paper.id = self.id
-        self.update_availability()
+        self.update_availability(update_fields=['authors_list', 'visible'])
 
     def recompute_fingerprint_and_merge_if_needed(self):
         """
@@ -964,7 +1439,7 @@ class Paper(models.Model, BarePaper):
         new_fingerprint = self.new_fingerprint()
         if self.fingerprint == new_fingerprint:
             return
-        match = Paper.objects.filter(fingerprint=new_fingerprint).first()
+        match = Paper.find_by_fingerprint(new_fingerprint).first()
         if match is None:
             self.fingerprint = new_fingerprint
             self.save(update_fields=['fingerprint'])
@@ -1026,6 +1501,167 @@ class OaiSource(CachingMixin, models.Model):
         verbose_name = "OAI source"
 
 
+class OaiHarvestCheckpoint(models.Model):
+    """
+    Progress of a harvest from an OAI-PMH endpoint, saved after every
+    page of records so that an interrupted harvest can be resumed
+    (see :meth:`backend.oai.OaiPaperSource.resume`).
+    """
+    endpoint = models.CharField(max_length=512)
+    metadata_prefix = models.CharField(max_length=64)
+    #: Identifies one of the date windows of a parallel harvest
+    #: (empty for regular harvests)
+    partition = models.CharField(max_length=64, blank=True, default='')
+
+    #: Resumption token fetching the first page which has not been
+    #: fully processed yet (None when the harvest is complete)
+    resumption_token = models.CharField(max_length=1024, null=True, blank=True)
+    #: Datestamp from which the harvest can be restarted: the beginning
+    #: of the harvest while it is in progress, the highest datestamp of
+    #: its records once it is complete
+    last_datestamp = models.DateTimeField(null=True, blank=True)
+    #: Upper bound of the harvest, if any
+    until_date = models.DateTimeField(null=True, blank=True)
+
+    last_update = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return '%s (%s) %s' % (self.endpoint, self.metadata_prefix, self.partition)
+
+    class Meta:
+        unique_together = (('endpoint', 'metadata_prefix', 'partition'),)
+        verbose_name = "OAI harvest checkpoint"
+
+
+class DoiMetadata(models.Model):
+    """
+    Local cache of the metadata fetched for DOIs (from CrossRef, the
+    DOI proxy or Zotero), stored as compressed JSON. DOIs for which no
+    metadata was found are cached too (with a shorter expiration),
+    to avoid requesting them again and again.
+    """
+    doi = models.CharField(max_length=1024)
+    #: The type of metadata: 'citeproc' or 'zotero'
+    kind = models.CharField(max_length=16, default='citeproc')
+    #: zlib-compressed JSON, None if no metadata was found
+    compressed_metadata = models.BinaryField(null=True)
+    last_update = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def get_many(cls, dois, kind='citeproc'):
+        """
+        Fetches the cached metadata of many DOIs with one query.
+
+        :returns: a dictionary mapping each DOI found in the cache (and
+            not expired) to its metadata, or to `None` if it is known to
+            have no metadata. DOIs which need to be fetched again are
+            not in the dictionary.
+        """
+        keys = {doi.lower(): doi for doi in dois if doi}
+        if not keys:
+            return {}
+        now = timezone.now()
+        result = {}
+        entries = cls.objects.filter(doi__in=keys.keys(), kind=kind)
+        for entry in entries:
+            if entry.compressed_metadata is None:
+                if now - entry.last_update > DOI_METADATA_NEGATIVE_CACHE_TTL:
+                    continue
+                result[keys[entry.doi]] = None
+            elif now - entry.last_update <= DOI_METADATA_CACHE_TTL:
+                result[keys[entry.doi]] = json.loads(
+                    zlib.decompress(bytes(entry.compressed_metadata)))
+        return result
+
+    @classmethod
+    def get(cls, doi, kind='citeproc'):
+        """
+        Fetches the cached metadata of a DOI.
+
+        :returns: a pair (found, metadata), where found is `False` if the
+            DOI is not in the cache (or has expired), and metadata is `None`
+            if the DOI is known to have no metadata.
+        """
+        result = cls.get_many([doi], kind)
+        return (doi in result, result.get(doi))
+
+    @classmethod
+    def set_many(cls, metadata, kind='citeproc'):
+        """
+        Stores the metadata of many DOIs in the cache, replacing any
+        previous entry.
+
+        :param metadata: a dictionary mapping DOIs to their metadata,
+            or to `None` if no metadata was found for them
+        """
+        entries = [cls(doi=doi.lower(), kind=kind,
+                       compressed_metadata=(
+                           zlib.compress(json.dumps(value))
+                           if value is not None else None))
+                   for doi, value in metadata.items() if doi]
+        if not entries:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.filter(
+                    doi__in=[e.doi for e in entries], kind=kind).delete()
+                cls.objects.bulk_create(entries)
+        except IntegrityError:
+            # Another worker stored some of these DOIs in the meantime:
+            # store them one by one instead
+            for entry in entries:
+                try:
+                    with transaction.atomic():
+                        cls.objects.update_or_create(
+                            doi=entry.doi, kind=kind,
+                            defaults={'compressed_metadata':
+                                      entry.compressed_metadata})
+                except IntegrityError:
+                    # The other worker's entry is just as fresh
+                    pass
+
+    @classmethod
+    def set(cls, doi, metadata, kind='citeproc'):
+        """
+        Stores the metadata of a DOI in the cache (`None` if no metadata
+        was found).
+        """
+        cls.set_many({doi: metadata}, kind)
+
+    def __unicode__(self):
+        return '%s (%s)' % (self.doi, self.kind)
+
+    class Meta:
+        unique_together = (('doi', 'kind'),)
+        verbose_name = "DOI metadata"
+        verbose_name_plural = "DOI metadata"
+
+
+https_re = re.compile(r'https?(.*)')
+
+
+def shorten_url(url):
+    """
+    Normalizes an url to find duplicate records:
+    removes the 'https?' prefix or converts to DOI.
+
+    >>> shorten_url('https://dissem.in/faq')
+    u'://dissem.in/faq'
+    >>> shorten_url('http://dx.doi.org/10.1007/BF02702259')
+    u'10.1007/bf02702259'
+    >>> shorten_url('ftp://dissem.in/paper.pdf') is None
+    True
+    """
+    if not url:
+        return
+    doi = to_doi(url)
+    if doi:
+        return doi
+    match = https_re.match(url.strip())
+    if match:
+        return match.group(1)
+
+
 class OaiRecord(models.Model, BareOaiRecord):
     source = models.ForeignKey(OaiSource)
     about = models.ForeignKey(Paper)
@@ -1061,10 +1697,122 @@ class OaiRecord(models.Model, BareOaiRecord):
     # Cached version of source.priority
     priority = models.IntegerField(default=1)
 
+    # Normalized versions of the urls, used to find duplicate records
+    # (see :func:`shorten_url`)
+    short_splash_url = models.CharField(max_length=1024, null=True, blank=True)
+    short_pdf_url = models.CharField(max_length=1024, null=True, blank=True)
+
+    #: The paper, publisher and journal this record links together,
+    #: as last saved (None if unknown)
+    _stats_links = (None, None, None)
+    stats_link_fields = ('about', 'publisher', 'journal')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        record = super(OaiRecord, cls).from_db(db, field_names, values)
+        if all(f+'_id' in field_names for f in cls.stats_link_fields):
+            record._stats_links = record.stats_links()
+        else:
+            record._stats_links = None
+        return record
+
+    def save(self, *args, **kwargs):
+        self.update_short_urls()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # the short urls have to be saved with the urls they derive from
+            update_fields = list(update_fields)
+            for field in ['splash_url', 'pdf_url']:
+                if field in update_fields and 'short_'+field not in update_fields:
+                    update_fields.append('short_'+field)
+            kwargs['update_fields'] = update_fields
+        super(OaiRecord, self).save(*args, **kwargs)
+        self.update_stats_incrementally(kwargs.get('update_fields'))
+
+    def update_short_urls(self):
+        """
+        Updates the normalized urls from the splash and pdf urls.
+        This is done by :meth:`save`, but needs to be called explicitly
+        before bulk creations.
+        """
+        self.short_splash_url = shorten_url(self.splash_url)
+        self.short_pdf_url = shorten_url(self.pdf_url)
+
+    def delete(self, *args, **kwargs):
+        if self._stats_links is not None:
+            self.apply_stats_deltas(self._stats_links, (None, None, None))
+        return super(OaiRecord, self).delete(*args, **kwargs)
+
     def update_priority(self):
         super(OaiRecord, self).update_priority()
         self.save(update_fields=['priority'])
 
+    ### Incremental updates of the access statistics ###
+
+    def stats_links(self):
+        """
+        The ids of the paper, publisher and journal linked by this record.
+        """
+        return tuple(getattr(self, f+'_id') for f in self.stats_link_fields)
+
+    def update_stats_incrementally(self, update_fields=None):
+        """
+        Updates the statistics of the publishers and journals when
+        this record starts or stops linking them to a paper.
+        This is called by :meth:`save`.
+
+        :param update_fields: the fields which were saved, if not all
+        """
+        old_links = self._stats_links
+        if old_links is None:
+            return
+        new_links = self.stats_links()
+        if update_fields is not None:
+            new_links = tuple(
+                new if (f in update_fields or f+'_id' in update_fields) else old
+                for f, old, new in zip(self.stats_link_fields, old_links, new_links))
+        self._stats_links = new_links
+        self.apply_stats_deltas(old_links, new_links)
+
+    def apply_stats_deltas(self, old_links, new_links):
+        """
+        Increments or decrements the statistics of the publisher
+        and journal of this record when its links change (a paper
+        is counted once by each publisher and journal).
+        """
+        for idx, model in [(1, Publisher), (2, Journal)]:
+            old_link = (old_links[0], old_links[idx])
+            new_link = (new_links[0], new_links[idx])
+            if old_link == new_link:
+                continue
+            if None not in old_link:
+                self.apply_link_delta(model, old_link, removed=True)
+            if None not in new_link:
+                self.apply_link_delta(model, new_link, removed=False)
+
+    def apply_link_delta(self, model, link, removed):
+        paper_id, target_id = link
+        field = model._meta.model_name
+        other_records = OaiRecord.objects.filter(
+            about_id=paper_id, **{field+'_id': target_id})
+        if self.pk is not None:
+            other_records = other_records.exclude(pk=self.pk)
+        if other_records.exists():
+            # the paper is counted through another record anyway
+            return
+
+        paper = Paper.objects.filter(pk=paper_id).only(
+            'oa_status', 'pdf_url', 'visible').first()
+        if paper is None or paper.counted_status is None:
+            return
+        if removed:
+            delta = status_delta(paper.counted_status, None)
+        else:
+            delta = status_delta(None, paper.counted_status)
+        stats_id = model.objects.filter(pk=target_id).values_list(
+            'stats_id', flat=True).first()
+        AccessStatistics.increment([stats_id], delta)
+
     @classmethod
     def new(cls, **kwargs):
         """
@@ -1093,23 +1841,15 @@ class OaiRecord(models.Model, BareOaiRecord):
         splash_url = kwargs['splash_url']
         pdf_url = kwargs.get('pdf_url')
 
-        # Has the paper we are trying to add a record to been just
-        # created? If so, we should not search for duplicate records in
-        # the paper itself.
-        match = None
-        if not about.just_created:
-            # Search for duplicate records
-            match = OaiRecord.find_duplicate_records(
-                    about,
-                    splash_url,
-                    pdf_url)
-
-        # We don't search for records with the same identifier yet,
-        # we will rather catch the exception thrown by the DB
-        if not match:
-            same_identifier = OaiRecord.objects.filter(identifier=identifier)
-            if same_identifier:
-                match = same_identifier[0]
+        # Search for duplicate records, with the same urls in the paper
+        # or with the same identifier. Has the paper we are trying to add
+        # a record to been just created? If so, we should not search for
+        # duplicate records in the paper itself.
+        match = OaiRecord.find_duplicate_records(
+                None if about.just_created else about,
+                splash_url,
+                pdf_url,
+                identifier=identifier)
 
         if not match:
             # Otherwise create a new record
@@ -1191,46 +1931,75 @@ class OaiRecord(models.Model, BareOaiRecord):
             return match
 
     @classmethod
-    def find_duplicate_records(cls, paper, splash_url, pdf_url):
+    def find_duplicate_records(cls, paper, splash_url, pdf_url, identifier=None):
         """
         Finds duplicate OAI records. These duplicates can have a different identifier,
         or slightly different urls (for instance https:// instead of http://).
+        This runs a single query, using the normalized urls stored in the records.
 
-        :param paper: the :class:`Paper` the record is about
+        :param paper: the :class:`Paper` the record is about (if `None`,
+            only records with the same identifier are found)
         :param splash_url: the splash url of the target record (link to the metadata page)
         :param pdf_url: the url of the PDF, if known (otherwise `None`)
+        :param identifier: the identifier of the target record, if known.
+            Records of the paper with the same urls take precedence over
+            records with the same identifier.
         """
-        https_re = re.compile(r'https?(.*)')
-
-        def shorten(url):
-            """
-            removes the 'https?' prefix or converts to DOI
-            """
-            if not url:
-                return
-            doi = to_doi(url)
-            if doi:
-                return doi
-            match = https_re.match(url.strip())
-            if match:
-                return match.group(1)
-
-        short_splash = shorten(splash_url)
-        short_pdf = shorten(pdf_url)
-
-        if short_splash == None or paper == None:
-            return
+        return cls.find_duplicate_records_batch(
+            [(paper, splash_url, pdf_url, identifier)])[0]
 
-        for record in paper.oairecord_set.all():
-            short_splash2 = shorten(record.splash_url)
-            short_pdf2 = shorten(record.pdf_url)
-            if (short_splash == short_splash2 or
-                (short_pdf is not None and
-                 short_pdf2 == short_pdf)):
-                return record
+    @classmethod
+    def find_duplicate_records_batch(cls, records):
+        """
+        Finds duplicate OAI records (see :meth:`find_duplicate_records`)
+        for many incoming records at once, with a single query.
+
+        :param records: a list of (paper, splash_url, pdf_url, identifier)
+            tuples, where paper and identifier can be `None`
+        :returns: the list of the duplicates found for each record
+            (`None` when there is no duplicate)
+        """
+        keys = []
+        conditions = []
+        for paper, splash_url, pdf_url, identifier in records:
+            short_splash = shorten_url(splash_url)
+            short_pdf = shorten_url(pdf_url)
+            if short_splash is None or paper is None:
+                keys.append((None, None, None, identifier))
+            else:
+                keys.append((paper.pk, short_splash, short_pdf, identifier))
+                urls = Q(short_splash_url=short_splash)
+                if short_pdf is not None:
+                    urls |= Q(short_pdf_url=short_pdf)
+                conditions.append(Q(about_id=paper.pk) & urls)
+            if identifier:
+                conditions.append(Q(identifier=identifier))
+
+        if not conditions:
+            return [None] * len(records)
+
+        candidates = list(cls.objects.filter(
+            reduce(operator.or_, conditions)).order_by('pk'))
+        matches = []
+        for paper_id, short_splash, short_pdf, identifier in keys:
+            match = None
+            if paper_id is not None:
+                match = next((c for c in candidates if c.about_id == paper_id and
+                              (c.short_splash_url == short_splash or
+                               (short_pdf is not None and
+                                c.short_pdf_url == short_pdf))), None)
+            if match is None and identifier:
+                match = next((c for c in candidates
+                              if c.identifier == identifier), None)
+            matches.append(match)
+        return matches
 
     class Meta:
         verbose_name = "OAI record"
+        index_together = [
+            ('about', 'short_splash_url'),
+            ('about', 'short_pdf_url'),
+        ]
 
 
 def create_default_stats():
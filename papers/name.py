@@ -20,6 +20,9 @@
 
 from __future__ import unicode_literals
 
+from collections import namedtuple
+from collections import OrderedDict
+import functools
 import re
 
 import name_tools
@@ -259,6 +262,114 @@ def name_signature(first, last):
         ident = iunaccent(first[0])+'-'+ident
     return ident
 
+### Parsed names and caches ###
+
+#: Maximum number of parsed names kept in memory
+NAME_CACHE_SIZE = 100000
+#: Maximum number of results kept in memory for each function of two names
+NAME_PAIR_CACHE_SIZE = 100000
+
+
+class LRUCache(object):
+    """
+    A dictionary with a maximum size, evicting the least recently
+    used entries first.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            return default
+        self.entries[key] = value
+        return value
+
+    def set(self, key, value):
+        self.entries.pop(key, None)
+        if len(self.entries) >= self.size:
+            self.entries.popitem(last=False)
+        self.entries[key] = value
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def memoized(size):
+    """
+    Caches the results of a function in an :class:`LRUCache` of the given
+    size, keyed by its (positional) arguments. The results must not be
+    mutated by the callers. The cache is available as the `cache`
+    attribute of the decorated function.
+    """
+    def decorator(func):
+        cache = LRUCache(size)
+        missing = object()
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            try:
+                result = cache.get(args, missing)
+            except TypeError:  # unhashable arguments
+                return func(*args)
+            if result is missing:
+                result = func(*args)
+                cache.set(args, result)
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+ParsedName = namedtuple('ParsedName', [
+    'last',  # unaccented, lowercase last name
+    'last_words',  # set of the words of the last name
+    'first_words',  # unaccented, lowercase words of the first name
+    'expanded',  # for each of these words, is it more than an initial?
+    'initials',  # first letter of each word of the first name
+    'raw_first_words',  # words of the first name, as written
+    'raw_separators',  # separators between them
+    ])
+
+
+@memoized(NAME_CACHE_SIZE)
+def parse_name(first, last):
+    """
+    Splits and normalizes a name once for all the similarity and
+    unification functions below (the result is cached, and should not
+    be modified).
+
+    >>> name = parse_name('Jean-Pierre', 'Lévy')
+    >>> name.last
+    u'levy'
+    >>> name.first_words
+    (u'jean', u'pierre')
+    >>> name.initials
+    (u'J', u'P')
+    >>> name.raw_separators
+    (u'-',)
+    """
+    # iunaccent returns str for unicode input
+    last_key = unicode(iunaccent(last))
+    first_words, _ = split_name_words(unicode(iunaccent(first)))
+    raw_words, raw_separators = split_name_words(first)
+    return ParsedName(
+        last=last_key,
+        last_words=frozenset(split_name_words(last_key)[0]),
+        first_words=tuple(first_words),
+        expanded=tuple(len(w) > 1 for w in first_words),
+        initials=tuple(w[0] for w in raw_words),
+        raw_first_words=tuple(raw_words),
+        raw_separators=tuple(raw_separators))
+
+
 ### Name similarity measure ###
 
 weight_initial_match = 0.4
@@ -308,21 +419,22 @@ def name_similarity(a, b):
 
     if not a or not b or len(a) != 2 or len(b) != 2:
         return False
-    firstA, lastA = a
-    firstB, lastB = b
-    firstA = iunaccent(firstA)
-    firstB = iunaccent(firstB)
-    lastA = iunaccent(lastA)
-    lastB = iunaccent(lastB)
-    if lastA != lastB:
+    return _name_similarity(tuple(a), tuple(b))
+
+
+@memoized(NAME_PAIR_CACHE_SIZE)
+def _name_similarity(a, b):
+    nameA = parse_name(*a)
+    nameB = parse_name(*b)
+    if nameA.last != nameB.last:
         return 0.
-    partsA, sepsA = split_name_words(firstA)
-    partsB, sepsB = split_name_words(firstB)
+    partsA, expandedA = nameA.first_words, nameA.expanded
+    partsB, expandedB = nameB.first_words, nameB.expanded
     parts = zip(partsA, partsB)
     if not all(map(match_first_names, parts)):
         # Try to match in reverse
-        partsA.reverse()
-        partsB.reverse()
+        partsA, expandedA = partsA[::-1], expandedA[::-1]
+        partsB, expandedB = partsB[::-1], expandedB[::-1]
         parts = zip(partsA, partsB)
         if not all(map(match_first_names, parts)):
             return 0.
@@ -333,13 +445,13 @@ def name_similarity(a, b):
     for i in range(maxlen):
         if i < len(parts):
             sumscores += weight_first_names(parts[i])
-            expanded.append((len(partsA[i]) > 1, len(partsB[i]) > 1))
+            expanded.append((expandedA[i], expandedB[i]))
         elif i < len(partsA):
             sumscores -= 0.25*weight_first_name(partsA[i])
-            expanded.append((len(partsA[i]) > 1, False))
+            expanded.append((expandedA[i], False))
         else:
             sumscores -= 0.25*weight_first_name(partsB[i])
-            expanded.append((False, len(partsB[i]) > 1))
+            expanded.append((False, expandedB[i]))
 
     # Make sure expanded first names of A are included in that of B
     # or that of B and included in that of A
@@ -361,30 +473,29 @@ def shallower_name_similarity(a, b):
     """
     if not a or not b or len(a) != 2 or len(b) != 2:
         return False
-    firstA, lastA = a
-    firstB, lastB = b
+    return _shallower_name_similarity(tuple(a), tuple(b))
+
+
+@memoized(NAME_PAIR_CACHE_SIZE)
+def _shallower_name_similarity(a, b):
+    nameA = parse_name(*a)
+    nameB = parse_name(*b)
 
     # Matching last names
-    lastA = iunaccent(lastA)
-    lastB = iunaccent(lastB)
-    wordsA, sepA = split_name_words(lastA)
-    wordsB, sepB = split_name_words(lastB)
-    wordsA = set(wordsA)
-    wordsB = set(wordsB)
+    wordsA = nameA.last_words
+    wordsB = nameB.last_words
     if not wordsA or not wordsB:
         return False
     ratio = float(len(wordsA & wordsB)) / len(wordsA | wordsB)
 
-    partsA, sepsA = split_name_words(firstA)
-    partsB, sepsB = split_name_words(firstB)
-    partsA = map(lambda x: x[0], partsA)
-    partsB = map(lambda x: x[0], partsB)
+    partsA = nameA.initials
+    partsB = nameB.initials
 
     parts = zip(partsA, partsB)
     if not all(map(match_first_names, parts)):
         # Try to match in reverse
-        partsA.reverse()
-        partsB.reverse()
+        partsA = partsA[::-1]
+        partsB = partsB[::-1]
         parts = zip(partsA, partsB)
         if not all(map(match_first_names, parts)):
             return 0.
@@ -555,14 +666,20 @@ def name_unification(a, b):
     :param b: the second name pair (idem)
     :returns: a unified name pair.
     """
-    firstA, lastA = a
-    firstB, lastB = b
+    return _name_unification(tuple(a), tuple(b))
 
-    if remove_diacritics(lastA).lower() != remove_diacritics(lastB).lower():
+
+@memoized(NAME_PAIR_CACHE_SIZE)
+def _name_unification(a, b):
+    nameA = parse_name(*a)
+    nameB = parse_name(*b)
+    lastA = a[1]
+
+    if nameA.last != nameB.last:
         return None
 
-    wordsA, sepsA = split_name_words(firstA)
-    wordsB, sepsB = split_name_words(firstB)
+    wordsA, sepsA = list(nameA.raw_first_words), list(nameA.raw_separators)
+    wordsB, sepsB = list(nameB.raw_first_words), list(nameB.raw_separators)
 
     def keep_best(pair):
         a, b = pair
@@ -611,19 +728,33 @@ def name_unification(a, b):
     return None
 
 
-def unify_name_lists(a, b):
+def unify_name_lists(a, b, fast_path=True):
     """
     Unify two name lists, by matching compatible names and unifying them, and inserting the other names as they are.
-    The names are sorted by average rank in the two lists.
+    The names are sorted by average rank in the two lists (the rank of a name at index `i`
+    in a list of `n` names being `(i+1)/n`).
 
+    When the lists are identical, or when one of them extends the other
+    with names that cannot be matched with the common ones, the common
+    names are unified with themselves without comparing the other names.
+    This gives the same result as the general case.
+
+    :param fast_path: set to False to always compare the names (useful
+        for benchmarking)
     :returns: the unified list of pairs: the first component is the unified name (a pair itself),
               the second is the pair of indices from the original lists this name was created from
               (None when there is no corresponding name in one of the lists).
     """
-    # TODO some normalization of last names? for instance case, hyphens…
+    a = map(tuple, a)
+    b = map(tuple, b)
+
+    if fast_path:
+        result = _unify_prefix_name_lists(a, b)
+        if result is not None:
+            return list(_make_unique(result))
 
-    a = sorted(enumerate(a), key=lambda (idx, (first, last)): (last, first))
-    b = sorted(enumerate(b), key=lambda (idx, (first, last)): (last, first))
+    a = sorted(enumerate(a), key=_unification_sort_key)
+    b = sorted(enumerate(b), key=_unification_sort_key)
 
     iA = 0
     iB = 0
@@ -634,12 +765,12 @@ def unify_name_lists(a, b):
         if iA == len(a):
             idxB = b[iB][0]
             rankB = (idxB+1)/lenB
-            result.append((b[iB][1], (rankB+1)/lenB, (None, iB)))
+            result.append((b[iB][1], rankB, (None, idxB)))
             iB += 1
         elif iB == len(b):
             idxA = a[iA][0]
             rankA = (idxA+1)/lenA
-            result.append((a[iA][1], (rankA+1)/lenA, (iA, None)))
+            result.append((a[iA][1], rankA, (idxA, None)))
             iA += 1
         else:
             idxA = a[iA][0]
@@ -648,25 +779,15 @@ def unify_name_lists(a, b):
             nameB = b[iB][1]
             rankA = (idxA+1)/lenA
             rankB = (idxB+1)/lenB
+            lastA = parse_name(*nameA).last
+            lastB = parse_name(*nameB).last
 
-            unified = name_unification(nameA, nameB)
-            if unified is not None:
-                result.append((unified, 0.5*(rankA+rankB), (idxA, idxB)))
-                iA += 1
-                iB += 1
-            elif shallower_name_similarity(nameA, nameB) > 0.:
-                # Those two names might refer to the same person
-                # default to the first one as unification failed
-                result.append((nameA, rankA, (idxA, None)))
+            if lastA == lastB or shallower_name_similarity(nameA, nameB) > 0.:
+                result.extend(_unify_name_pair(nameA, nameB, rankA, rankB,
+                                               idxA, idxB))
                 iA += 1
                 iB += 1
-            elif nameA[1] == nameB[1]:
-                # Those two names look incompatible because of their first names
-                result.append((nameA, rankA, (idxA, None)))
-                result.append((nameB, rankB, (None, idxB)))
-                iA += 1
-                iB += 1
-            elif nameA[1] < nameB[1]:
+            elif lastA < lastB:
                 result.append((nameA, rankA, (idxA, None)))
                 iA += 1
             else:
@@ -674,16 +795,100 @@ def unify_name_lists(a, b):
                 iB += 1
 
     result = map(lambda (name, rank, idx): (name, idx), sorted(result, key=lambda x: x[1]))
+    return list(_make_unique(result))
 
-    def make_unique(lst):
-        seen = set()
-        for name, idx in lst:
-            first, last = name
-            [k1, k2] = sorted([first.lower(), last.lower()])
-            if (k1, k2) not in seen:
-                seen.add((k1, k2))
-                yield (name, idx)
-            else:
-                yield (None, idx)
 
-    return list(make_unique(result))
+def _unification_sort_key((idx, name)):
+    """
+    Names are only compared to names with the same normalized last
+    name (or to their neighbours, for composite last names): sorting
+    by this key groups them.
+    """
+    return (parse_name(*name).last, name[1], name[0])
+
+
+def _unify_name_pair(nameA, nameB, rankA, rankB, idxA, idxB):
+    """
+    The entries added by :func:`unify_name_lists` for two names compared
+    with each other, as (name, rank, indices) triples.
+    """
+    unified = None
+    if parse_name(*nameA).last == parse_name(*nameB).last:
+        unified = name_unification(nameA, nameB)
+    if unified is not None:
+        return [(unified, 0.5*(rankA+rankB), (idxA, idxB))]
+    elif shallower_name_similarity(nameA, nameB) > 0.:
+        # Those two names might refer to the same person
+        # default to the first one as unification failed
+        return [(nameA, rankA, (idxA, None))]
+    else:
+        # Those two names look incompatible because of their first names
+        return [(nameA, rankA, (idxA, None)),
+                (nameB, rankB, (None, idxB))]
+
+
+def _unify_prefix_name_lists(a, b):
+    """
+    Fast path of :func:`unify_name_lists`, when one list is a prefix of
+    the other (or both are identical), and the additional names
+    cannot be matched with the common ones (their last names share no
+    word). In this case, the general algorithm compares each common name
+    with itself only, so we can skip the merge of the sorted lists.
+
+    :returns: the unified list (before removing duplicates), or None if
+        the lists do not have this shape.
+    """
+    if len(a) <= len(b):
+        short, other = a, b
+    else:
+        short, other = b, a
+    if other[:len(short)] != short:
+        return None
+
+    common_lasts = set()
+    common_words = set()
+    for name in short:
+        parsed = parse_name(*name)
+        common_lasts.add(parsed.last)
+        common_words |= parsed.last_words
+    for name in other[len(short):]:
+        parsed = parse_name(*name)
+        if parsed.last in common_lasts or parsed.last_words & common_words:
+            return None
+
+    lenA = float(len(a))
+    lenB = float(len(b))
+    # Entries with their position in the merge of the sorted lists,
+    # which decides the order of entries with the same rank
+    entries = []
+    for idx, name in enumerate(short):
+        pair = _unify_name_pair(name, name, (idx+1)/lenA, (idx+1)/lenB,
+                                idx, idx)
+        for seq, (unified, rank, indices) in enumerate(pair):
+            entries.append((rank, _unification_sort_key((idx, name)), idx,
+                            seq, unified, indices))
+    for idx in range(len(short), len(other)):
+        name = other[idx]
+        if other is a:
+            rank, indices = (idx+1)/lenA, (idx, None)
+        else:
+            rank, indices = (idx+1)/lenB, (None, idx)
+        entries.append((rank, _unification_sort_key((idx, name)), idx, 0,
+                        name, indices))
+    entries.sort(key=lambda entry: entry[:4])
+    return [(merged, positions) for _, _, _, _, merged, positions in entries]
+
+
+def _make_unique(lst):
+    """
+    Replaces the names which already appeared in the list by None.
+    """
+    seen = set()
+    for name, idx in lst:
+        first, last = name
+        [k1, k2] = sorted([first.lower(), last.lower()])
+        if (k1, k2) not in seen:
+            seen.add((k1, k2))
+            yield (name, idx)
+        else:
+            yield (None, idx)
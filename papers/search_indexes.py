@@ -1,7 +1,10 @@
+from django.db.models import Prefetch
 from haystack import indexes
 from papers.utils import remove_diacritics
 
+from .models import OaiRecord
 from .models import Paper
+from .models import Researcher
 
 
 class PaperIndex(indexes.SearchIndex, indexes.Indexable):
@@ -35,6 +38,37 @@ class PaperIndex(indexes.SearchIndex, indexes.Indexable):
     def get_updated_field(self):
         return "last_modified"
 
+    def index_queryset(self, using=None):
+        """
+        The papers to index. The researchers and the records with a journal
+        are prefetched, so that indexing a batch of papers only takes
+        a few queries.
+        """
+        return Paper.objects.prefetch_related(
+            Prefetch('researchers',
+                     queryset=Researcher.objects.only('id', 'department')),
+            Prefetch('oairecord_set',
+                     queryset=OaiRecord.objects.filter(journal__isnull=False)
+                     .only('about', 'journal', 'publisher').order_by('pk'),
+                     to_attr='journal_records'))
+
+    def get_researchers(self, obj):
+        """
+        The researchers of the paper, from the prefetched ones if available.
+        """
+        if 'researchers' in getattr(obj, '_prefetched_objects_cache', {}):
+            return obj.researchers.all()
+        return obj.researchers.only('id', 'department')
+
+    def get_journal_record(self, obj):
+        """
+        The first record of the paper with a journal, from the prefetched
+        ones if available.
+        """
+        if hasattr(obj, 'journal_records'):
+            return next(iter(obj.journal_records), None)
+        return obj.oairecords.filter(journal__isnull=False).first()
+
     def prepare_text(self, obj):
         return remove_diacritics(obj.title)
 
@@ -49,16 +83,16 @@ class PaperIndex(indexes.SearchIndex, indexes.Indexable):
         return 'OK' if obj.pdf_url else 'NOK'
 
     def prepare_researchers(self, obj):
-        return list(obj.researchers.values_list('id', flat=True))
+        return [r.id for r in self.get_researchers(obj)]
 
     def prepare_departments(self, obj):
-        return list(obj.researchers.filter(department__isnull=False)
-                    .values_list('department', flat=True))
+        return [r.department_id for r in self.get_researchers(obj)
+                if r.department_id is not None]
 
     def prepare_publisher(self, obj):
-        oairecord = obj.oairecords.filter(journal__isnull=False).first()
-        return getattr(getattr(oairecord, 'publisher', None), 'id', None)
+        oairecord = self.get_journal_record(obj)
+        return getattr(oairecord, 'publisher_id', None)
 
     def prepare_journal(self, obj):
-        oairecord = obj.oairecords.filter(journal__isnull=False).first()
-        return getattr(getattr(oairecord, 'journal', None), 'id', None)
+        oairecord = self.get_journal_record(obj)
+        return getattr(oairecord, 'journal_id', None)
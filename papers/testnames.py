@@ -25,11 +25,13 @@ import doctest
 import unittest
 
 import papers.name
+from papers.name import LRUCache
 from papers.name import match_names
 from papers.name import name_similarity
 from papers.name import name_unification
 from papers.name import normalize_name_words
 from papers.name import parse_comma_name
+from papers.name import parse_name
 from papers.name import recapitalize_word
 from papers.name import shallower_name_similarity
 from papers.name import split_name_words
@@ -317,6 +319,33 @@ class ShallowerNameSimilarityTest(unittest.TestCase):
             self.assertEqual(shallower_name_similarity(a, b), False)
 
 
+class ParsedNameTest(unittest.TestCase):
+
+    def test_parse_name(self):
+        name = parse_name('J.-P.', 'Dupont-Lévy')
+        self.assertEqual(name.last, 'dupont-levy')
+        self.assertEqual(name.last_words, frozenset(['dupont', 'levy']))
+        self.assertEqual(name.expanded, (False, False))
+        self.assertEqual(name.raw_first_words, ('J', 'P'))
+        self.assertIs(parse_name('J.-P.', 'Dupont-Lévy'), name)
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_unhashable_names(self):
+        self.assertEqual(name_similarity(['Robin', 'Ryder'], ['R.', 'Ryder']),
+                         name_similarity(('Robin', 'Ryder'), ('R.', 'Ryder')))
+        self.assertEqual(name_unification(['Robin', 'Ryder'], ['R. J.', 'Ryder']),
+                         ('Robin J.', 'Ryder'))
+
+
 class ParseCommaNameTest(unittest.TestCase):
 
     def test_simple(self):
@@ -494,6 +523,53 @@ class UnifyNameListsTest(unittest.TestCase):
             [('J.', 'Boutier')]),
             [(('Jérémie', 'Boutier'), (0, 0)), (None, (1, None))])
 
+    def test_fast_path(self):
+        names = [('Jean', 'Dupont'), ('Marie', 'Dupré'), ('Jean', 'Dupont')]
+        self.assertEqual(unify_name_lists(names, names),
+                         unify_name_lists(names, names, fast_path=False))
+        self.assertEqual(unify_name_lists(names, names + [('R.', 'Badinter')]),
+            [(('Jean', 'Dupont'), (0, 0)), (('Marie', 'Dupré'), (1, 1)),
+             (None, (2, 2)), (('R.', 'Badinter'), (None, 3))])
+        self.assertEqual(unify_name_lists(names[:2], []),
+                         [(('Jean', 'Dupont'), (0, None)),
+                          (('Marie', 'Dupré'), (1, None))])
+
+    def test_fast_path_long_extension(self):
+        names = [('Anne', 'Abel'), ('Bob', 'Berg')]
+        extended = names + [(first, last) for first, last in
+                            zip('CDEFGHIJ', ['Cole', 'Dunn', 'Ezra', 'Fox',
+                                             'Gray', 'Hale', 'Ives', 'Jude'])]
+        for a, b in [(names, extended), (extended, names)]:
+            self.assertEqual(unify_name_lists(a, b),
+                             unify_name_lists(a, b, fast_path=False))
+        # Names are ordered by their average rank: Berg (ranks 2/2 and 2/10)
+        # comes after the names ranked 3/10 to 5/10
+        self.assertEqual([name for name, idx in unify_name_lists(names, extended)],
+                         [('Anne', 'Abel'), ('C', 'Cole'), ('D', 'Dunn'),
+                          ('E', 'Ezra'), ('Bob', 'Berg'), ('F', 'Fox'),
+                          ('G', 'Gray'), ('H', 'Hale'), ('I', 'Ives'),
+                          ('J', 'Jude')])
+
+    def test_fast_path_related_names(self):
+        # The additional name could be matched with a common one,
+        # so the general algorithm is used
+        names = [('Jean', 'Dupont'), ('Marie', 'Martin')]
+        extended = names + [('J.', 'Dupont'), ('Anne', 'Le Martin')]
+        for a, b in [(names, extended), (extended, names)]:
+            self.assertEqual(unify_name_lists(a, b),
+                             unify_name_lists(a, b, fast_path=False))
+
+    def test_trailing_names_rank(self):
+        # Unmatched names are ranked by their own position in their list,
+        # like the other names which are not unified, including the ones
+        # left at the end of the sorted lists (Zzyzx, ranked 4/4)
+        self.assertEqual(unify_name_lists(
+            [('Anne', 'Zorro'), ('Bob', 'Abel')],
+            [('Bob', 'Abel'), ('Claire', 'Martin'), ('Anne', 'Zorro'),
+             ('Denis', 'Zzyzx')]),
+            [(('Claire', 'Martin'), (None, 1)), (('Bob', 'Abel'), (1, 0)),
+             (('Anne', 'Zorro'), (0, 2)), (('Denis', 'Zzyzx'), (None, 3))])
+
     def test_inverted(self):
         # in the wild:
         # http://dx.doi.org/10.1371/journal.pone.0156198
@@ -23,15 +23,24 @@ from __future__ import unicode_literals
 import datetime
 from datetime import date
 import doctest
+import hashlib
+import unittest
 
 import django.test
+import mock
 from papers.baremodels import BareName
+from papers.baremodels import BarePaper
+from papers.fingerprint import create_paper_fingerprint
+from papers.fingerprint import create_paper_fingerprints
+from papers.fingerprint import FingerprintIndex
 import papers.doi
+import papers.models
 from papers.models import Name
 from papers.models import OaiRecord
 from papers.models import OaiSource
 from papers.models import Paper
 from papers.models import Researcher
+from papers.search_indexes import PaperIndex
 
 
 class ResearcherTest(django.test.TestCase):
@@ -76,9 +85,31 @@ class OaiRecordTest(django.test.TestCase):
         OaiRecord.find_duplicate_records(
             paper, 'ftp://dissem.in/paper.pdf', None)
 
+    def test_find_duplicate_records(self):
+        paper = Paper.get_or_create('this is another title', [Name.lookup_name(('Jean', 'Saisrien'))],
+                                    datetime.date(year=2015, month=05, day=04))
+        record = OaiRecord.new(source=self.source,
+                               identifier='oai:arXiv.org:duplicate',
+                               about=paper,
+                               splash_url='http://arxiv.org/abs/1234.5678',
+                               pdf_url='http://arxiv.org/pdf/1234.5678')
+        self.assertEqual(OaiRecord.find_duplicate_records(
+            paper, 'https://arxiv.org/abs/1234.5678', None), record)
+        self.assertEqual(OaiRecord.find_duplicate_records(
+            paper, 'http://example.com/', 'https://arxiv.org/pdf/1234.5678'), record)
+        self.assertEqual(OaiRecord.find_duplicate_records(
+            None, 'http://example.com/', None,
+            identifier='oai:arXiv.org:duplicate'), record)
+        self.assertEqual(OaiRecord.find_duplicate_records_batch([
+            (paper, 'https://arxiv.org/abs/1234.5678', None, None),
+            (paper, 'http://example.com/', None, 'oai:unknown'),
+            (None, None, None, 'oai:arXiv.org:duplicate'),
+        ]), [record, None, record])
+
 
 def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite(papers.doi))
+    tests.addTests(doctest.DocTestSuite(papers.models))
     return tests
 
 
@@ -158,3 +189,124 @@ class PaperTest(django.test.TestCase):
                 seen_rids.add(a.researcher_id)
         self.assertEqual(seen_rids,
                          set([r1.id, r2.id]))
+
+    def test_from_bare_links_researchers(self):
+        researchers = [Researcher.create_by_name('Jean', last) for last in
+                       ['Alphand', 'Bertier', 'Cordier', 'Dalmont', 'Estier']]
+
+        def bare_paper():
+            paper = BarePaper.create('A paper written by many researchers',
+                                     [r.name for r in researchers],
+                                     date(year=2015, month=03, day=01))
+            for author, r in zip(paper.authors, researchers):
+                author.researcher_id = r.id
+            return paper
+
+        p = Paper.from_bare(bare_paper())
+        self.assertEqual(set(p.researchers.all()), set(researchers))
+        # Merging the same paper again does not duplicate the links
+        self.assertEqual(Paper.from_bare(bare_paper()).pk, p.pk)
+        self.assertEqual(p.researchers.count(), len(researchers))
+
+    def test_recompute_availability(self):
+        p = Paper.from_bare(Paper.create_by_doi('10.1007/BF02702259'))
+        self.assertEqual(p.oa_status, 'OA')
+        Paper.objects.filter(pk=p.pk).update(pdf_url=None, oa_status='UNK')
+        self.assertEqual(Paper.recompute_availability([p.pk]), 1)
+        p = Paper.objects.get(pk=p.pk)
+        self.assertEqual(p.oa_status, 'OA')
+        self.assertNotEqual(p.pdf_url, None)
+        # Nothing is written when the availability does not change
+        with self.assertNumQueries(2):
+            self.assertEqual(Paper.recompute_availability([p.pk]), 0)
+
+    def test_update_availability_saves_changes_only(self):
+        p = Paper.from_bare(Paper.create_by_doi('10.1007/BF02702259'))
+        last_modified = Paper.objects.get(pk=p.pk).last_modified
+        p.title = 'A title which should not be saved'
+        # The cache is invalidated even if nothing changed, as the caller
+        # may have added records to the paper
+        with mock.patch.object(Paper, 'invalidate_cache') as invalidate_cache:
+            p.update_availability()
+        invalidate_cache.assert_called_once_with()
+        saved = Paper.objects.get(pk=p.pk)
+        self.assertNotEqual(saved.title, p.title)
+        self.assertEqual(saved.last_modified, last_modified)
+        # Changes of availability are saved
+        Paper.objects.filter(pk=p.pk).update(oa_status='UNK')
+        saved = Paper.objects.get(pk=p.pk)
+        saved.update_availability()
+        saved = Paper.objects.get(pk=p.pk)
+        self.assertEqual(saved.oa_status, 'OA')
+        self.assertNotEqual(saved.title, p.title)
+
+    def test_fingerprint_index(self):
+        p = Paper.get_or_create('A paper indexed by its fingerprint',
+                                [BareName.create_bare('Jean', 'Saisrien')],
+                                date(year=2014, month=02, day=01))
+        Paper.load_fingerprint_index()
+        try:
+            self.assertEqual(Paper.find_by_fingerprint(p.fingerprint).first(), p)
+            with self.assertNumQueries(0):
+                self.assertFalse(Paper.find_by_fingerprint(
+                    '0123456789abcdef0123456789abcdef'))
+            # New papers are added to the index
+            p2 = Paper.get_or_create('Another paper created afterwards',
+                                     [BareName.create_bare('Jean', 'Saisrien')],
+                                     date(year=2014, month=02, day=01))
+            self.assertEqual(Paper.find_by_fingerprint(p2.fingerprint).first(), p2)
+        finally:
+            Paper.drop_fingerprint_index()
+
+    def test_index_preparation(self):
+        p = Paper.from_bare(Paper.create_by_doi('10.1007/BF02702259'))
+        r = Researcher.create_by_name('Stephan', 'Hauschildt')
+        p.set_researcher(0, r.id)
+        index = PaperIndex()
+        fields = ['researchers', 'departments', 'publisher', 'journal']
+        expected = {f: getattr(index, 'prepare_'+f)(p) for f in fields}
+        self.assertEqual(expected['researchers'], [r.id])
+
+        with self.assertNumQueries(3):
+            prefetched = list(index.index_queryset().filter(pk=p.pk))[0]
+        with self.assertNumQueries(0):
+            for f in fields:
+                self.assertEqual(
+                    getattr(index, 'prepare_'+f)(prefetched), expected[f])
+
+
+class FingerprintIndexTest(unittest.TestCase):
+
+    def test_lookup(self):
+        fps = sorted(hashlib.md5(str(i)).hexdigest() for i in range(100))
+        index = FingerprintIndex([(fp, i) for i, fp in enumerate(fps)])
+        for i, fp in enumerate(fps):
+            self.assertEqual(index.get(fp), i)
+        self.assertNotIn(hashlib.md5('unknown').hexdigest(), index)
+
+    def test_updates(self):
+        fp = hashlib.md5('paper').hexdigest()
+        index = FingerprintIndex([('not-a-digest', 1)])
+        self.assertEqual(index.get('not-a-digest'), 1)
+        self.assertNotIn(fp, index)
+        index.add(fp, 2)
+        self.assertEqual(index.get(fp), 2)
+        index.remove(fp)
+        self.assertNotIn(fp, index)
+
+
+class FingerprintTest(unittest.TestCase):
+    papers = [
+        ('Ambiguity', [('John', 'Doe')], 2014),
+        ('Les accents sont supprimés', [('Jean', 'Lévy-Leblond'),
+                                        ('Johannes', 'van der Waals')], 2015),
+        ('HTML tags are <emph>removed</emph>', [('John', 'Doe')], 2015),
+    ]
+
+    def test_batch(self):
+        expected = [create_paper_fingerprint(*p) for p in self.papers]
+        self.assertEqual(create_paper_fingerprints(self.papers), expected)
+        with mock.patch('papers.fingerprint.FINGERPRINT_POOL_THRESHOLD', 2):
+            self.assertEqual(
+                create_paper_fingerprints(self.papers, processes=2),
+                expected)
@@ -0,0 +1,36 @@
+# -*- encoding: utf-8 -*-
+
+# Dissemin: open access policy enforcement tool
+# Copyright (C) 2014 Antonin Delpeuch
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from __future__ import unicode_literals
+
+from django.utils.deprecation import MiddlewareMixin
+from publishers.models import alias_resolver
+
+
+class FlushAliasesMiddleware(MiddlewareMixin):
+    """
+    Writes the publisher alias increments made by a request
+    (see :class:`publishers.models.AliasResolver`) once its response
+    is ready, while the database connection is still open.
+    """
+
+    def process_response(self, request, response):
+        alias_resolver.flush()
+        return response
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from bulk_update.helper import bulk_update
+from django.db import migrations
+from django.db import models
+from unidecode import unidecode
+
+
+def journal_title_key(title):
+    """
+    The normalization of journal titles at the time of this migration
+    (see publishers.models.journal_title_key).
+    """
+    if not title:
+        return ''
+    if isinstance(title, unicode):
+        title = unidecode(title.replace('’', "'"))
+    words = re.split(r'\W+', title.lower(), flags=re.UNICODE)
+    return ' '.join(word for word in words if word)[:256]
+
+
+def populate_title_keys(apps, schema_editor):
+    Journal = apps.get_model('publishers', 'Journal')
+    journals = list(Journal.objects.only('id', 'title'))
+    for journal in journals:
+        journal.title_key = journal_title_key(journal.title)
+    bulk_update(journals, update_fields=['title_key'], batch_size=1000)
+
+
+def backwards(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+    """
+    Store a normalized version of the journal titles, so that
+    they can be matched with an index instead of case-insensitive
+    comparisons over the whole table, and the electronic ISSNs.
+    """
+
+    dependencies = [
+        ('publishers', '0002_update_aliases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journal',
+            name='title_key',
+            field=models.CharField(max_length=256, db_index=True, blank=True, default=''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='journal',
+            name='essn',
+            field=models.CharField(max_length=10, blank=True, null=True, db_index=True),
+        ),
+        migrations.RunPython(populate_title_keys, backwards),
+    ]
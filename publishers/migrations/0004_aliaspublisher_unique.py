@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def merge_duplicate_aliases(apps, schema_editor):
+    AliasPublisher = apps.get_model('publishers', 'AliasPublisher')
+    kept = {}
+    for alias in AliasPublisher.objects.order_by('id'):
+        key = (alias.name, alias.publisher_id)
+        if key in kept:
+            kept[key].count += alias.count
+            kept[key].save(update_fields=['count'])
+            alias.delete()
+        else:
+            kept[key] = alias
+
+
+def backwards(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+    """
+    The uniqueness of (name, publisher) was declared outside the Meta
+    class of AliasPublisher, so it was never enforced. Duplicate aliases
+    are merged (summing their counts) before adding the constraint.
+    """
+
+    dependencies = [
+        ('publishers', '0003_journal_title_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_aliases, backwards),
+        migrations.AlterUniqueTogether(
+            name='aliaspublisher',
+            unique_together=set([('name', 'publisher')]),
+        ),
+    ]
@@ -21,15 +21,26 @@
 
 from __future__ import unicode_literals
 
+import atexit
+from collections import Counter
+from collections import defaultdict
+import re
 from statistics.models import AccessStatistics
+import time
 
+from celery.signals import task_failure
+from celery.signals import task_success
 from django.apps import apps
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.db import models
+from django.db import transaction
 from django.template.defaultfilters import slugify
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext as __
 from django.utils.translation import ugettext_lazy as _
+from papers.name import memoized
+from papers.utils import remove_diacritics
 
 get_model = apps.get_model
 
@@ -55,6 +66,34 @@ OA_STATUS_PREFERENCE = [x[0] for x in OA_STATUS_CHOICES]
 OA_STATUS_CHOICES_WITHOUT_HELPTEXT = [(x[0], x[1]) for x in OA_STATUS_CHOICES]
 
 
+# Number of normalized journal titles kept in memory
+JOURNAL_TITLE_CACHE_SIZE = 8192
+
+# Number of pending alias increments after which they are written
+# to the database
+ALIAS_FLUSH_THRESHOLD = 500
+# Maximum delay (in seconds) before pending alias increments are written
+ALIAS_FLUSH_INTERVAL = 60
+# Delay (in seconds) after which the alias counts are reloaded,
+# to take into account the increments of other processes
+ALIAS_RELOAD_INTERVAL = 3600
+
+
+@memoized(JOURNAL_TITLE_CACHE_SIZE)
+def journal_title_key(title):
+    """
+    Normalizes a journal title so that titles differing only by
+    their accents, case, punctuation or spacing are matched together.
+
+    >>> journal_title_key('Revista de Gastroenterología de  México.')
+    u'revista de gastroenterologia de mexico'
+    """
+    if not title:
+        return ''
+    words = re.split(r'\W+', remove_diacritics(title).lower(), flags=re.UNICODE)
+    return ' '.join(word for word in words if word)[:256]
+
+
 def publishers_breadcrumbs():
     return [(_('Publishers'), reverse('publishers'))]
 
@@ -132,6 +171,15 @@ class Publisher(models.Model):
         self.stats.update(get_model('papers', 'Paper').objects.filter(
             oairecord__publisher=self).distinct())
 
+    @classmethod
+    def compute_all_stats(cls):
+        """
+        Computes the access statistics of all publishers at once
+        (see :py:meth:`AccessStatistics.update_all_stats`).
+        """
+        return AccessStatistics.count_by_group(
+            get_model('papers', 'Paper').objects.all(), 'oairecord__publisher')
+
     def __unicode__(self):
         if not self.alias:
             return self.name
@@ -179,15 +227,17 @@ class Publisher(models.Model):
         return len(self.copyrightlinks) > 0
 
     def change_oa_status(self, new_oa_status):
+        """
+        Changes the OA status of the publisher and updates the
+        availability of its papers, chunk by chunk.
+        """
         if self.oa_status == new_oa_status:
             return
         self.oa_status = new_oa_status
         self.save()
-        papers = get_model('papers', 'Paper').objects.filter(
-            oairecord__publisher=self.pk)
-        for p in papers:
-            p.update_availability()
-            p.invalidate_cache()
+        Paper = get_model('papers', 'Paper')
+        Paper.recompute_availability(Paper.objects.filter(
+            oairecord__publisher=self.pk).values_list('pk', flat=True).distinct())
 
     def breadcrumbs(self):
         result = publishers_breadcrumbs()
@@ -216,12 +266,20 @@ class Publisher(models.Model):
 
 class Journal(models.Model):
     title = models.CharField(max_length=256, db_index=True)
+    #: The normalized title (see :func:`journal_title_key`), used to match journals
+    title_key = models.CharField(max_length=256, db_index=True, blank=True)
     last_updated = models.DateTimeField(auto_now=True)
     issn = models.CharField(max_length=10, blank=True, null=True, unique=True)
+    #: The electronic ISSN
+    essn = models.CharField(max_length=10, blank=True, null=True, db_index=True)
     publisher = models.ForeignKey(Publisher)
 
     stats = models.ForeignKey(AccessStatistics, null=True)
 
+    def save(self, *args, **kwargs):
+        self.title_key = journal_title_key(self.title)
+        super(Journal, self).save(*args, **kwargs)
+
     def update_stats(self):
         if not self.stats:
             self.stats = AccessStatistics.objects.create()
@@ -229,6 +287,15 @@ class Journal(models.Model):
         self.stats.update(get_model('papers', 'Paper').objects.filter(
             oairecord__journal=self).distinct())
 
+    @classmethod
+    def compute_all_stats(cls):
+        """
+        Computes the access statistics of all journals at once
+        (see :py:meth:`AccessStatistics.update_all_stats`).
+        """
+        return AccessStatistics.count_by_group(
+            get_model('papers', 'Paper').objects.all(), 'oairecord__journal')
+
     def breadcrumbs(self):
         return self.publisher.breadcrumbs()+[(unicode(self), '')]
 
@@ -282,21 +349,134 @@ class AliasPublisher(models.Model):
     publisher = models.ForeignKey(Publisher)
     name = models.CharField(max_length=512)
     count = models.IntegerField(default=0)
-    unique_together = ('name', 'publisher')
 
     def __unicode__(self):
         return self.name + ' --'+str(self.count)+'--> '+unicode(self.publisher)
 
     @classmethod
     def increment(cls, name, publisher):
-        # TODO it would be more efficient with an update, but it does not really
-        # work
-        if not name:
-            return
-        alias, created = cls.objects.get_or_create(
-            name=name, publisher=publisher)
-        alias.count += 1
-        alias.save()
+        """
+        Records that the publisher name has been associated to this
+        publisher. The count is updated in the database later,
+        by :meth:`AliasResolver.flush`.
+        """
+        alias_resolver.increment(name, publisher.pk)
 
     class Meta:
         db_table = 'papers_aliaspublisher'
+        unique_together = ('name', 'publisher')
+
+
+class AliasResolver(object):
+    """
+    Keeps the publisher aliases in memory, so that publisher
+    names can be resolved without querying the database,
+    and accumulates the increments of their counts so that they
+    are written at once by :meth:`flush`, instead of updating
+    the same rows for each publication.
+
+    The counts are loaded on the first lookup and reloaded every
+    `ALIAS_RELOAD_INTERVAL` seconds.
+    """
+
+    def __init__(self):
+        #: maps each publisher name to a dict from publisher ids to counts
+        self.counts = None
+        self.loaded_at = None
+        #: pending increments, indexed by (name, publisher id)
+        self.pending = Counter()
+        self.nb_pending = 0
+        self.flushed_at = time.time()
+
+    def load(self):
+        counts = defaultdict(Counter)
+        for name, publisher_id, count in AliasPublisher.objects.values_list(
+                'name', 'publisher_id', 'count').iterator():
+            counts[name][publisher_id] += count
+        for (name, publisher_id), delta in self.pending.items():
+            counts[name][publisher_id] += delta
+        self.counts = counts
+        self.loaded_at = time.time()
+
+    def clear(self):
+        """
+        Forgets the counts loaded and the pending increments.
+        """
+        self.counts = None
+        self.pending.clear()
+        self.nb_pending = 0
+
+    def most_common(self, name, n=2):
+        """
+        :returns: the `n` (publisher id, count) pairs with the highest
+            counts for that publisher name
+        """
+        if (self.counts is None or
+                time.time() - self.loaded_at > ALIAS_RELOAD_INTERVAL):
+            self.load()
+        if name not in self.counts:
+            return []
+        return self.counts[name].most_common(n)
+
+    def increment(self, name, publisher_id):
+        if not name:
+            return
+        self.pending[(name, publisher_id)] += 1
+        self.nb_pending += 1
+        if self.counts is not None:
+            self.counts[name][publisher_id] += 1
+        if (self.nb_pending >= ALIAS_FLUSH_THRESHOLD or
+                time.time() - self.flushed_at > ALIAS_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the pending increments to the database with a single
+        upsert: existing aliases are incremented and the others are
+        created (unless their publisher has been deleted). If the write
+        fails, the increments are kept for the next flush.
+        """
+        self.flushed_at = time.time()
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = Counter()
+        self.nb_pending = 0
+
+        values = []
+        for (name, publisher_id), delta in pending.items():
+            values += [name, publisher_id, delta]
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    'INSERT INTO papers_aliaspublisher (name, publisher_id, count) '
+                    'SELECT v.name, v.publisher_id, v.delta '
+                    'FROM (VALUES ' + ', '.join(['(%s, %s, %s)']*len(pending)) +
+                    ') AS v(name, publisher_id, delta) '
+                    'JOIN papers_publisher AS p ON p.id = v.publisher_id '
+                    'ON CONFLICT (name, publisher_id) DO UPDATE '
+                    'SET count = papers_aliaspublisher.count + EXCLUDED.count',
+                    values)
+        except Exception:
+            self.pending.update(pending)
+            self.nb_pending = sum(self.pending.values())
+            raise
+
+
+#: The resolver of publisher aliases of this process
+alias_resolver = AliasResolver()
+
+
+def flush_alias_resolver(**kwargs):
+    """
+    Writes the pending alias increments at the end of each task, so that
+    they are not lost when the process exits before the next flush.
+    This runs before Celery closes the database connection of the task
+    (on `task_postrun`).
+    """
+    alias_resolver.flush()
+
+
+task_success.connect(flush_alias_resolver)
+task_failure.connect(flush_alias_resolver)
+atexit.register(alias_resolver.flush)
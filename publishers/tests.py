@@ -18,8 +18,17 @@
 
 
 from backend.romeo import fetch_journal
+from django.db import DatabaseError
+from django.http import HttpResponse
+from django.test import TestCase
+import mock
 from papers.models import Paper
 from papers.testpages import RenderingTest
+from publishers.middleware import FlushAliasesMiddleware
+from publishers.models import alias_resolver
+from publishers.models import AliasPublisher
+from publishers.models import AliasResolver
+from publishers.models import Publisher
 
 
 class JournalPageTest(RenderingTest):
@@ -42,3 +51,62 @@ class JournalPageTest(RenderingTest):
         for publi in p.publications:
             self.checkPage('publisher', kwargs={
                            'pk': publi.publisher_id, 'slug': publi.publisher.slug})
+
+
+class AliasResolverTest(TestCase):
+
+    def setUp(self):
+        self.resolver = AliasResolver()
+        self.publisher = Publisher.objects.create(
+            romeo_id='1', name='Alias Press', preprint='can',
+            postprint='can', pdfversion='can', oa_status='OK')
+        AliasPublisher.objects.create(
+            name='AP', publisher=self.publisher, count=10)
+
+    def test_most_common(self):
+        self.assertEqual(self.resolver.most_common('AP'),
+                         [(self.publisher.pk, 10)])
+        self.assertEqual(self.resolver.most_common('Unknown'), [])
+        self.resolver.increment('AP', self.publisher.pk)
+        self.assertEqual(self.resolver.most_common('AP'),
+                         [(self.publisher.pk, 11)])
+
+    def test_flush(self):
+        for i in range(3):
+            self.resolver.increment('AP', self.publisher.pk)
+        self.resolver.increment('Alias Press Ltd', self.publisher.pk)
+        # nothing is written until the increments are flushed
+        self.assertEqual(AliasPublisher.objects.get(name='AP').count, 10)
+        # a single upsert, in a savepoint
+        with self.assertNumQueries(3):
+            self.resolver.flush()
+        self.assertEqual(AliasPublisher.objects.get(name='AP').count, 13)
+        self.assertEqual(AliasPublisher.objects.get(
+            name='Alias Press Ltd').count, 1)
+        with self.assertNumQueries(0):
+            self.resolver.flush()
+
+    def test_flush_failure(self):
+        self.resolver.increment('AP', self.publisher.pk)
+        with mock.patch('publishers.models.connection.cursor',
+                        side_effect=DatabaseError('connection lost')):
+            with self.assertRaises(DatabaseError):
+                self.resolver.flush()
+        # the increments are kept for the next flush
+        self.assertEqual(self.resolver.nb_pending, 1)
+        self.resolver.flush()
+        self.assertEqual(AliasPublisher.objects.get(name='AP').count, 11)
+
+    def test_flush_deleted_publisher(self):
+        other = Publisher.objects.create(
+            romeo_id='2', name='Gone Press', preprint='can',
+            postprint='can', pdfversion='can', oa_status='OK')
+        self.resolver.increment('GP', other.pk)
+        other.delete()
+        self.resolver.flush()
+        self.assertFalse(AliasPublisher.objects.filter(name='GP').exists())
+
+    def test_flush_at_end_of_request(self):
+        alias_resolver.increment('AP', self.publisher.pk)
+        FlushAliasesMiddleware().process_response(None, HttpResponse())
+        self.assertEqual(AliasPublisher.objects.get(name='AP').count, 11)
@@ -0,0 +1,126 @@
+"""
+Queue of papers to (re)index in Elasticsearch.
+
+Instead of updating the search index synchronously every time a paper
+is saved, the ids of the papers which need to be reindexed (dirty papers)
+are added to a set stored in Redis. The `flush_indexing_queue` task
+then reindexes them by batches, with the bulk API of Elasticsearch.
+If no Redis client is configured, papers are reindexed as soon as they
+are marked dirty.
+"""
+
+from __future__ import unicode_literals
+
+from dissemin.settings import redis_client
+from django.db import connection
+from django.db import transaction
+import haystack
+from haystack.exceptions import NotHandled
+
+#: Prefix of the Redis key of the set of dirty paper ids
+INDEXING_QUEUE_KEY = 'indexing-queue'
+
+#: Number of papers sent to Elasticsearch in one bulk request
+INDEXING_BATCH_SIZE = 500
+
+
+def queue_key():
+    """
+    The Redis key of the indexing queue. It contains the name of the
+    database, so that test databases get their own queue.
+    """
+    return '%s:%s' % (INDEXING_QUEUE_KEY, connection.settings_dict['NAME'])
+
+
+def mark_papers_dirty(paper_ids):
+    """
+    Adds papers to the indexing queue, once the current transaction
+    is committed (immediately if there is none). This way, the queue is
+    never flushed before the changes are visible, and the papers of a
+    rolled back transaction are not queued.
+
+    :param paper_ids: the ids of the papers which need to be reindexed
+        (or removed from the index, if they have been deleted)
+    """
+    paper_ids = [pk for pk in paper_ids if pk is not None]
+    if not paper_ids:
+        return
+
+    def enqueue():
+        if redis_client is None:
+            index_papers(paper_ids)
+        else:
+            redis_client.sadd(queue_key(), *paper_ids)
+    transaction.on_commit(enqueue)
+
+
+def mark_paper_dirty(paper_id):
+    """
+    Adds one paper to the indexing queue.
+    """
+    mark_papers_dirty([paper_id])
+
+
+def indexing_queue_length():
+    """
+    The number of papers waiting to be indexed.
+    """
+    if redis_client is None:
+        return 0
+    return redis_client.scard(queue_key())
+
+
+def pop_dirty_papers(count):
+    """
+    Removes at most `count` paper ids from the indexing queue and
+    returns them.
+    """
+    if redis_client is None:
+        return []
+    paper_ids = redis_client.srandmember(queue_key(), count)
+    if paper_ids:
+        redis_client.srem(queue_key(), *paper_ids)
+    return [int(pk) for pk in paper_ids]
+
+
+def index_papers(paper_ids):
+    """
+    Reindexes some papers with one bulk request per search backend.
+    Papers which do not exist anymore are removed from the index.
+    """
+    from papers.models import Paper
+
+    for using in haystack.connection_router.for_write():
+        backend = haystack.connections[using].get_backend()
+        try:
+            index = haystack.connections[using].get_unified_index(
+                                    ).get_index(Paper)
+        except NotHandled:
+            continue
+        papers = list(index.index_queryset(using).filter(pk__in=paper_ids))
+        deleted_ids = set(paper_ids) - set(p.pk for p in papers)
+        if papers:
+            backend.update(index, papers)
+        for pk in deleted_ids:
+            backend.remove('papers.paper.%d' % pk)
+
+
+def flush_indexing_queue(batch_size=INDEXING_BATCH_SIZE):
+    """
+    Reindexes all the papers in the indexing queue, by batches.
+
+    :returns: the number of papers processed
+    """
+    processed = 0
+    while True:
+        paper_ids = pop_dirty_papers(batch_size)
+        if not paper_ids:
+            break
+        try:
+            index_papers(paper_ids)
+        except Exception:
+            # put the papers back in the queue for the next flush
+            mark_papers_dirty(paper_ids)
+            raise
+        processed += len(paper_ids)
+    return processed
@@ -28,21 +28,30 @@ As all these modules are spread in different apps and link to :class:`AccessStat
 this model has been separated from the rest for dependency reasons.
 
 The different states a paper can have are defined in :py:obj:`COMBINED_STATUS_CHOICES`
-(where a human-readable description is given), :py:obj:`STATUS_QUERYSET_FILTER`
-(where the corresponding QuerySet filters are defined) and in :py:func:`combined_status_for_instance`
+(where a human-readable description is given), :py:obj:`STATUS_QUERYSET_CONDITION`
+(where the corresponding QuerySet conditions are defined) and in :py:func:`combined_status_for_instance`
 which computes the status of a particular paper.
 """
 
 from __future__ import unicode_literals
 
+from collections import Counter
+from collections import defaultdict
+
+from bulk_update.helper import bulk_update
 from django.db import models
+from django.db.models import Case
+from django.db.models import Count
+from django.db.models import F
 from django.db.models import Q
+from django.db.models import Sum
+from django.db.models import When
 from django.utils.translation import ugettext_lazy as _
 
 #: Paper status (combined because it takes into account
 #: both the publisher policy and the full text availability).
 #:
-#: If these states are changed, then the filters :py:obj:`STATUS_QUERYSET_FILTER`
+#: If these states are changed, then the conditions :py:obj:`STATUS_QUERYSET_CONDITION`
 #: have to be updated, as well as :py:func:`combined_status_for_instance`.
 COMBINED_STATUS_CHOICES = [
     ('oa', _('Available from the publisher')),
@@ -65,23 +74,55 @@ STATUS_CHOICES_HELPTEXT = {
 PDF_STATUS_CHOICES = [('OK', _('Available')),
                       ('NOK', _('Unavailable'))]
 
+#: Conditions associated to each combined status choice
+#: These conditions, on Papers, select the papers in the given state.
+STATUS_QUERYSET_CONDITION = {
+    'oa': Q(oa_status='OA'),
+    'ok': Q(pdf_url__isnull=False) & ~Q(oa_status='OA'),
+    'couldbe': Q(pdf_url__isnull=True, oa_status='OK'),
+    'unk': Q(pdf_url__isnull=True, oa_status='UNK'),
+    'closed': Q(pdf_url__isnull=True, oa_status='NOK'),
+    }
+
 #: Filters associated to each combined status choice
 #: These filters, once applied to a queryset of Papers,
 #: select the papers in the given state.
 STATUS_QUERYSET_FILTER = {
-    'oa': lambda q: q.filter(oa_status='OA'),
-    'ok': lambda q: q.filter(Q(pdf_url__isnull=False) & ~Q(oa_status='OA')),
-    'couldbe': lambda q: q.filter(pdf_url__isnull=True, oa_status='OK'),
-    'unk': lambda q: q.filter(pdf_url__isnull=True, oa_status='UNK'),
-    'closed': lambda q: q.filter(pdf_url__isnull=True, oa_status='NOK'),
+    'oa': lambda q: q.filter(STATUS_QUERYSET_CONDITION['oa']),
+    'ok': lambda q: q.filter(STATUS_QUERYSET_CONDITION['ok']),
+    'couldbe': lambda q: q.filter(STATUS_QUERYSET_CONDITION['couldbe']),
+    'unk': lambda q: q.filter(STATUS_QUERYSET_CONDITION['unk']),
+    'closed': lambda q: q.filter(STATUS_QUERYSET_CONDITION['closed']),
+    }
+
+#: The counters stored in access statistics
+STATS_FIELDS = ['num_oa', 'num_ok', 'num_couldbe',
+                'num_unk', 'num_closed', 'num_tot']
+
+
+def status_aggregates(distinct=False):
+    """
+    Aggregates counting the papers in each combined status, and their
+    total, in a single query (conditional aggregation). They are returned
+    as keyword arguments for `aggregate()` or `annotate()` on a queryset
+    of Papers.
+
+    :param distinct: count each paper only once, even if the queryset
+        contains it multiple times (because of joins)
+    """
+    aggregates = {
+        'num_'+key: Count(Case(When(condition, then='id')), distinct=distinct)
+        for key, condition in STATUS_QUERYSET_CONDITION.items()
     }
+    aggregates['num_tot'] = Count('id', distinct=distinct)
+    return aggregates
 
 
 def combined_status_for_instance(paper):
     """
     Computes the current combined status of a given paper.
     This is defined here so that the function can be easily updated when
-    we change :py:obj:`STATUS_QUERYSET_FILTER` or :py:obj:`COMBINED_STATUS_CHOICES`.
+    we change :py:obj:`STATUS_QUERYSET_CONDITION` or :py:obj:`COMBINED_STATUS_CHOICES`.
     """
     if paper.oa_status == 'OA':
         return 'oa'
@@ -95,6 +136,35 @@ def combined_status_for_instance(paper):
     return 'unk'
 
 
+def status_delta(old_status, new_status):
+    """
+    The changes to apply to the counters of access statistics when
+    a paper moves from one combined status to another.
+
+    :param old_status: the previous combined status of the paper,
+        or `None` if it was not counted in these statistics
+    :param new_status: the new combined status of the paper,
+        or `None` if it should not be counted anymore
+    :returns: a dictionary mapping the :py:obj:`STATS_FIELDS` to
+        their (non-zero) increments
+
+    >>> sorted(status_delta('unk', 'ok').items())
+    [(u'num_ok', 1), (u'num_unk', -1)]
+    >>> status_delta(None, 'oa') == {'num_oa': 1, 'num_tot': 1}
+    True
+    >>> status_delta('oa', 'oa')
+    {}
+    """
+    delta = defaultdict(int)
+    if old_status is not None:
+        delta['num_'+old_status] -= 1
+        delta['num_tot'] -= 1
+    if new_status is not None:
+        delta['num_'+new_status] += 1
+        delta['num_tot'] += 1
+    return {field: value for field, value in delta.items() if value}
+
+
 def combined_status_stats(queryset):
     aggregations = queryset.get_aggregation_results()
     status = aggregations.get('status', {'buckets':[]})
@@ -156,6 +226,18 @@ class BareAccessStatistics(object):
             setattr(stats, attrname, getattr(stats, attrname) + 1)
         return stats
 
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        :param counts: a dictionary mapping some of the
+            :py:obj:`STATS_FIELDS` to their values (missing or
+            `None` values are considered as zero)
+        """
+        stats = cls.new()
+        for field in STATS_FIELDS:
+            setattr(stats, field, counts.get(field) or 0)
+        return stats
+
     @classmethod
     def from_dict(cls, d):
         stats = cls.new()
@@ -253,21 +335,117 @@ class AccessStatistics(models.Model, BareAccessStatistics):
         """
         Updates the statistics for papers contained in the given :py:class:`Paper` queryset
         """
-        queryset = queryset.filter(visible=True)
-        for key, modifier in STATUS_QUERYSET_FILTER.items():
-            self.__dict__['num_'+key] = modifier(queryset).count()
-        self.num_tot = queryset.count()
+        counts = queryset.filter(visible=True).aggregate(**status_aggregates())
+        for field in STATS_FIELDS:
+            setattr(self, field, counts[field])
         self.save()
 
+    @classmethod
+    def increment(cls, stats_ids, delta):
+        """
+        Atomically applies a delta (see :py:func:`status_delta`) to some
+        statistics, with `F()` expressions.
+
+        :param stats_ids: the ids of the statistics to update. An id can
+            be repeated, in which case the delta is applied as many times.
+            `None` values are ignored.
+        :param delta: a dictionary mapping fields to increments
+        """
+        if not delta:
+            return
+        multiplicities = defaultdict(list)
+        for stats_id, count in Counter(stats_ids).items():
+            if stats_id is not None:
+                multiplicities[count].append(stats_id)
+        for count, ids in multiplicities.items():
+            cls.objects.filter(pk__in=ids).update(**{
+                field: F(field) + count*value
+                for field, value in delta.items()
+            })
+
+    @classmethod
+    def count_by_group(cls, queryset, group_by):
+        """
+        Computes the statistics of the visible papers of a queryset,
+        for each value of a lookup, in a single GROUP BY query.
+
+        :param queryset: a queryset of :py:class:`Paper`
+        :param group_by: the lookup to group the papers by, for instance
+            `'oairecord__publisher'`
+        :returns: a dictionary mapping the values of the lookup
+            to :py:class:`BareAccessStatistics`
+        """
+        rows = (queryset.filter(visible=True)
+                .values(group_by)
+                .annotate(**status_aggregates(distinct=True))
+                .order_by())
+        return {row[group_by]: BareAccessStatistics.from_counts(row)
+                for row in rows if row[group_by] is not None}
+
+    @classmethod
+    def sum_by_group(cls, queryset, group_by):
+        """
+        Sums the statistics of the objects of a queryset (which
+        must have a `stats` field), for each value of a lookup,
+        in a single GROUP BY query.
+
+        :returns: a dictionary mapping the values of the lookup
+            to :py:class:`BareAccessStatistics`
+        """
+        rows = (queryset
+                .values(group_by)
+                .annotate(**{field: Sum('stats__'+field)
+                             for field in STATS_FIELDS})
+                .order_by())
+        return {row[group_by]: BareAccessStatistics.from_counts(row)
+                for row in rows if row[group_by] is not None}
+
+    @classmethod
+    def save_all_stats(cls, _class, stats):
+        """
+        Writes the statistics of all instances of a model in bulk.
+
+        :param _class: the model, which must have a `stats` field
+        :param stats: a dictionary mapping primary keys of the model to
+            :py:class:`BareAccessStatistics`. Instances missing from
+            this dictionary get empty statistics.
+        :returns: the number of statistics which had to be changed
+        """
+        to_update = []
+        rows = _class.objects.values_list(
+            'pk', 'stats_id', *['stats__'+field for field in STATS_FIELDS])
+        for row in rows.iterator():
+            pk, stats_id, old_values = row[0], row[1], row[2:]
+            if stats_id is None:
+                stats_id = cls.objects.create().pk
+                _class.objects.filter(pk=pk).update(stats_id=stats_id)
+            record = cls(pk=stats_id)
+            record.clear()
+            record.add(stats.get(pk) or BareAccessStatistics.new())
+            new_values = tuple(getattr(record, field) for field in STATS_FIELDS)
+            if new_values != old_values:
+                to_update.append(record)
+        if to_update:
+            bulk_update(to_update, update_fields=STATS_FIELDS, batch_size=1000)
+        return len(to_update)
+
     @classmethod
     def update_all_stats(self, _class):
         """
         Update all statistics for the objects of a given class.
-        This calls the underlying :py:meth:`!update_stats()` function for each instance
-        of the model.
+        If the model provides a :py:meth:`!compute_all_stats()` class method
+        (computing the statistics of all its instances at once), they are
+        written back in bulk. Otherwise, this calls the underlying
+        :py:meth:`!update_stats()` function for each instance of the model.
+
+        :returns: in grouped mode, the number of statistics which had
+            to be changed (`None` otherwise)
         """
-        for x in _class.objects.all():
-            x.update_stats()
+        if hasattr(_class, 'compute_all_stats'):
+            return self.save_all_stats(_class, _class.compute_all_stats())
+        else:
+            for x in _class.objects.all():
+                x.update_stats()
 
     class Meta:
         db_table = 'papers_accessstatistics'
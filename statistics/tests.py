@@ -20,12 +20,17 @@
 Tests statistics update and statistics consistency.
 """
 
+from statistics.models import AccessStatistics
 from statistics.models import BareAccessStatistics
+from statistics.models import STATS_FIELDS
 
 from backend.orcid import OrcidPaperSource
 from backend.tests import PrefilledTest
+from papers.models import Department
 from papers.models import Paper
 from papers.models import PaperWorld
+from papers.models import Researcher
+from publishers.models import Publisher
 
 
 class StatisticsTest(PrefilledTest):
@@ -73,5 +78,76 @@ class StatisticsTest(PrefilledTest):
         pw.update_stats()
         self.validStats(pw.stats)
 
-# TODO check journal and publisher stats
+    def test_update_all_stats(self):
+        publisher = Publisher.objects.filter(
+            oairecord__about__visible=True).first()
+        AccessStatistics.update_all_stats(Publisher)
+        grouped = Publisher.objects.get(pk=publisher.pk).stats
+        self.assertTrue(grouped.check_values())
+        publisher.update_stats()
+        for field in STATS_FIELDS:
+            self.assertEqual(getattr(grouped, field),
+                             getattr(publisher.stats, field))
+
+    def test_update_all_stats_researchers(self):
+        self.r3.update_stats()
+        expected = self.r3.stats
+        AccessStatistics.objects.filter(pk=expected.pk).update(num_tot=0)
+        AccessStatistics.update_all_stats(Researcher)
+        grouped = Researcher.objects.get(pk=self.r3.pk).stats
+        for field in STATS_FIELDS:
+            self.assertEqual(getattr(grouped, field),
+                             getattr(expected, field))
+
+    def test_update_all_stats_departments(self):
+        self.r3.department = self.d
+        self.r3.save()
+        AccessStatistics.update_all_stats(Department)
+        self.validStats(Department.objects.get(pk=self.d.pk).stats)
+
+    def test_incremental_update(self):
+        self.r3.department = self.d
+        self.r3.save()
+        self.r3.update_stats()
+        self.d.update_stats()
+        paper = self.r3.papers.filter(visible=True, pdf_url__isnull=True).first()
+        paper.pdf_url = 'http://my.repository.edu/paper.pdf'
+        paper.save()
+        paper.visible = False
+        paper.save(update_fields=['visible'])
+
+        incremental = Researcher.objects.get(pk=self.r3.pk).stats
+        department = Department.objects.get(pk=self.d.pk).stats
+        self.r3.update_stats()
+        self.d.update_stats()
+        for field in STATS_FIELDS:
+            self.assertEqual(getattr(incremental, field),
+                             getattr(self.r3.stats, field))
+            self.assertEqual(getattr(department, field),
+                             getattr(self.d.stats, field))
+
+    def test_change_publisher_oa_status(self):
+        publisher = Publisher.objects.filter(
+            oairecord__about__authors_list__contains=[
+                {'researcher_id': self.r3.id}],
+            oairecord__about__visible=True).first()
+        self.r3.update_stats()
+        publisher.update_stats()
+        new_status = 'NOK' if publisher.oa_status == 'OA' else 'OA'
+        publisher.change_oa_status(new_status)
+
+        papers = Paper.objects.filter(oairecord__publisher=publisher)
+        if new_status == 'OA':
+            self.assertTrue(all(p.oa_status == 'OA' for p in papers))
+        incremental = Researcher.objects.get(pk=self.r3.pk).stats
+        incremental_publisher = Publisher.objects.get(pk=publisher.pk).stats
+        self.r3.update_stats()
+        publisher.update_stats()
+        for field in STATS_FIELDS:
+            self.assertEqual(getattr(incremental, field),
+                             getattr(self.r3.stats, field))
+            self.assertEqual(getattr(incremental_publisher, field),
+                             getattr(publisher.stats, field))
+
+# TODO check journal stats
 # TODO check that (for instance) department stats add up to institution stats